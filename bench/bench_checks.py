@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+########################################################################
+# bench_checks - Benchmarks for the check_mssql plugins
+#
+# Runs the plugins against the stand-in driver in bench/fakedriver, so
+# no SQL Server is needed, and reports:
+#
+#   * end-to-end latency of one plugin process per check
+#   * in-process latency of a check once the interpreter is running
+#   * delta state store read/write cost
+#   * threshold range evaluation cost
+#   * --modes batch versus one process per mode
+#   * check_mssql_fleet.py throughput
+#
+# Compare the numbers before and after a change, e.g.
+#   python bench/bench_checks.py --runs 20 > bench_output.txt
+########################################################################
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+DRIVER_DIR = os.path.join(BENCH_DIR, 'fakedriver')
+
+sys.path.insert(0, PLUGIN_DIR)
+sys.path.insert(0, DRIVER_DIR)
+
+import mssql_common
+import check_mssql_server
+import check_mssql_database
+
+CREDENTIALS = ['-U', 'bench', '-P', 'bench']
+
+END_TO_END = [
+    ('server time2connect', 'check_mssql_server.py', ['--time2connect']),
+    ('server standard', 'check_mssql_server.py', ['--pagelife', '-w', '300:', '-c', '100:']),
+    ('server divide', 'check_mssql_server.py', ['--bufferhitratio', '-w', '95:', '-c', '90:']),
+    ('server delta', 'check_mssql_server.py', ['--batchreq', '-w', '5000', '-c', '10000']),
+    ('server --modes all', 'check_mssql_server.py', ['--modes', 'all']),
+    ('database delta', 'check_mssql_database.py', ['-T', 'appdb001', '--transpsec', '-w', '5000', '-c', '10000']),
+    ('database --all-databases', 'check_mssql_database.py', ['--all-databases', '--logfileusage', '-w', '80', '-c', '90']),
+]
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def report(name, samples, unit='ms', scale=1000.0):
+    print('%-40s %10.3f %10.3f %s' % (name, percentile(samples, 0.5) * scale, percentile(samples, 0.95) * scale, unit))
+
+def header(title):
+    print('')
+    print(title)
+    print('%-40s %10s %10s' % ('', 'median', 'p95'))
+
+def plugin_env(options):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([DRIVER_DIR, PLUGIN_DIR, env.get('PYTHONPATH', '')])
+    env['FAKE_PYMSSQL_CONNECT_MS'] = str(options.connect_ms)
+    env['FAKE_PYMSSQL_QUERY_MS'] = str(options.query_ms)
+    env['FAKE_PYMSSQL_DATABASES'] = str(options.databases)
+    return env
+
+def run_plugin(script, args, env):
+    start = time.time()
+    devnull = open(os.devnull, 'w')
+    try:
+        subprocess.call([sys.executable, os.path.join(PLUGIN_DIR, script)] + args, env=env, stdout=devnull, stderr=devnull)
+    finally:
+        devnull.close()
+    return time.time() - start
+
+def bench_end_to_end(options, env):
+    header('End-to-end plugin process per check (ms)')
+    for name, script, args in END_TO_END:
+        samples = [run_plugin(script, ['-H', 'bench-e2e'] + CREDENTIALS + args, env) for _ in range(options.runs)]
+        report(name, samples)
+
+def run_in_process(module, args):
+    sys.argv = [module.__name__] + args
+    start = time.time()
+    try:
+        module.main()
+    except module.NagiosReturn:
+        pass
+    return time.time() - start
+
+def bench_in_process(options):
+    header('In-process check, interpreter already running (ms)')
+    os.environ['FAKE_PYMSSQL_CONNECT_MS'] = str(options.connect_ms)
+    os.environ['FAKE_PYMSSQL_QUERY_MS'] = str(options.query_ms)
+    os.environ['FAKE_PYMSSQL_DATABASES'] = str(options.databases)
+    argv = sys.argv
+    try:
+        for name, script, args in END_TO_END:
+            module = script.startswith('check_mssql_server') and check_mssql_server or check_mssql_database
+            args = ['-H', 'bench-inproc'] + CREDENTIALS + args
+            run_in_process(module, args)
+            samples = [run_in_process(module, args) for _ in range(options.runs * 5)]
+            report(name, samples)
+    finally:
+        sys.argv = argv
+
+def bench_state(options):
+    header('Delta state store (us per operation)')
+    for entries in (1, 100, 1000):
+        store = mssql_common.StateStore('bench-state-%d' % entries).open()
+        for i in range(entries):
+            store.set('key%d' % i, time.time(), i)
+        store.close()
+        samples = []
+        for i in range(options.runs * 10):
+            start = time.time()
+            store = mssql_common.StateStore('bench-state-%d' % entries).open()
+            store.get('key0')
+            store.set('key0', time.time(), i)
+            store.close()
+            samples.append(time.time() - start)
+        report('open/get/set/close, %d entries' % entries, samples, 'us', 1000000.0)
+    samples = []
+    query = bench_query('batchreq', 'bench-state-delta')
+    for i in range(options.runs * 10):
+        query.query_result = i * 1000
+        start = time.time()
+        query.calculate_result()
+        samples.append(time.time() - start)
+    report('MSSQLDeltaQuery.calculate_result', samples, 'us', 1000000.0)
+    samples = []
+    query = bench_query('waitstats', 'bench-state-waits')
+    for i in range(options.runs * 10):
+        #~ A full sys.dm_os_wait_stats snapshot, about 1000 wait types
+        query.query_result = [(i * 60000 + 1000, 0, 'WAIT_TYPE_%04d' % n, i * n, i) for n in range(1000)]
+        start = time.time()
+        query.calculate_result()
+        samples.append(time.time() - start)
+    report('MSSQLWaitStatsQuery, 1000 wait types', samples, 'us', 1000000.0)
+    samples = []
+    query = bench_query('filelatency', 'bench-state-files')
+    for i in range(options.runs * 10):
+        #~ sys.dm_io_virtual_file_stats of a large instance, 2500 databases with two files each
+        query.query_result = [(i * 60000 + 1000, 0, n // 2 + 1, n % 2 + 1, 'db%04d' % (n // 2), 'file%d' % n,
+                               i * n, i * n * 8192, i * n * 4, i * n, i * n * 65536, i * n) for n in range(5000)]
+        start = time.time()
+        query.calculate_result()
+        samples.append(time.time() - start)
+    report('MSSQLFileStatsQuery, 5000 files', samples, 'us', 1000000.0)
+
+def bench_query(mode, host):
+    #~ Options parsed like a real check, so every option the query reads has its default
+    options = check_mssql_server.parse_args(['-H', host] + CREDENTIALS + ['--%s' % mode, '-w', '300:', '-c', '100:'])
+    return check_mssql_server.make_query(mode, options, host)
+
+def bench_thresholds(options):
+    header('Threshold evaluation (us)')
+    ranges = ['10', '10:', '~:10', '10:20', '@10:20', '1.5:2.5']
+    samples = []
+    for _ in range(options.runs * 10):
+        mssql_common.RANGES.clear()
+        start = time.time()
+        for nagstring in ranges:
+            mssql_common.parse_range(nagstring)
+        samples.append((time.time() - start) / len(ranges))
+    report('parse one range, uncached', samples, 'us', 1000000.0)
+    samples = []
+    for _ in range(options.runs * 10):
+        start = time.time()
+        check_mssql_server.get_state(250.0, '300:', '100:')
+        samples.append(time.time() - start)
+    report('get_state, one value', samples, 'us', 1000000.0)
+    values = [float(i % 500) for i in range(10000)]
+    samples = []
+    for _ in range(options.runs):
+        start = time.time()
+        check_mssql_server.get_states(values, '300:', '100:')
+        samples.append(time.time() - start)
+    report('get_states, 10000 values', samples, 'us', 1000000.0)
+
+def bench_batch(options, env):
+    header('Every server mode: --modes all versus one process per mode (ms)')
+    modes = [k for k in check_mssql_server.MODES if k != 'test']
+    batch = [run_plugin('check_mssql_server.py', ['-H', 'bench-batch'] + CREDENTIALS + ['--modes', 'all'], env)
+             for _ in range(options.runs)]
+    report('--modes all, %d modes' % len(modes), batch)
+    single = []
+    for _ in range(max(1, options.runs // 5)):
+        start = time.time()
+        for mode in modes:
+            run_plugin('check_mssql_server.py', ['-H', 'bench-batch'] + CREDENTIALS + ['--%s' % mode], env)
+        single.append(time.time() - start)
+    report('%d single mode processes' % len(modes), single)
+
+def bench_fleet(options, env):
+    header('check_mssql_fleet.py, %d hosts (ms per run)' % options.hosts)
+    workdir = tempfile.mkdtemp(prefix='mssql-bench-')
+    try:
+        inventory = os.path.join(workdir, 'inventory.ini')
+        inv = open(inventory, 'w')
+        inv.write('[DEFAULT]\nuser = bench\npassword = bench\nmodes = all\n\n')
+        for i in range(options.hosts):
+            inv.write('[host%04d]\nhostname = bench-fleet-%04d\n\n' % (i, i))
+        inv.close()
+        for workers in (1, 8, 32):
+            samples = [run_plugin('check_mssql_fleet.py', ['-i', inventory, '--workers', str(workers),
+                                                           '--command-file', os.path.join(workdir, 'nagios.cmd')], env)
+                       for _ in range(max(1, options.runs // 5))]
+            report('%d workers' % workers, samples)
+            print('%-40s %10.1f hosts/s' % ('', options.hosts / percentile(samples, 0.5)))
+    finally:
+        shutil.rmtree(workdir)
+
+def parse_args():
+    parser = OptionParser(usage="usage: %prog [--runs n] [--connect-ms ms] [--query-ms ms]")
+    parser.add_option('--runs', type='int', help='Samples per measurement.', default=10)
+    parser.add_option('--connect-ms', type='float', help='Simulated login latency.', default=5)
+    parser.add_option('--query-ms', type='float', help='Simulated query latency.', default=1)
+    parser.add_option('--databases', type='int', help='Simulated user databases.', default=50)
+    parser.add_option('--hosts', type='int', help='Hosts in the fleet inventory.', default=100)
+    parser.add_option('--only', help='Comma separated subset: e2e,inproc,state,thresholds,batch,fleet', default=None)
+    options, _ = parser.parse_args()
+    return options
+
+def main():
+    options = parse_args()
+    #~ Keep the state files of the benchmark hosts out of the real temp directory
+    scratch = tempfile.mkdtemp(prefix='mssql-bench-')
+    os.environ['TMPDIR'] = scratch
+    tempfile.tempdir = scratch
+    env = plugin_env(options)
+    benches = [
+        ('e2e', lambda: bench_end_to_end(options, env)),
+        ('inproc', lambda: bench_in_process(options)),
+        ('state', lambda: bench_state(options)),
+        ('thresholds', lambda: bench_thresholds(options)),
+        ('batch', lambda: bench_batch(options, env)),
+        ('fleet', lambda: bench_fleet(options, env)),
+    ]
+    only = options.only and options.only.split(',')
+    print('python %s, login %sms, query %sms, %d databases' % (sys.version.split()[0], options.connect_ms,
+                                                            options.query_ms, options.databases))
+    try:
+        for name, bench in benches:
+            if not only or name in only:
+                bench()
+    finally:
+        shutil.rmtree(scratch)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,517 @@
+########################################################################
+# Stand-in for the pymssql DB-API driver used by the benchmarks.
+#
+# Put this directory first on PYTHONPATH and the plugins will import it
+# instead of pymssql. It answers the queries the plugins send from an
+# in-memory copy of sysperfinfo and the DMVs they read. Behaviour is set
+# with environment variables:
+#
+#   FAKE_PYMSSQL_CONNECT_MS   login latency in milliseconds (default 0)
+#   FAKE_PYMSSQL_QUERY_MS     latency per cursor.execute (default 0)
+#   FAKE_PYMSSQL_DATABASES    number of user databases (default 4)
+#   FAKE_PYMSSQL_DOWN_HOSTS   comma separated hosts that refuse logins
+#   FAKE_PYMSSQL_PASSWORD     the only password logins succeed with (default any)
+#   FAKE_PYMSSQL_INSTANCE     named instance used in object_name prefixes
+#   FAKE_PYMSSQL_QUERY_LOG    file every executed query is appended to
+#   FAKE_PYMSSQL_MISSING      comma separated counters left out of sysperfinfo
+#   FAKE_PYMSSQL_VERSION      product version reported by SERVERPROPERTY
+#   FAKE_PYMSSQL_SESSIONS     number of user sessions (default 200)
+#   FAKE_PYMSSQL_PLAN_CACHE   file keeping the cached plans across runs
+#   FAKE_PYMSSQL_INDEXES      number of indexes in the checked database (default 200)
+########################################################################
+
+import os
+import re
+import time
+
+apilevel = '2.0'
+paramstyle = 'pyformat'
+
+class Error(Exception):
+    pass
+
+class InterfaceError(Error):
+    pass
+
+class DatabaseError(Error):
+    pass
+
+class OperationalError(DatabaseError):
+    pass
+
+class ProgrammingError(DatabaseError):
+    pass
+
+#~ Counters grow from a fixed start so consecutive plugin runs see real rates
+START_TIME = float(os.environ.get('FAKE_PYMSSQL_START', time.time() // 86400 * 86400))
+#~ The OS booted an hour before SQL Server started, ms_ticks counts from the boot
+BOOT_TIME = START_TIME - 3600
+
+def env_float(name, default=0):
+    return float(os.environ.get(name, default))
+
+def object_prefix():
+    instance = os.environ.get('FAKE_PYMSSQL_INSTANCE')
+    if instance:
+        return 'MSSQL$%s:' % instance
+    return 'SQLServer:'
+
+#~ (object, counter, instance, base value, increase per second)
+SERVER_COUNTERS = [
+    ('Buffer Manager', 'Buffer cache hit ratio', '', 990, 0),
+    ('Buffer Manager', 'Buffer cache hit ratio base', '', 1000, 0),
+    ('Buffer Manager', 'Page lookups/sec', '', 100000, 5000),
+    ('Buffer Manager', 'Free pages', '', 2048, 0),
+    ('Buffer Manager', 'Total pages', '', 262144, 0),
+    ('Buffer Manager', 'Target pages', '', 262144, 0),
+    ('Buffer Manager', 'Database pages', '', 200000, 0),
+    ('Buffer Manager', 'Stolen pages', '', 40000, 0),
+    ('Buffer Manager', 'Lazy writes/sec', '', 1000, 2),
+    ('Buffer Manager', 'Readahead pages/sec', '', 5000, 40),
+    ('Buffer Manager', 'Page reads/sec', '', 20000, 80),
+    ('Buffer Manager', 'Checkpoint pages/sec', '', 3000, 10),
+    ('Buffer Manager', 'Page writes/sec', '', 9000, 30),
+    ('Buffer Manager', 'Page life expectancy', '', 3600, 0),
+    ('Locks', 'Lock Requests/sec', '_Total', 500000, 3000),
+    ('Locks', 'Lock Timeouts/sec', '_Total', 10, 0),
+    ('Locks', 'Number of Deadlocks/sec', '_Total', 2, 0),
+    ('Locks', 'Lock Waits/sec', '_Total', 300, 1),
+    ('Locks', 'Lock Wait Time (ms)', '_Total', 4500, 10),
+    ('Locks', 'Average Wait Time (ms)', '_Total', 4500, 10),
+    ('Locks', 'Average Wait Time Base', '_Total', 300, 1),
+    ('Access Methods', 'Page Splits/sec', '', 4000, 5),
+    ('Access Methods', 'Full Scans/sec', '', 8000, 12),
+    ('Plan Cache', 'Cache Hit Ratio', '_Total', 950, 0),
+    ('Plan Cache', 'Cache Hit Ratio Base', '_Total', 1000, 0),
+    ('SQL Statistics', 'Batch Requests/sec', '', 250000, 1500),
+    ('SQL Statistics', 'SQL Compilations/sec', '', 20000, 90),
+]
+
+DATABASE_COUNTERS = [
+    ('Databases', 'Log Cache Hit Ratio', 60, 0),
+    ('Databases', 'Log Cache Hit Ratio Base', 100, 0),
+    ('Databases', 'Active Transactions', 3, 0),
+    ('Databases', 'Log Flushes/sec', 5000, 20),
+    ('Databases', 'Percent Log Used', 35, 0),
+    ('Databases', 'Transactions/sec', 90000, 150),
+    ('Databases', 'Log Growths', 4, 0),
+    ('Databases', 'Log Shrinks', 0, 0),
+    ('Databases', 'Log Truncations', 120, 0),
+    ('Databases', 'Log Flush Wait Time', 2, 0),
+    ('Databases', 'Data File(s) Size (KB)', 1048576, 0),
+]
+
+def database_names():
+    names = ['master', 'tempdb', 'model', 'msdb']
+    names.extend(['appdb%03d' % i for i in range(int(env_float('FAKE_PYMSSQL_DATABASES', 4)))])
+    return names
+
+def perf_rows():
+    #~ (object_name, counter_name, instance_name, cntr_value), values grow with time
+    elapsed = time.time() - START_TIME
+    prefix = object_prefix()
+    rows = []
+    missing = os.environ.get('FAKE_PYMSSQL_MISSING', '').lower().split(',')
+    for obj, counter, instance, base, rate in SERVER_COUNTERS:
+        if counter.lower() in missing:
+            continue
+        rows.append((prefix + obj, counter, instance, int(base + rate * elapsed)))
+    databases = database_names()
+    for obj, counter, base, rate in DATABASE_COUNTERS:
+        if counter.lower() in missing:
+            continue
+        for i, database in enumerate(databases):
+            rows.append((prefix + obj, counter, database, int(base + i + rate * elapsed)))
+        rows.append((prefix + obj, counter, '_Total', int(base * len(databases) + rate * elapsed)))
+    return rows
+
+def unquote(literal):
+    return literal[1:-1].replace("''", "'")
+
+def like(value, pattern):
+    #~ % and _ are wildcards, [x] is x itself as like_escape writes it
+    regex = ''
+    for part in re.findall(r"\[[^]]\]|.", pattern):
+        if part == '%':
+            regex += '.*'
+        elif part == '_':
+            regex += '.'
+        else:
+            regex += re.escape(part[1] if len(part) == 3 else part)
+    return re.match('^%s$' % regex, value, re.I | re.S) is not None
+
+def split_top(where, word):
+    #~ Splits on word outside parentheses and literals
+    parts = ['']
+    depth = 0
+    quoted = False
+    i = 0
+    while i < len(where):
+        char = where[i]
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and where[i:i + len(word)].upper() == word:
+            parts.append('')
+            i += len(word)
+            continue
+        parts[-1] += char
+        i += 1
+    return [part.strip() for part in parts]
+
+def unparen(term):
+    #~ Drops parentheses around the whole term, not those of (a) AND (b)
+    while term.startswith('(') and term.endswith(')'):
+        depth = 0
+        quoted = False
+        for i, char in enumerate(term):
+            if char == "'":
+                quoted = not quoted
+            elif not quoted and char == '(':
+                depth += 1
+            elif not quoted and char == ')':
+                depth -= 1
+                if depth == 0 and i < len(term) - 1:
+                    return term
+        term = term[1:-1].strip()
+    return term
+
+def counter_list(xml):
+    #~ The <c>pattern</c> values of an xml parameter, see mssql_common.counter_patterns
+    return [value.replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&')
+            for value in re.findall(r"<c>(.*?)</c>", unquote(xml), re.S)]
+
+def row_filter(where):
+    #~ Understands the predicates the plugins use against sysperfinfo: OR of ANDs of the terms below
+    def value_of(row, column):
+        return {'object_name' : row[0], 'counter_name' : row[1], 'instance_name' : row[2]}[column.lower()]
+
+    def term_test(term):
+        term = unparen(term)
+        exists = re.match(r"EXISTS \(SELECT 1 FROM N?('(?:[^']|'')*')\.nodes\(.*\bLIKE\b", term, re.S)
+        if exists:
+            patterns = counter_list(exists.group(1))
+            return lambda row: any(like(row[1], pattern) for pattern in patterns)
+        in_list = re.match(r"(\w+)\s+IN\s*\((.*)\)$", term, re.S)
+        if in_list:
+            names = [unquote(x).lower() for x in re.findall(r"'(?:[^']|'')*'", in_list.group(2))]
+            return lambda row: value_of(row, in_list.group(1)).lower() in names
+        compare = re.match(r"(\w+)\s*(=|<>|LIKE)\s*N?('(?:[^']|'')*')$", term, re.S)
+        if compare:
+            column, operator, literal = compare.group(1), compare.group(2), unquote(compare.group(3))
+            if operator == '=':
+                return lambda row: value_of(row, column).lower() == literal.lower()
+            if operator == '<>':
+                return lambda row: value_of(row, column).lower() != literal.lower()
+            return lambda row: like(value_of(row, column), literal)
+        if term.startswith('(') or ' OR ' in term.upper() or ' AND ' in term.upper():
+            return row_filter(term)
+        return lambda row: True
+
+    alternatives = [[term_test(term) for term in split_top(unparen(alternative), ' AND ')]
+                    for alternative in split_top(unparen(where), ' OR ')] if where.strip() else [[]]
+
+    def match(row):
+        return any(all(test(row) for test in tests) for tests in alternatives)
+    return match
+
+def cntr_type(counter):
+    #~ A plausible cntr_type for the counter names used here
+    name = counter.lower()
+    if name.endswith(' base'):
+        return 1073939712
+    if name.startswith('average '):
+        return 1073874176
+    if name.endswith('/sec') or name.endswith('(ms)'):
+        return 272696576
+    if name.endswith('ratio'):
+        return 537003264
+    return 65792
+
+def select_columns(select, row):
+    columns = []
+    for column in [c.strip() for c in select.split(',')]:
+        name = re.sub(r'^RTRIM\((\w+)\)$', r'\1', column).lower()
+        if name == 'cntr_type':
+            columns.append(cntr_type(row[1]))
+            continue
+        columns.append({'object_name' : row[0], 'counter_name' : row[1],
+                        'instance_name' : row[2], 'cntr_value' : row[3]}.get(name, row[3]))
+    return tuple(columns)
+
+def order_last(rows, order):
+    #~ ORDER BY CASE WHEN counter_name=N'...' THEN 1 ELSE 0 END puts that counter last
+    last = re.search(r"counter_name\s*=\s*N?('(?:[^']|'')*')", order)
+    if not last:
+        return rows
+    name = unquote(last.group(1)).lower()
+    return sorted(rows, key=lambda row: row[1].lower() == name)
+
+#~ (wait type, wait ms per second, share of it that is signal wait)
+WAITS = [
+    ('PAGEIOLATCH_SH', 120, 0.05),
+    ('WRITELOG', 40, 0.1),
+    ('LCK_M_X', 15, 0.01),
+    ('SOS_SCHEDULER_YIELD', 30, 1.0),
+    ('ASYNC_NETWORK_IO', 8, 0.02),
+    ('CXPACKET', 25, 0.2),
+    ('LAZYWRITER_SLEEP', 1000, 0.0),
+    ('SLEEP_TASK', 900, 0.0),
+    ('XE_TIMER_EVENT', 500, 0.0),
+    ('MSQL_XP', 0, 0.0),
+]
+
+def wait_rows():
+    ms_ticks = int((time.time() - BOOT_TIME) * 1000)
+    start_ticks = int((START_TIME - BOOT_TIME) * 1000)
+    elapsed = time.time() - START_TIME
+    rows = []
+    for wait_type, rate, signal in WAITS:
+        wait = int(rate * elapsed)
+        if wait > 0:
+            rows.append((ms_ticks, start_ticks, wait_type, wait, int(wait * signal)))
+    return rows
+
+def file_rows():
+    #~ A data and a log file per database; tempdb is slower than the rest
+    ms_ticks = int((time.time() - BOOT_TIME) * 1000)
+    start_ticks = int((START_TIME - BOOT_TIME) * 1000)
+    elapsed = time.time() - START_TIME
+    rows = []
+    for database_id, database in enumerate(database_names()):
+        slow = database == 'tempdb' and 5 or 1
+        for file_id, name, reads, writes in ((1, database, 20, 5), (2, database + '_log', 1, 10)):
+            num_reads, num_writes = int(reads * elapsed), int(writes * elapsed)
+            rows.append((ms_ticks, start_ticks, database_id + 1, file_id, database, name,
+                         num_reads, num_reads * 8192, num_reads * 4 * slow,
+                         num_writes, num_writes * 65536, num_writes * slow))
+    return rows
+
+#~ sys.dm_exec_sessions columns the plugins group on, and the session they read them from
+SESSION_COLUMNS = {
+    's.login_name'              : 0,
+    's.host_name'               : 1,
+    's.program_name'            : 2,
+    'DB_NAME(s.database_id)'    : 3,
+    's.status'                  : 4,
+}
+
+def sessions():
+    #~ (login, host, program, database, status, has a request); web01 leaks pooled connections
+    rows = []
+    for n in range(int(env_float('FAKE_PYMSSQL_SESSIONS', 200))):
+        host = n % 3 and 'web%02d' % (n % 5) or 'web01'
+        program = host == 'web01' and '.Net SqlClient Data Provider' or 'app'
+        active = n % 7 == 0
+        rows.append(('app_user', host, program, 'appdb%03d' % (n % 2), active and 'running' or 'sleeping', active))
+    rows.append(('sa', 'dbadmin', 'SQLCMD', 'master', 'running', True))
+    return rows
+
+def session_rows(query):
+    if 'GROUP BY' not in query:
+        return [(len(sessions()),)]
+    top = int(re.search(r"TOP \(?(\d+)", query).group(1))
+    columns = [SESSION_COLUMNS[c.strip()] for c in re.search(r"GROUP BY (.*?) ORDER BY", query).group(1).split(', ')]
+    groups = {}
+    for session in sessions():
+        key = tuple([session[c] for c in columns])
+        count, active = groups.get(key, (0, 0))
+        groups[key] = (count + 1, active + session[5])
+    total = sum([count for count, _ in groups.values()])
+    total_active = sum([active for _, active in groups.values()])
+    ordered = sorted(groups.items(), key=lambda g: -g[1][0])[:top]
+    return [key + (count, active, total, len(groups), total_active) for key, (count, active) in ordered]
+
+def ring_buffer_rows(query):
+    #~ One scheduler monitor record per minute since boot, (timestamp, process, idle)
+    ms_ticks = int((time.time() - BOOT_TIME) * 1000)
+    since = int(re.search(r"\[timestamp\] > (\d+) OR", query).group(1))
+    window = int(re.search(r"\[timestamp\] > i\.ms_ticks - (\d+)", query).group(1))
+    if since > ms_ticks:
+        since = 0
+    rows = []
+    for timestamp in range(ms_ticks - ms_ticks % 60000, max(since, ms_ticks - window), -60000):
+        minute = timestamp // 60000
+        rows.append((timestamp, 10 + minute % 7, 80 - minute % 5))
+    return rows
+
+def indexes():
+    #~ (object_id, index_id, name, pages) of a database with tables of very different sizes
+    rows = []
+    for n in range(int(env_float('FAKE_PYMSSQL_INDEXES', 200))):
+        object_id = 1000 + n // 3
+        rows.append((object_id, n % 3 + 1, 'dbo.table%04d.ix%d' % (object_id, n % 3 + 1), n * 7919 % 250000 + 100))
+    return rows
+
+def index_rows(query):
+    pages = int(re.search(r"HAVING SUM\(ps\.used_page_count\) >= (\d+)", query).group(1))
+    return [row for row in indexes() if row[3] >= pages]
+
+def fragmentation_rows(query):
+    object_id, index_id = [int(x) for x in re.search(r"DB_ID\(\), (\d+), (\d+),", query).groups()]
+    for row in indexes():
+        if row[:2] == (object_id, index_id):
+            return [((object_id * 31 + index_id * 17) % 1000 / 10.0, row[3])]
+    return [(None, None)]
+
+def quote(value):
+    #~ As pymssql quotes parameters: numbers as they are, text as an N'' literal
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "N'%s'" % value.replace("'", "''")
+
+def unwrap(query):
+    #~ EXEC sp_executesql N'statement'[, N'declarations', @name=value, ...] with the values put back
+    match = re.match(r"EXEC sp_executesql N'((?:[^']|'')*)'(?:, N'((?:[^']|'')*)'(.*?))?;?$", query, re.S)
+    if not match:
+        return query, query
+    statement = match.group(1).replace("''", "'")
+    values = dict(re.findall(r"@(\w+)=(N?'(?:[^']|'')*'|[-\d.]+|NULL)", match.group(3) or ''))
+    plan = '(%s)%s' % (match.group(2) or '', statement)
+    statement = re.sub(r'@(\w+)', lambda m: values.get(m.group(1), m.group(0)), statement)
+    #~ counter_name LIKE N'Cache Hit Ratio' + N'%' becomes one literal
+    statement = re.sub(r"'\s*\+\s*N'", '', statement)
+    return re.sub(r'^/\*.*?\*/\s*', '', statement), plan
+
+def plan_cache(*plans_used):
+    #~ Like the server, one cached plan per kind and distinct statement text, counting its uses
+    import json
+    filename = os.environ.get('FAKE_PYMSSQL_PLAN_CACHE')
+    plans = PLANS
+    if filename and os.path.exists(filename):
+        plans = json.load(open(filename))
+    for plan in plans_used:
+        plans[plan] = plans.get(plan, 0) + 1
+    if plans_used and filename:
+        json.dump(plans, open(filename, 'w'))
+    return plans
+
+PLANS = {}
+
+def plan_rows(query):
+    tag = re.search(r"LIKE N'%((?:[^']|'')*)%'", query)
+    rows = []
+    for objtype, size in (('Adhoc', 16384), ('Prepared', 40960)):
+        uses = [count for plan, count in plan_cache().items()
+                if plan.startswith(objtype + ':') and (not tag or tag.group(1) in plan)]
+        if uses:
+            rows.append((objtype, len(uses), sum(uses), len([count for count in uses if count == 1]), len(uses) * size))
+    return rows
+
+class Cursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        if params is not None:
+            query = query % tuple([quote(value) for value in params])
+        batch = query
+        query, plan = unwrap(query)
+        if plan == batch:
+            plan_cache('Adhoc:' + batch)
+        else:
+            #~ The EXEC batch with its values is cached as well, apart from the prepared statement
+            plan_cache('Adhoc:' + batch, 'Prepared:' + plan)
+        delay = env_float('FAKE_PYMSSQL_QUERY_MS') / 1000.0
+        timeout = self.connection.timeout
+        if timeout and delay > timeout:
+            time.sleep(timeout)
+            raise OperationalError('Adaptive Server connection timed out')
+        if delay:
+            time.sleep(delay)
+        log = os.environ.get('FAKE_PYMSSQL_QUERY_LOG')
+        if log:
+            logfile = open(log, 'a')
+            logfile.write(query.replace('\n', ' ') + '\n')
+            logfile.close()
+        self.rows = self.answer(query)
+        self.rowcount = len(self.rows)
+
+    def answer(self, query):
+        perf = re.match(r"SELECT (.*?) FROM (sys\.dm_os_sys_info i CROSS JOIN )?(?:sys\.)?(?:sysperfinfo|dm_os_performance_counters)"
+                        r"(?: WHERE (.*?))?(?: ORDER BY (.*?))?;?$", query, re.S | re.I)
+        if perf:
+            select, sys_info, where = perf.group(1), perf.group(2), perf.group(3) or ''
+            match = row_filter(where)
+            rows = order_last([row for row in perf_rows() if match(row)], perf.group(4) or '')
+            rows = [select_columns(select, row) for row in rows]
+            if sys_info:
+                #~ The trailing i.ms_ticks, i.sqlserver_start_time_ms_ticks columns
+                ticks = (int((time.time() - BOOT_TIME) * 1000), int((START_TIME - BOOT_TIME) * 1000))
+                rows = [row[:-2] + ticks for row in rows]
+            return rows
+        if 'SERVERPROPERTY' in query:
+            return [(os.environ.get('FAKE_PYMSSQL_VERSION', '15.0.4236.7'),)]
+        if 'sys.dm_os_wait_stats' in query:
+            return wait_rows()
+        if 'sys.dm_db_partition_stats' in query:
+            return index_rows(query)
+        if 'sys.dm_db_index_physical_stats' in query:
+            return fragmentation_rows(query)
+        if 'sys.dm_exec_cached_plans' in query:
+            return plan_rows(query)
+        if 'sys.dm_exec_sessions' in query:
+            return session_rows(query)
+        if 'sys.dm_io_virtual_file_stats' in query:
+            return file_rows()
+        if 'sys.dm_os_sys_memory' in query:
+            return [(63.5,)]
+        if 'RING_BUFFER_SCHEDULER_MONITOR' in query:
+            return ring_buffer_rows(query)
+        raise ProgrammingError('Fake driver cannot answer: %s' % query)
+
+    def fetchone(self):
+        if not self.rows:
+            return None
+        return self.rows.pop(0)
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+class Connection(object):
+
+    def __init__(self, host, database, timeout=0):
+        self.host = host
+        self.database = database
+        self.timeout = timeout
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+def connect(host='', user='', password='', database='', login_timeout=60, timeout=0, **kwargs):
+    down = [h for h in os.environ.get('FAKE_PYMSSQL_DOWN_HOSTS', '').split(',') if h]
+    delay = env_float('FAKE_PYMSSQL_CONNECT_MS') / 1000.0
+    if host.split('\\')[0].split(':')[0] in down:
+        time.sleep(min(delay, login_timeout or delay))
+        raise OperationalError(20009, 'DB-Lib error message 20009, severity 9:\n'
+                               'Unable to connect: Adaptive Server is unavailable or does not exist (%s)' % host)
+    if login_timeout and delay > login_timeout:
+        time.sleep(login_timeout)
+        raise OperationalError(20003, 'DB-Lib error message 20003, severity 6:\n'
+                               'Adaptive Server connection timed out (%s)' % host)
+    if password != os.environ.get('FAKE_PYMSSQL_PASSWORD', password):
+        #~ The message pymssql gives, with the follow-up DB-Lib errors of the closed connection
+        raise OperationalError(18456, "Login failed for user '%s'.DB-Lib error message 20018, severity 14:\n"
+                               "General SQL Server error: Check messages from the SQL Server\n"
+                               "DB-Lib error message 20002, severity 9:\nAdaptive Server connection failed (%s)" % (user, host))
+    if delay:
+        time.sleep(delay)
+    return Connection(host, database, timeout)
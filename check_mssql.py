@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+########################################################################
+# check_mssql - Nagios plugin checking Microsoft SQL Server and
+# database counters together over one connection
+# Copyright (C) 2017 Nagios Enterprises
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+################### check_mssql.py #####################################
+# Version    : 1.0.0
+# Date       : 10/18/2026
+# Maintainer : Nagios Enterprises, LLC
+# License    : GPLv2 (LICENSE.md / https://www.gnu.org/licenses/old-licenses/gpl-2.0.html)
+########################################################################
+
+import re
+import sys
+from optparse import OptionGroup
+
+import check_mssql_server
+import check_mssql_database
+import mssql_common
+from mssql_common import NagiosReturn, mark_phase
+#~ Called by check_mssql_collector.py, like on the other plugins
+from mssql_common import connect_db
+from check_mssql_server import return_nagios
+
+#~ Database counters are read from master, their instance_name is the database
+DATABASES_QUERY = "SELECT RTRIM(instance_name) FROM sysperfinfo WHERE object_name LIKE '%:Databases' " +\
+    "AND counter_name = 'Percent Log Used' AND instance_name <> '_Total';"
+
+def add_database_options(parser):
+    parser.set_usage("usage: %prog -H hostname -U user -P password [--modes modes] "
+                     "[-T databases | --all-databases] [--database-modes modes]")
+    database = OptionGroup(parser, "Database Options")
+    database.add_option('-T', '--databases', help='Comma separated list of databases to check.', default=None)
+    database.add_option('--all-databases', action="store_true", help='Check every database on the server.', default=False)
+    database.add_option('--include', help='With --all-databases, only check databases matching this regular expression.', default=None)
+    database.add_option('--exclude', help='With --all-databases, skip databases matching this regular expression.', default=None)
+    database.add_option('--database-modes', help='Comma separated list of check_mssql_database.py modes (or "all") '
+                        'to check for every database. Thresholds may be given per mode or per database.mode.', default=None)
+    parser.add_option_group(database)
+
+def check_database_options(parser, options):
+    if options.mode == 'test':
+        parser.error('The test mode is only available in check_mssql_server.py and check_mssql_database.py.')
+    if options.databases and options.all_databases:
+        parser.error('Cannot combine -T with --all-databases.')
+    if options.database_modes and not (options.databases or options.all_databases):
+        parser.error('--database-modes needs -T or --all-databases.')
+    if (options.databases or options.all_databases) and not options.database_modes:
+        parser.error('-T and --all-databases need --database-modes.')
+    if options.database_modes == 'all':
+        options.database_modes = [k for k, v in check_mssql_database.MODES.items() if 'counter' in v]
+    elif options.database_modes:
+        options.database_modes = [k.strip() for k in options.database_modes.split(',') if k.strip()]
+        for k in options.database_modes:
+            if 'counter' not in check_mssql_database.MODES.get(k, {}):
+                parser.error("Unknown database mode in --database-modes: %s" % k)
+    if options.databases:
+        options.databases = [d.strip() for d in options.databases.split(',') if d.strip()]
+    if not options.modes:
+        options.modes = [options.mode or 'time2connect']
+        if options.database_modes and not options.mode:
+            options.modes = []
+
+def parse_args(args=None):
+    return check_mssql_server.parse_args(args, add_database_options, check_database_options)
+
+def list_databases(mssql, options):
+    if options.databases:
+        return options.databases
+    cur = mssql.cursor()
+    mssql_common.execute_sql(cur, DATABASES_QUERY)
+    databases = []
+    for row in cur.fetchall():
+        database = row[0]
+        if options.include and not re.search(options.include, database):
+            continue
+        if options.exclude and re.search(options.exclude, database):
+            continue
+        databases.append(database)
+    mark_phase(options, 'databases')
+    return sorted(databases)
+
+def database_queries(databases, modes):
+    #~ One MODES style entry per database and mode, named database.mode
+    queries = {}
+    names = []
+    for database in databases:
+        for mode in modes:
+            #~ Run by the query classes of check_mssql_server.py with the semantics of check_mssql_database.py
+            sql_query = dict(check_mssql_database.MODES[mode], **check_mssql_database.DATABASE_ENTRY)
+            del sql_query['help']
+            name = '%s.%s' % (database, mode)
+            #~ The @instance parameter of the query, it keeps the delta state of every database apart
+            sql_query['instance'] = database
+            sql_query['stdout'] = '%s %s' % (database.replace('%', '%%'), sql_query['stdout'])
+            sql_query['label'] = check_mssql_database.perf_label('%s_%s' % (database, sql_query['label']))
+            queries[name] = sql_query
+            names.append(name)
+    return queries, names
+
+def run_check(mssql, options, host, total):
+    queries = dict(check_mssql_server.MODES)
+    modes = list(options.modes)
+    if options.database_modes:
+        databases = list_databases(mssql, options)
+        if not databases:
+            raise NagiosReturn('UNKNOWN: No databases found to check.', 3)
+        extra, names = database_queries(databases, options.database_modes)
+        queries.update(extra)
+        modes.extend(names)
+    options.modes = modes
+    results = check_mssql_server.collect_batch(mssql, options, host, total, queries)
+    check_mssql_server.return_nagios_multi(options, results)
+
+def main():
+    mssql_common.run_main('combined', parse_args, check)
+
+def check(options, connection=None):
+    mssql_common.check_plugin(options, 'combined', run_check, connection=connection)
+
+if __name__ == '__main__':
+    try:
+        main()
+    except mssql_common.driver_errors() as e:
+        print(e)
+        sys.exit(3)
+    except IOError as e:
+        print(e)
+        sys.exit(3)
+    except NagiosReturn as e:
+        print(e.message)
+        sys.exit(e.code)
+    except Exception as e:
+        print(type(e))
+        print("Caught unexpected error. This could be caused by your sysperfinfo not containing the proper entries for this query, and you may delete this service check.")
+        sys.exit(3)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+########################################################################
+# check_mssql_collector - Connection pooling daemon for the
+# check_mssql_server and check_mssql_database Nagios plugins
+# Copyright (C) 2017 Nagios Enterprises
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+################### check_mssql_collector.py ###########################
+# Version    : 1.0.0
+# Date       : 10/18/2026
+# Maintainer : Nagios Enterprises, LLC
+# License    : GPLv2 (LICENSE.md / https://www.gnu.org/licenses/old-licenses/gpl-2.0.html)
+########################################################################
+
+import os
+import sys
+import time
+import json
+import tempfile
+import threading
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+from optparse import OptionParser
+
+import pymssql
+import mssql_common
+import check_mssql_server
+import check_mssql_database
+import check_mssql
+
+PLUGINS = {
+    'server'    : check_mssql_server,
+    'database'  : check_mssql_database,
+    'combined'  : check_mssql,
+}
+
+UNEXPECTED = "Caught unexpected error. This could be caused by your sysperfinfo not containing " +\
+    "the proper entries for this query, and you may delete this service check."
+
+class ConnectionPool(object):
+
+    def __init__(self, size=4, max_idle=300):
+        self.size = size
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, connect):
+        with self.lock:
+            connections = self.idle.get(key, [])
+            while connections:
+                mssql, host, last_used = connections.pop()
+                if time.time() - last_used < self.max_idle:
+                    return mssql, host
+                close_quietly(mssql)
+        mssql, _, host = connect()
+        return mssql, host
+
+    def put(self, key, mssql, host):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.size:
+                connections.append((mssql, host, time.time()))
+                return
+        close_quietly(mssql)
+
+    def reap(self):
+        now = time.time()
+        with self.lock:
+            for key in list(self.idle.keys()):
+                keep = []
+                for mssql, host, last_used in self.idle[key]:
+                    if now - last_used < self.max_idle:
+                        keep.append((mssql, host, last_used))
+                    else:
+                        close_quietly(mssql)
+                if keep:
+                    self.idle[key] = keep
+                else:
+                    del self.idle[key]
+
+def close_quietly(mssql):
+    try:
+        mssql.close()
+    except Exception:
+        pass
+
+def pool_key(plugin, options):
+    #~ The driver timeouts are fixed when the connection is made, so they are part of the key
+    return (options.hostname, options.instance, options.port, options.user, options.password,
+            getattr(options, 'table', None) if plugin == 'database' else None, options.timeout)
+
+def pool_timeouts(options):
+    #~ The login and query timeouts check_plugin would use for a login of its own
+    if options.timeout:
+        return mssql_common.Deadline(options.timeout).timeouts()
+    return 60, 0
+
+def run_plugin(pool, plugin, args):
+    module = PLUGINS[plugin]
+    try:
+        options = module.parse_args(args)
+    except SystemExit:
+        return 'Invalid arguments: %s' % ' '.join(args), 3
+    if options.mode == 'test':
+        return 'The test mode cannot be run through the collector.', 3
+    #~ The request is at the collector already
+    options.collector = None
+    try:
+        #~ The main loop of the plugin: -t, --breaker, --record, --timings and the baselines all apply
+        mssql_common.run_main(plugin, lambda: options, lambda options: check_pooled(pool, plugin, options))
+    except mssql_common.NagiosReturn as e:
+        return e.message, e.code
+    except (pymssql.OperationalError, pymssql.InterfaceError, IOError) as e:
+        return str(e), 3
+    except Exception as e:
+        return '%s %s' % (type(e), UNEXPECTED), 3
+    return 'The check gave no result. %s' % UNEXPECTED, 3
+
+def check_pooled(pool, plugin, options):
+    module = PLUGINS[plugin]
+    if mssql_common.measures_login(options):
+        #~ Measuring the login is the point of this mode, so it is never pooled
+        module.check(options)
+        return
+    key = pool_key(plugin, options)
+    database = plugin == 'database' and options.table or 'master'
+    for attempt in (0, 1):
+        mssql, host = pool.get(key, lambda: mssql_common.login(options, *pool_timeouts(options), database=database))
+        try:
+            module.check(options, (mssql, host))
+        except mssql_common.NagiosReturn:
+            deadline = getattr(options, 'deadline', None)
+            if deadline and deadline.remaining() <= 0:
+                #~ The -t budget ran out, perhaps in the middle of a query
+                close_quietly(mssql)
+            else:
+                pool.put(key, mssql, host)
+            raise
+        except (pymssql.OperationalError, pymssql.InterfaceError):
+            #~ A pooled connection may have been dropped by the server, retry once on a fresh one
+            close_quietly(mssql)
+            if attempt:
+                raise
+        except Exception:
+            close_quietly(mssql)
+            raise
+
+class CollectorHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            plugin = request['plugin']
+            if plugin not in PLUGINS:
+                raise ValueError('Unknown plugin %s' % plugin)
+            message, code = run_plugin(self.server.pool, plugin, request['args'])
+        except (ValueError, KeyError, TypeError) as e:
+            message, code = 'Invalid collector request: %s' % e, 3
+        reply = json.dumps({ 'message' : message, 'code' : code }) + '\n'
+        self.wfile.write(reply.encode('utf-8'))
+
+class CollectorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def reaper(pool, interval):
+    while True:
+        time.sleep(interval)
+        pool.reap()
+
+def parse_args():
+    usage = "usage: %prog [--socket path] [--pool-size n] [--max-idle seconds]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-s', '--socket', help='Unix socket to listen on.',
+                      default=os.path.join(tempfile.gettempdir(), 'check_mssql_collector.sock'))
+    parser.add_option('--pool-size', type='int', help='Idle connections kept per host and credentials.', default=4)
+    parser.add_option('--max-idle', type='int', help='Seconds before an idle connection is closed.', default=300)
+    options, _ = parser.parse_args()
+    return options
+
+def main():
+    options = parse_args()
+    if os.path.exists(options.socket):
+        os.unlink(options.socket)
+    pool = ConnectionPool(options.pool_size, options.max_idle)
+
+    #~ Requests carry credentials, keep the socket private to the nagios user
+    old_umask = os.umask(0o077)
+    try:
+        server = CollectorServer(options.socket, CollectorHandler)
+    finally:
+        os.umask(old_umask)
+    server.pool = pool
+
+    thread = threading.Thread(target=reaper, args=(pool, max(1, options.max_idle // 2)))
+    thread.daemon = True
+    thread.start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(options.socket)
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
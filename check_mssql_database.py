@@ -19,24 +19,56 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 #
 ################### check_mssql_database.py ############################
-# Version    : 2.1.2
-# Date       : 06/18/2019
+# Version    : 2.2.0
+# Date       : 10/18/2026
 # Maintainer : Nagios Enterprises, LLC
 # License    : GPLv2 (LICENSE.md / https://www.gnu.org/licenses/old-licenses/gpl-2.0.html)
 ########################################################################
 
-import pymssql
 import time
 import sys
-import tempfile
-try:
-    import cPickle as pickle
-except:
-    import pickle
+import os
+import re
 from optparse import OptionParser, OptionGroup
 
-BASE_QUERY = "SELECT cntr_value FROM sys.sysperfinfo WHERE counter_name='%s' AND instance_name='%%s';"
-DIVI_QUERY = "SELECT cntr_value FROM sys.sysperfinfo WHERE counter_name LIKE '%s%%%%' AND instance_name='%%s';"
+import mssql_common
+from mssql_common import (LOGIN_SHARE, QUERY_SHARE, STATES, NagiosReturn, execute_sql,
+    host_filename, write_json_file, StateStore, connection_host, baseline_enabled, unsupported_modes,
+    with_server_time, server_rate, state_key, mode_options, parse_range, counter_match, counter_patterns, driver_errors, extra_perfdata,
+    mark_phase, run_main, check_plugin, get_states, inverted_ranges, return_probe, MSSQLQuery, MSSQLDivideQuery,
+    MSSQLDeltaQuery, add_startup_options, add_timing_options,
+    add_delta_options, check_delta_options, add_timeout_option,
+    add_breaker_options, add_record_option,
+    add_baseline_options, check_baseline_options, baseline_scope, check_collector_options)
+
+#~ pymssql and the modules the state/collector helpers need are imported where they are used,
+#~ so usage errors, the collector client and simple modes start quickly
+
+#~ Statements take their values as sp_executesql parameters, see execute_sql; @instance is the database
+BASE_QUERY = "SELECT cntr_value FROM sys.sysperfinfo WHERE counter_name=@counter AND instance_name=@instance;"
+DIVI_QUERY = "SELECT cntr_value FROM sys.sysperfinfo WHERE counter_name LIKE @counter + N'%' AND instance_name=@instance;"
+SWEEP_QUERY = "SELECT RTRIM(instance_name), RTRIM(counter_name), cntr_value FROM sys.sysperfinfo " +\
+    "WHERE object_name LIKE '%%:Databases' AND instance_name <> '_Total' AND %s;"
+#~ The instance condition is one of two fixed texts, the counters are the @counters parameter
+PROBE_QUERY = "SELECT RTRIM(object_name), RTRIM(counter_name), RTRIM(instance_name), cntr_value FROM sys.sysperfinfo " +\
+    "WHERE object_name LIKE N'%%:Databases' AND %s AND " + counter_match() + ";"
+VERSION_QUERY = "SELECT CAST(SERVERPROPERTY('ProductVersion') AS nvarchar(128));"
+#~ The rowstore indexes worth checking, listed once per --fragmentation pass; the size is metadata, nothing is scanned
+INDEX_QUERY = "SELECT i.[object_id], i.index_id, OBJECT_SCHEMA_NAME(i.[object_id]) + N'.' + OBJECT_NAME(i.[object_id]) + N'.' + i.name, " +\
+    "SUM(ps.used_page_count) FROM sys.indexes i " +\
+    "JOIN sys.dm_db_partition_stats ps ON ps.[object_id] = i.[object_id] AND ps.index_id = i.index_id " +\
+    "WHERE i.type IN (1, 2) AND i.is_disabled = 0 AND i.is_hypothetical = 0 AND OBJECTPROPERTY(i.[object_id], 'IsMsShipped') = 0 " +\
+    "GROUP BY i.[object_id], i.index_id, i.name HAVING SUM(ps.used_page_count) >= @pages ORDER BY i.[object_id], i.index_id;"
+#~ Leaf level fragmentation of one index over all its partitions, weighted by their pages
+FRAG_QUERY = "SELECT SUM(s.avg_fragmentation_in_percent * s.page_count) / NULLIF(SUM(s.page_count), 0), SUM(s.page_count) " +\
+    "FROM sys.dm_db_index_physical_stats(DB_ID(), @table_id, @index_id, NULL, @scan_mode) s " +\
+    "WHERE s.alloc_unit_type_desc = N'IN_ROW_DATA' AND s.index_level = 0;"
+
+FRAGMENTATION_MAX_AGE = 35 * 86400
+
+#~ Added to the MODES entry of a database counter, here and by check_mssql.py --database-modes:
+#~ the first sample of a delta and a ratio over a zero base are 0, ranges may be inverted
+DATABASE_ENTRY = { 'first_result' : 0, 'zero_base' : 0, 'invert_ranges' : True }
 
 MODES = {
     
@@ -44,7 +76,8 @@ MODES = {
                             'stdout'    : 'Log Cache Hit Ratio is %s%%',
                             'label'     : 'log_cache_hit_ratio',
                             'unit'      : '%',
-                            'query'     : DIVI_QUERY % 'Log Cache Hit Ratio',
+                            'query'     : DIVI_QUERY,
+                            'counter'   : 'Log Cache Hit Ratio',
                             'type'      : 'divide',
                             'modifier'  : 100,
                             },
@@ -53,14 +86,16 @@ MODES = {
                             'stdout'    : 'Active Transactions is %s',
                             'label'     : 'log_file_usage',
                             'unit'      : '',
-                            'query'     : BASE_QUERY % 'Active Transactions',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Active Transactions',
                             'type'      : 'standard',
                             },
     
     'logflushes'         : { 'help'     : 'Log Flushes Per Second',
                             'stdout'    : 'Log Flushes Per Second is %s/sec',
                             'label'     : 'log_flushes_per_sec',
-                            'query'     : BASE_QUERY % 'Log Flushes/sec',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Log Flushes/sec',
                             'type'      : 'delta'
                             },
     
@@ -68,35 +103,40 @@ MODES = {
                             'stdout'    : 'Log File Usage is %s%%',
                             'label'     : 'log_file_usage',
                             'unit'      : '%',
-                            'query'     : BASE_QUERY % 'Percent Log Used',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Percent Log Used',
                             'type'      : 'standard',
                             },
     
     'transpsec'         : { 'help'      : 'Transactions Per Second',
                             'stdout'    : 'Transactions Per Second is %s/sec',
                             'label'     : 'transactions_per_sec',
-                            'query'     : BASE_QUERY % 'Transactions/sec',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Transactions/sec',
                             'type'      : 'delta'
                             },
     
     'loggrowths'        : { 'help'      : 'Log Growths',
                             'stdout'    : 'Log Growths is %s',
                             'label'     : 'log_growths',
-                            'query'     : BASE_QUERY % 'Log Growths',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Log Growths',
                             'type'      : 'standard'
                             },
     
     'logshrinks'        : { 'help'      : 'Log Shrinks',
                             'stdout'    : 'Log Shrinks is %s',
                             'label'     : 'log_shrinks',
-                            'query'     : BASE_QUERY % 'Log Shrinks',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Log Shrinks',
                             'type'      : 'standard'
                             },
     
     'logtruncs'         : { 'help'      : 'Log Truncations',
                             'stdout'    : 'Log Truncations is %s',
                             'label'     : 'log_truncations',
-                            'query'     : BASE_QUERY % 'Log Truncations',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Log Truncations',
                             'type'      : 'standard'
                             },
     
@@ -104,163 +144,286 @@ MODES = {
                             'stdout'    : 'Log Flush Wait Time is %sms',
                             'label'     : 'log_wait_time',
                             'unit'      : 'ms',
-                            'query'     : BASE_QUERY % 'Log Flush Wait Time',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Log Flush Wait Time',
                             'type'      : 'standard'
                             },
     
     'datasize'          : { 'help'      : 'Database Size',
                             'stdout'    : 'Database size is %sKB',
                             'label'     : 'KB',
-                            'query'     : BASE_QUERY % 'Data File(s) Size (KB)',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Data File(s) Size (KB)',
                             'type'      : 'standard'
                             },
     
+    'fragmentation'     : { 'help'      : 'Worst index fragmentation, scanning the next slice of the indexes on every run',
+                            'stdout'    : 'Worst index fragmentation is %s%%',
+                            'label'     : 'fragmentation',
+                            'unit'      : '%',
+                            'query'     : FRAG_QUERY,
+                            'type'      : 'fragmentation'
+                            },
+    
     'time2connect'      : { 'help'      : 'Time to connect to the database.' },
     
-    'test'              : { 'help'      : 'Run tests of all queries against the database.' },
+    'test'              : { 'help'      : 'Probe which modes the database supports and cache the result for later checks.' },
 }
 
 def return_nagios(options, stdout='', result='', unit='', label=''):
-    invert = False
-    w = options.warning
-    c = options.critical
+    #~ time2connect, run directly or by check_mssql_collector.py, with the baseline and ranges of the queries
+    key = options.table and state_key(baseline_scope(options), options.table, label)
+    mssql_common.return_nagios(options, stdout, result, unit, label, key, inverted_ranges(options.warning, options.critical))
 
-    # Check for ranges
-    if ':' in options.critical and ':' in options.warning:
-        c = options.critical.split(':')[1]
-        w = options.warning.split(':')[1]
+def perf_label(label):
+    if re.search(r"[\s'=]", label):
+        return "'%s'" % label.replace("'", "''")
+    return label
 
-    # Check if we should invert the warning/critical (this should change someday)
-    if int(c) < int(w):
-        invert = True
-
-    if is_within_range(options.critical, result, invert):
-        prefix = 'CRITICAL: '
-        code = 2
-    elif is_within_range(options.warning, result, invert):
-        prefix = 'WARNING: '
-        code = 1
+def return_nagios_sweep(options, stdout='', results=None, unit='', label=''):
+    worst = 0
+    problems = []
+    perfdata = []
+    databases = sorted(results)
+    codes = get_states([results[database] for database in databases], options.warning, options.critical,
+                       inverted_ranges(options.warning, options.critical))
+    for database, code in zip(databases, codes):
+        result = results[database]
+        if code:
+            problems.append((code, database, result))
+        if code > worst:
+            worst = code
+        perfdata.append('%s=%s%s;%s;%s;;' % (perf_label('%s_%s' % (database, label)), result, unit,
+                                            options.warning or '', options.critical or ''))
+    if problems:
+        problems.sort(key=lambda x: -x[0])
+        details = ['%s %s (%s)' % (database, stdout % result, STATES[code]) for code, database, result in problems]
+        summary = '%d of %d databases not OK: %s' % (len(problems), len(results), ', '.join(details))
     else:
-        prefix = 'OK: '
-        code = 0
-
-    strresult = str(result)
-    stdout = stdout % (strresult)
-    stdout = '%s%s|%s=%s%s;%s;%s;;' % (prefix, stdout, label, strresult, unit, options.warning or '', options.critical or '')
-    raise NagiosReturn(stdout, code)
+        summary = 'All %d databases OK' % len(results)
+    raise NagiosReturn('%s: %s|%s' % (STATES[worst], summary, ' '.join(perfdata)) + extra_perfdata(options), worst)
 
-class NagiosReturn(Exception):
-    
-    def __init__(self, message, code):
-        self.message = message
-        self.code = code
-
-class MSSQLQuery(object):
+class MSSQLSweepQuery(MSSQLQuery):
+    
+    def __init__(self, query, options, counter='', *args, **kwargs):
+        super(MSSQLSweepQuery, self).__init__(query, options, *args, **kwargs)
+        self.counter = counter
+        self.type = kwargs.get('type')
+        if self.type == 'divide':
+            self.query = SWEEP_QUERY % "counter_name LIKE @counter + N'%'"
+        else:
+            self.query = SWEEP_QUERY % "counter_name = @counter"
+        self.params = { 'counter' : counter }
     
-    def __init__(self, query, options, label='', unit='', stdout='', host='', modifier=1, *args, **kwargs):
-        self.query = query % options.table
-        self.label = label
-        self.unit = unit
-        self.stdout = stdout
-        self.options = options
-        self.host = host
-        self.modifier = modifier
+    def selected(self, database):
+        if self.options.include and not re.search(self.options.include, database):
+            return False
+        if self.options.exclude and re.search(self.options.exclude, database):
+            return False
+        return True
     
     def run_on_connection(self, connection):
         cur = connection.cursor()
-        cur.execute(self.query)
-        self.query_result = cur.fetchone()[0]
-    
-    def finish(self):
-        return_nagios(  self.options,
-                        self.stdout,
-                        self.result,
-                        self.unit,
-                        self.label )
+        server_time = self.type == 'delta' and self.options.server_time
+        if server_time:
+            execute_sql(cur, with_server_time(self.query), self.params)
+        else:
+            execute_sql(cur, self.query, self.params)
+        mark_phase(self.options, 'execute')
+        rows = cur.fetchall()
+        mark_phase(self.options, 'fetch')
+        self.ms_ticks = None
+        if server_time and rows:
+            self.ms_ticks, self.start_ticks = rows[0][3:5]
+        self.query_result = {}
+        for row in rows:
+            database, counter_name, value = row[:3]
+            if not self.selected(database):
+                continue
+            values = self.query_result.setdefault(database, [None, None])
+            #~ Same ordering as DIVI_QUERY, the base counter comes second
+            values[counter_name.lower().endswith(' base')] = value
     
     def calculate_result(self):
-        self.result = float(self.query_result) * self.modifier
+        if self.type == 'delta':
+            self.calculate_delta()
+            return
+        self.result = {}
+        for database, values in self.query_result.items():
+            if self.type == 'divide':
+                if not values[1]:
+                    self.result[database] = 0
+                else:
+                    self.result[database] = (float(values[0]) / values[1]) * self.modifier
+            else:
+                self.result[database] = float(values[0]) * self.modifier
     
-    def do(self, connection):
-        self.run_on_connection(connection)
-        self.calculate_result()
-        self.finish()
-
-class MSSQLDivideQuery(MSSQLQuery):
+    def calculate_server_rates(self):
+        last_vals = {}
+        if not self.options.no_state:
+            store = StateStore(self.host, deadline=getattr(self.options, 'deadline', None)).open()
+            try:
+                key = state_key(self.host, 'sweep', self.counter, 'ms_ticks')
+                last_run = store.get(key)
+                new_vals = {}
+                for database, values in self.query_result.items():
+                    new_vals[database] = values[0]
+                store.set(key, time.time(), [new_vals, self.ms_ticks])
+            finally:
+                store.close()
+            if last_run:
+                old_vals, old_ticks = last_run[1]
+                for database, old_val in old_vals.items():
+                    last_vals[database] = [old_val, old_ticks]
+        self.result = {}
+        for database, values in self.query_result.items():
+            rate = server_rate(values[0], self.ms_ticks, self.start_ticks, last_vals.get(database))
+            self.result[database] = (rate or 0) * self.modifier
+    
+    def calculate_delta(self):
+        if self.ms_ticks is not None:
+            self.calculate_server_rates()
+            return
+        #~ One entry holds the last sample of every database for this counter
+        store = StateStore(self.host, deadline=getattr(self.options, 'deadline', None)).open()
+        try:
+            key = state_key(self.host, 'sweep', self.counter)
+            last_run = store.get(key)
+            new_time = time.time()
+            new_vals = {}
+            for database, values in self.query_result.items():
+                new_vals[database] = values[0]
+            self.result = {}
+            for database, new_val in new_vals.items():
+                if last_run and database in last_run[1]:
+                    old_time, old_vals = last_run
+                    self.result[database] = ((new_val - old_vals[database]) / (new_time - old_time)) * self.modifier
+                else:
+                    self.result[database] = 0
+            store.set(key, new_time, new_vals)
+        finally:
+            store.close()
     
-    def calculate_result(self):
-        if self.query_result[1] == 0:
-            self.result = 0
-        else:
-            self.result = (float(self.query_result[0]) / self.query_result[1]) * self.modifier
+    def finish(self):
+        return_nagios_sweep(self.options,
+                            self.stdout,
+                            self.result,
+                            self.unit,
+                            self.label )
+
+class FragmentationStore(StateStore):
     
-    def run_on_connection(self, connection):
-        cur = connection.cursor()
-        cur.execute(self.query)
-        self.query_result = [x[0] for x in cur.fetchall()]
+    #~ Results of every index of one database, too large to rewrite with the delta state on each check
+    def __init__(self, host, database, deadline=None):
+        StateStore.__init__(self, host, FRAGMENTATION_MAX_AGE, deadline)
+        self.filename = host_filename('%s-%s' % (host, database), 'fragmentation')
 
-class MSSQLDeltaQuery(MSSQLQuery):
+class MSSQLFragmentationQuery(MSSQLQuery):
     
-    def make_pickle_name(self):
-        tmpdir = tempfile.gettempdir()
-        tmpname = hash(self.host + self.options.table + self.query)
-        self.picklename = '%s/mssql-%s.tmp' % (tmpdir, tmpname)
+    #~ sys.dm_db_index_physical_stats over a whole large database takes too long for one check, so every
+    #~ run scans the next indexes within --scan-pages and --scan-seconds, resuming where the last run
+    #~ stopped, and reports on the results kept for all indexes. A pass starts with a fresh index list.
     
-    def calculate_result(self):
-        self.make_pickle_name()
-        
-        try:
-            tmpfile = open(self.picklename)
-        except IOError:
-            tmpfile = open(self.picklename, 'w')
-            tmpfile.close()
-            tmpfile = open(self.picklename)
+    def run_on_connection(self, connection):
+        store = FragmentationStore(self.host, self.options.table, getattr(self.options, 'deadline', None)).open()
         try:
-            try:
-                last_run = pickle.load(tmpfile)
-            except EOFError as ValueError:
-                last_run = { 'time' : None, 'value' : None }
+            entry = store.get('fragmentation')
+            self.scan = entry and entry[1] or { 'indexes' : [], 'next' : 0, 'results' : {} }
+            if self.scan.get('current'):
+                #~ The last run never finished this index; it has been skipped for the rest of the pass
+                self.scan.setdefault('failed', []).append(self.scan['current'])
+                self.scan['current'] = None
+            cur = connection.cursor()
+            if self.scan['next'] >= len(self.scan['indexes']):
+                self.start_pass(cur)
+            self.scanned, self.scanned_pages = self.scan_slice(cur, store)
+            mark_phase(self.options, 'execute')
+            store.set('fragmentation', time.time(), self.scan)
         finally:
-            tmpfile.close()
-        
-        if last_run['time']:
-            old_time = last_run['time']
-            new_time = time.time()
-            old_val  = last_run['query_result']
-            new_val  = self.query_result
-            self.result = ((new_val - old_val) / (new_time - old_time)) * self.modifier
-        else:
-            self.result = 0
-        
-        new_run = { 'time' : time.time(), 'query_result' : self.query_result }
-        
-        #~ Will throw IOError, leaving it to acquiesce
-        tmpfile = open(self.picklename, 'w')
-        pickle.dump(new_run, tmpfile)
-        tmpfile.close()
+            store.close()
+    
+    def start_pass(self, cur):
+        execute_sql(cur, INDEX_QUERY, { 'pages' : self.options.min_pages })
+        indexes = [list(row) for row in cur.fetchall()]
+        mark_phase(self.options, 'indexes')
+        #~ Results of dropped indexes go, the others are kept until their turn comes again
+        keys = set(['%d.%d' % (row[0], row[1]) for row in indexes])
+        results = dict([(key, value) for key, value in self.scan['results'].items() if key in keys])
+        self.scan = { 'indexes' : indexes, 'next' : 0, 'results' : results, 'failed' : [] }
+    
+    def scan_slice(self, cur, store):
+        end = time.time() + self.options.scan_seconds
+        deadline = getattr(self.options, 'deadline', None)
+        if deadline:
+            #~ Stop in time to leave the share of --timeout kept for the state file
+            end = min(end, deadline.end - deadline.budget * (1 - LOGIN_SHARE - QUERY_SHARE))
+        indexes = self.scan['indexes']
+        scanned = 0
+        pages = 0
+        while self.scan['next'] < len(indexes):
+            object_id, index_id, name, index_pages = indexes[self.scan['next']]
+            #~ At least one index per run, so an index above the page budget is still reached
+            if scanned and (pages + index_pages > self.options.scan_pages or time.time() >= end):
+                break
+            key = '%d.%d' % (object_id, index_id)
+            #~ Saved already past the index, so one that fails or runs out of time is skipped by the next run
+            #~ instead of stalling the scan; this also keeps the result of the index before it
+            self.scan['next'] += 1
+            self.scan['current'] = key
+            store.set('fragmentation', time.time(), self.scan)
+            store.save()
+            execute_sql(cur, self.query, { 'table_id' : object_id, 'index_id' : index_id, 'scan_mode' : self.options.scan_mode })
+            row = cur.fetchone()
+            if row and row[1]:
+                self.scan['results'][key] = [float(row[0] or 0), row[1], time.time()]
+            self.scan['current'] = None
+            scanned += 1
+            pages += index_pages
+        return scanned, pages
+    
+    def calculate_result(self):
+        import heapq
+        names = dict([('%d.%d' % (row[0], row[1]), row[2]) for row in self.scan['indexes']])
+        results = [(value[0], value[1], names[key]) for key, value in self.scan['results'].items() if key in names]
+        worst = heapq.nlargest(max(1, self.options.top), results)
+        self.result = worst and round(worst[0][0], 1) or 0.0
+        over = len([code for code in get_states([result[0] for result in results], self.options.warning,
+                    self.options.critical, inverted_ranges(self.options.warning, self.options.critical)) if code])
+        detail = ''
+        if worst:
+            detail = ' (%s, %d pages)' % (worst[0][2], worst[0][1])
+        detail += ', %d of %d indexes of at least %d pages scanned (%d this run), %d over the thresholds' % (
+            len(results), len(names), self.options.min_pages, self.scanned, over)
+        failed = len([key for key in self.scan.get('failed', []) if key in names])
+        if failed:
+            detail += ', %d failed or timed out this pass' % failed
+        self.stdout = self.stdout + detail.replace('%', '%%')
+        self.long_output = ['%s: %.1f%% of %d pages' % (name, fragmentation, pages) for fragmentation, pages, name in worst]
+        coverage = names and 100.0 * len(results) / len(names) or 100.0
+        total = sum([result[1] for result in results])
+        average = total and sum([result[0] * result[1] for result in results]) / total or 0.0
+        perfdata = ['fragmentation_avg=%.1f%%;;;0;100' % average, 'fragmented_indexes=%d;;;0;' % over,
+                    'index_coverage=%.1f%%;;;0;100' % coverage, 'indexes_scanned=%d;;;0;' % self.scanned,
+                    'pages_scanned=%d;;;0;' % self.scanned_pages]
+        self.options.perfdata = list(getattr(self.options, 'perfdata', None) or []) + perfdata
+    
+    def finish(self):
+        #~ The most fragmented indexes as Nagios long output, worst first
+        try:
+            super(MSSQLFragmentationQuery, self).finish()
+        except NagiosReturn as e:
+            if self.long_output:
+                e.message += '\n' + '\n'.join(self.long_output)
+            raise
 
 def is_within_range(nagstring, value, invert = False):
     if not nagstring:
         return False
-    import re
-    import operator
-    first_float = r'(?P<first>(-?[0-9]+(\.[0-9]+)?))'
-    second_float= r'(?P<second>(-?[0-9]+(\.[0-9]+)?))'
-    actions = [ (r'^%s$' % first_float,lambda y: (value > float(y.group('first'))) or (value < 0)),
-                (r'^%s:$' % first_float,lambda y: value < float(y.group('first'))),
-                (r'^~:%s$' % first_float,lambda y: value > float(y.group('first'))),
-                (r'^%s:%s$' % (first_float,second_float), lambda y: (value < float(y.group('first'))) or (value > float(y.group('second')))),
-                (r'^@%s:%s$' % (first_float,second_float), lambda y: not((value < float(y.group('first'))) or (value > float(y.group('second')))))]
-    for regstr,func in actions:
-        res = re.match(regstr,nagstring)
-        if res: 
-            if invert:
-                return not func(res)
-            else:
-                return func(res)
-    raise Exception('Improper warning/critical format.')
+    if invert:
+        return not parse_range(nagstring).alert(value)
+    return parse_range(nagstring).alert(value)
 
-def parse_args():
+def parse_args(args=None):
     usage = "usage: %prog -H hostname -U user -P password -T table --mode"
     parser = OptionParser(usage=usage)
     
@@ -274,19 +437,51 @@ def parse_args():
     connection = OptionGroup(parser, "Optional Connection Information")
     connection.add_option('-I', '--instance', help='Specify instance', default=None)
     connection.add_option('-p', '--port', help='Specify port.', default=None)
+    connection.add_option('--collector', help='Run the check through the check_mssql_collector.py daemon '
+                          'listening on this Unix socket, connecting directly if it is not running.', default=None)
     parser.add_option_group(connection)
     
+    add_breaker_options(parser)
+    
     nagios = OptionGroup(parser, "Nagios Plugin Information")
     nagios.add_option('-w', '--warning', help='Specify warning range.', default=None)
     nagios.add_option('-c', '--critical', help='Specify critical range.', default=None)
+    add_timeout_option(nagios)
     parser.add_option_group(nagios)
     
+    add_baseline_options(parser, 'host, database and mode')
+    
+    sweep = OptionGroup(parser, "All Databases Options")
+    sweep.add_option('--all-databases', action="store_true", help='Check the mode for every database with one query, '
+                     'applying the thresholds to each database.', default=False)
+    sweep.add_option('--include', help='Only check databases matching this regular expression.', default=None)
+    sweep.add_option('--exclude', help='Skip databases matching this regular expression.', default=None)
+    parser.add_option_group(sweep)
+    
+    add_timing_options(nagios)
+    add_record_option(nagios)
+    add_startup_options(nagios)
+    
+    fragmentation = OptionGroup(parser, "Fragmentation Options")
+    fragmentation.add_option('--scan-mode', choices=['LIMITED', 'SAMPLED'], help='sys.dm_db_index_physical_stats mode '
+                             'used by --fragmentation, LIMITED or SAMPLED.', default='LIMITED')
+    fragmentation.add_option('--scan-pages', type='int', help='Pages of indexes --fragmentation scans per run, '
+                             'at least one index.', default=100000)
+    fragmentation.add_option('--scan-seconds', type='float', help='Seconds --fragmentation spends scanning per run, '
+                             'finishing the index it is on.', default=5)
+    fragmentation.add_option('--min-pages', type='int', help='Pages an index needs to be checked by --fragmentation.', default=1000)
+    fragmentation.add_option('--top', type='int', help='Number of indexes listed by --fragmentation.', default=5)
+    parser.add_option_group(fragmentation)
+    
+    add_delta_options(parser)
+    
     mode = OptionGroup(parser, "Mode Options")
     global MODES
-    for k, v in zip(list(MODES.keys()), list(MODES.values())):
+    for k in mode_options(parser, args, MODES):
+        v = MODES[k]
         mode.add_option('--%s' % k, action="store_true", help=v.get('help'), default=False)
     parser.add_option_group(mode)
-    options, _ = parser.parse_args()
+    options, _ = parser.parse_args(args)
     
     if not options.hostname:
         parser.error('Hostname is a required option.')
@@ -294,7 +489,7 @@ def parse_args():
         parser.error('User is a required option.')
     if not options.password:
         parser.error('Password is a required option.')
-    if not options.table:
+    if not options.table and not options.all_databases:
         parser.error('Table is a required option.')
     
     if options.instance and options.port:
@@ -307,26 +502,35 @@ def parse_args():
         elif getattr(options, arg.dest):
             options.mode = arg.dest
     
+    check_baseline_options(parser, options)
+    check_collector_options(parser, options)
+    
+    if options.all_databases and baseline_enabled(options):
+        parser.error('--all-databases cannot be combined with baseline thresholds.')
+    
+    check_delta_options(parser, options)
+    
+    if options.all_databases and options.mode != 'test' and 'counter' not in MODES.get(options.mode, {}):
+        parser.error("--all-databases needs a counter Mode Option.")
+    
+    if options.mode == 'fragmentation' and options.no_state:
+        parser.error('--fragmentation resumes from its state and cannot be combined with --no-state.')
+    
     return options
 
-def connect_db(options):
-    host = options.hostname
-    if options.instance:
-        host += "\\" + options.instance
-    elif options.port:
-        host += ":" + options.port
-    start = time.time()
-    mssql = pymssql.connect(host = host, user = options.user, password = options.password, database=options.table)
-    total = time.time() - start
-    return mssql, total, host
+def connect_db(options, login_timeout=60, timeout=0):
+    return mssql_common.connect_db(options, login_timeout, timeout, options.table or 'master')
 
 def main():
-    options = parse_args()
-    
-    mssql, total, host = connect_db(options)
-    
+    run_main('database', parse_args, check)
+
+def check(options, connection=None):
+    check_supported(options, connection_host(options))
+    check_plugin(options, 'database', run_check, options.table or 'master', connection=connection)
+
+def run_check(mssql, options, host, total):
     if options.mode =='test':
-        run_tests(mssql, options, host)
+        run_probe(mssql, options, host)
         
     elif not options.mode or options.mode == 'time2connect':
         return_nagios(  options,
@@ -334,44 +538,89 @@ def main():
                         label='time',
                         unit='s',
                         result=total )
-                        
+    
     else:
         execute_query(mssql, options, host)
 
+def check_supported(options, host):
+    #~ Consulted before the login, a mode the last --test probe found missing costs no connection
+    if options.mode in (None, 'time2connect', 'test'):
+        return
+    if unsupported_modes(capability_host(options, host), [options.mode], 'database-capabilities'):
+        raise NagiosReturn('UNKNOWN: Mode %s is not supported by %s according to the last --test probe.' % (options.mode, host), 3)
+
 def execute_query(mssql, options, host=''):
-    sql_query = MODES[options.mode]
+    sql_query = dict(MODES[options.mode], **DATABASE_ENTRY)
+    sql_query['instance'] = options.table
     sql_query['options'] = options
     sql_query['host'] = host
     query_type = sql_query.get('type')
-    if query_type == 'delta':
+    if options.all_databases:
+        mssql_query = MSSQLSweepQuery(**sql_query)
+    elif query_type == 'delta':
         mssql_query = MSSQLDeltaQuery(**sql_query)
     elif query_type == 'divide':
         mssql_query = MSSQLDivideQuery(**sql_query)
+    elif query_type == 'fragmentation':
+        mssql_query = MSSQLFragmentationQuery(**sql_query)
     else:
         mssql_query = MSSQLQuery(**sql_query)
     mssql_query.do(mssql)
 
-def run_tests(mssql, options, host):
-    failed = 0
-    total  = 0
-    del MODES['time2connect']
-    del MODES['test']
-    for mode in list(MODES.keys()):
-        total += 1
-        options.mode = mode
-        try:
-            execute_query(mssql, options, host)
-        except NagiosReturn:
-            print("%s passed!" % mode)
-        except Exception as e:
-            failed += 1
-            print("%s failed with: %s" % (mode, e))
-    print('%d/%d tests failed.' % (failed, total))
-    
+def capability_host(options, host):
+    #~ Capabilities of one database, or of any database with --all-databases
+    if options.all_databases:
+        return host
+    return '%s-%s' % (host, options.table)
+
+def run_probe(mssql, options, host):
+    #~ Every mode is a Databases counter, so one query answers all of them
+    counter_modes = [k for k in MODES if 'counter' in MODES[k]]
+    names = []
+    for mode in counter_modes:
+        sql_query = MODES[mode]
+        names.append(sql_query['counter'])
+        if sql_query.get('type') == 'divide':
+            names.append(sql_query['counter'] + ' Base')
+    params = { 'counters' : counter_patterns(names) }
+    if options.all_databases:
+        instance = "instance_name <> N'_Total'"
+    else:
+        instance = "instance_name = @instance"
+        params['instance'] = options.table
+    cur = mssql.cursor()
+    execute_sql(cur, VERSION_QUERY)
+    version = cur.fetchone()[0]
+    start = time.time()
+    execute_sql(cur, PROBE_QUERY % instance, params)
+    rows = cur.fetchall()
+    latency = time.time() - start
+    found = set([row[1].lower() for row in rows])
+    modes = {}
+    for mode in counter_modes:
+        counter = MODES[mode]['counter'].lower()
+        supported = counter in found
+        if MODES[mode].get('type') == 'divide':
+            supported = supported and counter + ' base' in found
+        modes[mode] = supported or None
+    capabilities = { 'time'     : time.time(),
+                     'version'  : version,
+                     'prefixes' : sorted(set([row[0].split(':')[0] for row in rows if ':' in row[0]])),
+                     'modes'    : modes }
+    write_json_file(host_filename(capability_host(options, host), 'database-capabilities'), capabilities,
+                    getattr(options, 'deadline', None))
+    if options.all_databases:
+        target = host
+    else:
+        target = '%s database %s' % (host, options.table)
+    return_probe(options, target, capabilities, latency)
+
+
+
 if __name__ == '__main__':
     try:
         main()
-    except pymssql.OperationalError as e:
+    except driver_errors() as e:
         print(e)
         sys.exit(3)
     except IOError as e:
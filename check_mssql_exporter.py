@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+########################################################################
+# check_mssql_exporter - Serves the check_mssql_server and
+# check_mssql_database counters as OpenMetrics text over HTTP
+# Copyright (C) 2017 Nagios Enterprises
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+################### check_mssql_exporter.py ############################
+# Version    : 1.0.0
+# Date       : 10/18/2026
+# Maintainer : Nagios Enterprises, LLC
+# License    : GPLv2 (LICENSE.md / https://www.gnu.org/licenses/old-licenses/gpl-2.0.html)
+########################################################################
+
+import sys
+import time
+import threading
+from optparse import OptionGroup
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import pymssql
+import mssql_common
+import check_mssql_server
+import check_mssql_database
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+#~ The sysperfinfo modes of the server plus every Databases counter of every database, in one query;
+#~ cntr_type tells the cumulative counters from the gauges
+COUNTER_QUERY = "SELECT RTRIM(object_name), RTRIM(counter_name), RTRIM(instance_name), cntr_value, cntr_type " +\
+    "FROM sys.dm_os_performance_counters WHERE %s OR (object_name LIKE N'%%:Databases' AND instance_name <> N'_Total' AND %s);" % (
+    mssql_common.counter_match(), mssql_common.counter_match('database_counters'))
+#~ Scheduler monitor records are written every minute, this always holds the latest one
+CPU_WINDOW = 2 * 60 * 1000
+
+#~ Collected one after the other on every scrape; a failing part only drops its own metrics.
+#~ The plancache mode reads the whole plan cache and is left to the plugin
+PARTS = ['counters', 'waitstats', 'filelatency', 'cpu', 'connections', 'memory']
+
+#~ The OpenMetrics name of every counter mode, by object and with its unit; the perfdata labels of
+#~ the plugins are neither unique nor unit suffixed. A running total is exported as name_total
+SERVER_METRICS = {
+    'averagewait'       : 'mssql_lock_average_wait_milliseconds',
+    'batchreq'          : 'mssql_sql_batch_requests',
+    'bufferhitratio'    : 'mssql_buffer_cache_hit_ratio_percent',
+    'cachehit'          : 'mssql_plan_cache_hit_ratio_percent',
+    'checkpoints'       : 'mssql_buffer_checkpoint_pages',
+    'databasepages'     : 'mssql_buffer_database_pages',
+    'deadlocks'         : 'mssql_lock_deadlocks',
+    'freepages'         : 'mssql_buffer_free_pages',
+    'fullscans'         : 'mssql_access_full_scans',
+    'lazywrites'        : 'mssql_buffer_lazy_writes',
+    'lockrequests'      : 'mssql_lock_requests',
+    'locktimeouts'      : 'mssql_lock_timeouts',
+    'lockwait'          : 'mssql_lock_wait_time_milliseconds',
+    'lockwaits'         : 'mssql_lock_waits',
+    'pagelife'          : 'mssql_buffer_page_life_expectancy_seconds',
+    'pagelooks'         : 'mssql_buffer_page_lookups',
+    'pagereads'         : 'mssql_buffer_page_reads',
+    'pagesplits'        : 'mssql_access_page_splits',
+    'pagewrites'        : 'mssql_buffer_page_writes',
+    'readahead'         : 'mssql_buffer_readahead_pages',
+    'sqlcompilations'   : 'mssql_sql_compilations',
+    'stolenpages'       : 'mssql_buffer_stolen_pages',
+    'targetpages'       : 'mssql_buffer_target_pages',
+    'totalpages'        : 'mssql_buffer_total_pages',
+}
+
+#~ The base of an average, exported next to it
+SERVER_BASE_METRICS = {
+    'averagewait'       : 'mssql_lock_average_wait_base',
+}
+
+DATABASE_METRICS = {
+    'activetrans'       : 'mssql_database_active_transactions',
+    'datasize'          : 'mssql_database_data_size_kilobytes',
+    'logcachehit'       : 'mssql_database_log_cache_hit_ratio_percent',
+    'logfileusage'      : 'mssql_database_log_used_percent',
+    'logflushes'        : 'mssql_database_log_flushes',
+    'loggrowths'        : 'mssql_database_log_growths',
+    'logshrinks'        : 'mssql_database_log_shrinks',
+    'logtruncs'         : 'mssql_database_log_truncations',
+    'logwait'           : 'mssql_database_log_flush_wait_time_milliseconds',
+    'transpsec'         : 'mssql_database_transactions',
+}
+
+def escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_value(value):
+    return repr(float(value))
+
+class Metrics(object):
+
+    def __init__(self):
+        self.families = []
+        self.samples = {}
+
+    def add(self, name, kind, help_text, value, labels=None):
+        #~ Cumulative counters keep their raw value; OpenMetrics wants them suffixed _total
+        if name not in self.samples:
+            self.families.append((name, kind, help_text))
+            self.samples[name] = []
+        label_text = ''
+        if labels:
+            label_text = '{%s}' % ','.join(['%s="%s"' % (k, escape_label(v)) for k, v in sorted(labels.items())])
+        suffix = kind == 'counter' and '_total' or ''
+        self.samples[name].append('%s%s%s %s' % (name, suffix, label_text, format_value(value)))
+
+    def render(self):
+        lines = []
+        for name, kind, help_text in self.families:
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.append('# HELP %s %s' % (name, escape_help(help_text)))
+            lines.extend(self.samples[name])
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+def counter_kind(cntr_type):
+    #~ How check_mssql_server.py --counter treats the cntr_type, 'standard' if unknown
+    return check_mssql_server.CNTR_TYPES.get(cntr_type, 'standard')
+
+def log_error(part, error):
+    sys.stderr.write('%s collecting %s: %s: %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), part,
+                     type(error).__name__, str(error).replace('\n', ' ').strip()))
+
+class Collector(object):
+
+    def __init__(self, options, ttl):
+        self.options = options
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.mssql = None
+        self.host = None
+        self.text = None
+        self.collected = 0
+
+    def get(self):
+        #~ Scrapers arriving while a collection runs wait for it and share its result
+        with self.lock:
+            if self.text is None or time.time() - self.collected >= self.ttl:
+                self.text = self.collect()
+                self.collected = time.time()
+            return self.text
+
+    def connection(self):
+        if self.mssql is None:
+            self.mssql, _, self.host = mssql_common.connect_db(self.options)
+        return self.mssql
+
+    def close(self):
+        if self.mssql is not None:
+            try:
+                self.mssql.close()
+            except Exception:
+                pass
+        self.mssql = None
+
+    def collect(self):
+        start = time.time()
+        for attempt in (0, 1):
+            metrics = Metrics()
+            failed = self.collect_into(metrics)
+            if len(failed) < len(PARTS) or attempt:
+                break
+            #~ Every part failing usually means the server dropped the kept connection, retry once on a fresh one
+            self.close()
+        for part in PARTS:
+            metrics.add('mssql_collect_error', 'gauge', 'Whether collecting this part failed on the last collection.',
+                        part in failed and 1 or 0, { 'part' : part })
+        metrics.add('mssql_up', 'gauge', 'Whether the last collection from SQL Server succeeded.',
+                    len(failed) < len(PARTS) and 1 or 0)
+        metrics.add('mssql_scrape_duration_seconds', 'gauge', 'Time spent collecting from SQL Server.', time.time() - start)
+        return metrics.render()
+
+    def collect_into(self, metrics):
+        #~ Returns the parts that failed. Nothing here touches the state files of the plugins, so the
+        #~ delta windows of the checks stay theirs; DMV totals are exported raw for the scraper to rate()
+        #~ Whatever goes wrong with the target is reported through mssql_up, never as a failed scrape
+        try:
+            mssql = self.connection()
+        except Exception as e:
+            log_error('login', e)
+            self.close()
+            return list(PARTS)
+        failed = []
+        for part in PARTS:
+            try:
+                getattr(self, 'collect_' + part)(metrics, mssql)
+            except Exception as e:
+                log_error(part, e)
+                failed.append(part)
+        return failed
+
+    def collect_counters(self, metrics, mssql):
+        options = self.options
+        options.perfdata = []
+        server_modes = [k for k, v in check_mssql_server.MODES.items() if 'counter' in v]
+        database_modes = [k for k, v in check_mssql_database.MODES.items() if 'counter' in v]
+        names = []
+        for mode in database_modes:
+            sql_query = check_mssql_database.MODES[mode]
+            names.append(sql_query['counter'])
+            if sql_query.get('type') == 'divide':
+                names.append(sql_query['counter'] + ' Base')
+        cur = mssql.cursor()
+        mssql_common.execute_sql(cur, COUNTER_QUERY, { 'counters' : check_mssql_server.batch_counters(server_modes),
+                                                      'database_counters' : mssql_common.counter_patterns(names) })
+        rows = cur.fetchall()
+
+        #~ The value and cntr_type travel together through match_counter_values
+        counter_rows = [(counter, instance, (value, cntr_type)) for obj, counter, instance, value, cntr_type in rows
+                        if not obj.endswith(':Databases')]
+        for mode in sorted(server_modes):
+            sql_query = check_mssql_server.MODES[mode]
+            values = check_mssql_server.match_counter_values(counter_rows, sql_query)
+            if not values:
+                continue
+            (value, cntr_type), bases = values[0], [base for base, _ in values[1:]]
+            name = SERVER_METRICS[mode]
+            kind = counter_kind(cntr_type)
+            if kind == 'delta':
+                metrics.add(name, 'counter', sql_query['help'], value)
+            elif kind == 'average' and bases:
+                #~ Both halves of an average are cumulative, rate(x_total) / rate(x_base_total) is the average
+                metrics.add(name, 'counter', sql_query['help'], value)
+                metrics.add(SERVER_BASE_METRICS[mode], 'counter', sql_query['help'] + ' base', bases[0])
+            elif kind == 'divide' and bases:
+                mssql_query = check_mssql_server.make_query(mode, options, self.host)
+                mssql_query.load_values([value] + bases)
+                mssql_query.calculate_result()
+                metrics.add(name, 'gauge', sql_query['help'], mssql_query.result)
+            else:
+                metrics.add(name, 'gauge', sql_query['help'], value)
+
+        databases = {}
+        for obj, counter, instance, value, cntr_type in rows:
+            if obj.endswith(':Databases') and instance != '_Total':
+                databases.setdefault(instance, {})[counter.lower()] = (value, cntr_type)
+        for mode in sorted(database_modes):
+            sql_query = check_mssql_database.MODES[mode]
+            counter = sql_query['counter'].lower()
+            name = DATABASE_METRICS[mode]
+            for database in sorted(databases):
+                values = databases[database]
+                if counter not in values:
+                    continue
+                value, cntr_type = values[counter]
+                kind = counter_kind(cntr_type)
+                if kind == 'divide':
+                    base = values.get(counter + ' base', (0, None))[0]
+                    if base:
+                        value = float(value) / base
+                    value = value * sql_query.get('modifier', 1)
+                metrics.add(name, kind == 'delta' and 'counter' or 'gauge', sql_query['help'], value, { 'database' : database })
+
+    def collect_waitstats(self, metrics, mssql):
+        #~ Summed per wait category like --waitstats, leaving out the benign waits
+        cur = mssql.cursor()
+        mssql_common.execute_sql(cur, check_mssql_server.WAIT_QUERY)
+        waits = dict([(name, [0, 0]) for name in check_mssql_server.WAIT_CATEGORY_NAMES])
+        for _, _, wait_type, wait_ms, signal_ms in cur.fetchall():
+            if not wait_type or wait_type in check_mssql_server.BENIGN_WAITS:
+                continue
+            totals = waits[check_mssql_server.wait_category(wait_type)]
+            totals[0] += wait_ms
+            totals[1] += signal_ms
+        for category in sorted(waits):
+            metrics.add('mssql_wait_time_milliseconds', 'counter', 'Wait time since SQL Server started.',
+                        waits[category][0], { 'category' : category })
+        for category in sorted(waits):
+            metrics.add('mssql_signal_wait_time_milliseconds', 'counter', 'Signal wait time since SQL Server started.',
+                        waits[category][1], { 'category' : category })
+
+    def collect_filelatency(self, metrics, mssql):
+        cur = mssql.cursor()
+        mssql_common.execute_sql(cur, check_mssql_server.FILE_QUERY)
+        columns = [('reads', 'Reads'), ('read_bytes', 'Bytes read'), ('read_stall_milliseconds', 'Read stall time'),
+                   ('writes', 'Writes'), ('written_bytes', 'Bytes written'), ('write_stall_milliseconds', 'Write stall time')]
+        files = [(row[4] or str(row[2]), row[5] or str(row[3]), row[6:]) for row in cur.fetchall()]
+        for i, (column, help_text) in enumerate(columns):
+            for database, name, counters in files:
+                metrics.add('mssql_file_' + column, 'counter', help_text + ' of the database file since SQL Server started.',
+                            counters[i], { 'database' : database, 'file' : name })
+
+    def collect_cpu(self, metrics, mssql):
+        cur = mssql.cursor()
+        mssql_common.execute_sql(cur, check_mssql_server.CPU_QUERY, { 'since' : 0, 'window' : CPU_WINDOW })
+        row = cur.fetchone()
+        if not row:
+            return
+        metrics.add('mssql_cpu_percent', 'gauge', 'SQL Server CPU utilization in the latest scheduler monitor record.', row[1])
+        metrics.add('mssql_cpu_system_idle_percent', 'gauge', 'System idle CPU in the latest scheduler monitor record.', row[2])
+
+    def collect_connections(self, metrics, mssql):
+        cur = mssql.cursor()
+        mssql_common.execute_sql(cur, check_mssql_server.CON_QUERY)
+        metrics.add('mssql_user_sessions', 'gauge', 'Number of user sessions.', cur.fetchone()[0])
+
+    def collect_memory(self, metrics, mssql):
+        cur = mssql.cursor()
+        mssql_common.execute_sql(cur, check_mssql_server.MEM_QUERY)
+        metrics.add('mssql_memory_used_percent', 'gauge', check_mssql_server.MODES['memory']['help'] + '.', cur.fetchone()[0])
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.collector.get().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ExporterServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def add_exporter_options(parser):
+    parser.set_usage("usage: %prog -H hostname -U user -P password [--listen address:port] [--cache-ttl seconds]")
+    exporter = OptionGroup(parser, "Exporter Options")
+    exporter.add_option('--listen', help='Address and port to serve /metrics on.', default='127.0.0.1:9399')
+    exporter.add_option('--cache-ttl', type='float', help='Seconds a collection is served to scrapers before the next.', default=15)
+    parser.add_option_group(exporter)
+
+def check_exporter_options(parser, options):
+    address, _, port = options.listen.rpartition(':')
+    if not port.isdigit():
+        parser.error('--listen must be given as address:port.')
+    options.listen = (address or '127.0.0.1', int(port))
+
+def parse_args(args=None):
+    return check_mssql_server.parse_args(args, add_exporter_options, check_exporter_options)
+
+def main():
+    options = parse_args()
+    server = ExporterServer(options.listen, MetricsHandler)
+    server.collector = Collector(options, options.cache_ttl)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.collector.close()
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+########################################################################
+# check_mssql_fleet - Check an inventory of Microsoft SQL Servers from
+# one process and submit the results as Nagios passive checks
+# Copyright (C) 2017 Nagios Enterprises
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+################### check_mssql_fleet.py ###############################
+# Version    : 1.0.0
+# Date       : 10/18/2026
+# Maintainer : Nagios Enterprises, LLC
+# License    : GPLv2 (LICENSE.md / https://www.gnu.org/licenses/old-licenses/gpl-2.0.html)
+########################################################################
+
+import os
+import re
+import sys
+import time
+import errno
+import random
+import string
+import threading
+from xml.sax.saxutils import escape
+try:
+    from configparser import RawConfigParser
+except ImportError:
+    from ConfigParser import RawConfigParser
+from optparse import OptionParser
+
+import mssql_common
+import check_mssql_server
+
+#~ Inventory keys and the check_mssql_server.py options they map to
+INVENTORY_OPTIONS = [
+    ('hostname', '-H'),
+    ('user', '-U'),
+    ('password', '-P'),
+    ('instance', '-I'),
+    ('port', '-p'),
+    ('warning', '-w'),
+    ('critical', '-c'),
+    ('modes', '--modes'),
+    ('breaker', '--breaker'),
+]
+
+SPOOL_CHARS = string.ascii_letters + string.digits
+
+class FleetJob(object):
+
+    def __init__(self, host_name, args, service_prefix):
+        self.host_name = host_name
+        self.args = args
+        self.service_prefix = service_prefix
+        self.modes = []
+        self.results = []
+        self.error = None
+        self.error_code = 3
+        self.start_time = None
+        self.finish_time = None
+
+    def run(self, host_timeout):
+        self.start_time = time.time()
+        try:
+            try:
+                options = check_mssql_server.parse_args(self.args)
+            except SystemExit:
+                raise ValueError('invalid inventory entry')
+            self.modes = options.modes or ['time2connect']
+            if not options.modes:
+                options.modes = self.modes
+            #~ The -t budget of the plugin: login and queries give up on their own within the host
+            #~ timeout, so an abandoned job does not keep its thread and connection for long
+            options.timeout = host_timeout
+            login_timeout, timeout = mssql_common.start_deadline(options)
+            mssql, total, host = mssql_common.login(options, login_timeout, timeout)
+            try:
+                results = mssql_common.run_phase(options, 'query', check_mssql_server.collect_batch, mssql, options, host, total)
+                for result in results:
+                    code, stdout, perfdata = check_mssql_server.evaluate_result(options, *result)
+                    self.results.append((result[0], code, '%s: %s|%s' % (mssql_common.STATES[code], stdout, perfdata)))
+            finally:
+                mssql.close()
+        except mssql_common.NagiosReturn as e:
+            #~ e.g. an open --breaker, which may be configured to return CRITICAL
+            self.error = re.sub(r'^[A-Z]+: ', '', e.message)
+            self.error_code = e.code
+        except Exception as e:
+            self.error = str(e) or str(type(e))
+        self.finish_time = time.time()
+
+    def service_results(self, timed_out=False):
+        if timed_out:
+            error = 'Check of %s did not finish within the host timeout' % self.host_name
+        else:
+            error = self.error
+        if error:
+            #~ Keep the services of a failed host UNKNOWN rather than letting them go stale
+            code = not timed_out and self.error_code or 3
+            return [(mode, code, '%s: %s' % (mssql_common.STATES[code], error)) for mode in self.modes or ['time2connect']]
+        return self.results
+
+    def service_description(self, mode):
+        return '%s%s' % (self.service_prefix, mode)
+
+def load_inventory(filename):
+    #~ Raw, so passwords and ranges may contain %
+    inventory = RawConfigParser()
+    if not inventory.read(filename):
+        raise IOError('Could not read inventory %s' % filename)
+    jobs = []
+    for section in inventory.sections():
+        args = []
+        for key, flag in INVENTORY_OPTIONS:
+            if inventory.has_option(section, key):
+                args.extend([flag, inventory.get(section, key)])
+            elif key == 'hostname':
+                args.extend([flag, section])
+        prefix = ''
+        if inventory.has_option(section, 'service_prefix'):
+            #~ Allow quoting so a prefix can end in a space
+            prefix = inventory.get(section, 'service_prefix').strip('"')
+        job = FleetJob(section, args, prefix)
+        modes = inventory.has_option(section, 'modes') and inventory.get(section, 'modes')
+        if modes and modes != 'all':
+            job.modes = [m.strip() for m in modes.split(',') if m.strip()]
+        elif modes:
+            job.modes = [m for m in check_mssql_server.MODES if m != 'test']
+        jobs.append(job)
+    return jobs
+
+def run_fleet(jobs, workers, host_timeout):
+    pending = list(jobs)
+    running = {}
+    abandoned = []
+    timed_out = []
+    while pending or running:
+        now = time.time()
+        for thread, job in list(running.items()):
+            if not thread.is_alive():
+                del running[thread]
+            elif now - job.start_time > host_timeout:
+                #~ Reported now; the thread is left to its driver timeouts
+                del running[thread]
+                abandoned.append(thread)
+                timed_out.append(job)
+        #~ Abandoned threads keep their worker slot until they end, so there are never more
+        #~ than --workers threads and connections
+        abandoned = [thread for thread in abandoned if thread.is_alive()]
+        while pending and len(running) + len(abandoned) < workers:
+            job = pending.pop(0)
+            job.start_time = time.time()
+            thread = threading.Thread(target=job.run, args=(host_timeout,))
+            thread.daemon = True
+            thread.start()
+            running[thread] = job
+        time.sleep(0.01)
+    return timed_out
+
+def clean_output(output):
+    return output.replace('\n', ' ').strip()
+
+def write_command_file(filename, jobs, timed_out):
+    lines = []
+    for job in jobs:
+        for mode, code, output in job.service_results(job in timed_out):
+            lines.append('[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n' % (
+                job.finish_time or time.time(), job.host_name, job.service_description(mode), code, clean_output(output)))
+    if filename == '-':
+        sys.stdout.write(''.join(lines))
+        return
+    #~ The Nagios command file is a named pipe, write the whole batch at once
+    cmdfile = open(filename, 'a')
+    try:
+        cmdfile.write(''.join(lines))
+    finally:
+        cmdfile.close()
+
+def write_spool(directory, jobs, timed_out):
+    for job in jobs:
+        finish_time = job.finish_time or time.time()
+        entries = ['### Passive Check Result File ###\nfile_time=%d\n\n' % finish_time]
+        for mode, code, output in job.service_results(job in timed_out):
+            entries.append('### Nagios Service Check Result ###\n'
+                           'host_name=%s\nservice_description=%s\ncheck_type=1\ncheck_options=0\n'
+                           'scheduled_check=0\nreschedule_check=0\nlatency=0\n'
+                           'start_time=%f\nfinish_time=%f\nearly_timeout=0\nexited_ok=1\n'
+                           'return_code=%d\noutput=%s\n\n' % (
+                           job.host_name, job.service_description(mode), job.start_time or finish_time,
+                           finish_time, code, clean_output(output).replace('\\', '\\\\')))
+        fd, name = make_spool_file(directory)
+        spool = os.fdopen(fd, 'w')
+        try:
+            spool.write(''.join(entries))
+        finally:
+            spool.close()
+        #~ Nagios only picks up a result file once its .ok marker exists
+        open(name + '.ok', 'w').close()
+
+def make_spool_file(directory):
+    #~ Nagios only reads result files named c plus six characters
+    while True:
+        name = os.path.join(directory, 'c' + ''.join(random.choice(SPOOL_CHARS) for _ in range(6)))
+        try:
+            return os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644), name
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+def write_nrdp(filename, jobs, timed_out):
+    results = []
+    for job in jobs:
+        for mode, code, output in job.service_results(job in timed_out):
+            results.append('<checkresult type="service" checktype="1"><hostname>%s</hostname>'
+                           '<servicename>%s</servicename><state>%d</state><output>%s</output></checkresult>' % (
+                           escape(job.host_name), escape(job.service_description(mode)), code, escape(clean_output(output))))
+    nrdp = open(filename, 'w')
+    try:
+        nrdp.write('<?xml version="1.0"?>\n<checkresults>\n%s\n</checkresults>\n' % '\n'.join(results))
+    finally:
+        nrdp.close()
+
+def parse_args():
+    usage = "usage: %prog -i inventory.ini [--command-file file | --spool-dir dir | --nrdp-file file]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-i', '--inventory', help='Inventory file with one section per Nagios host.', default=None)
+    parser.add_option('--command-file', help='Nagios command file to write passive results to, - for stdout.', default=None)
+    parser.add_option('--spool-dir', help='Nagios check_result_path to write check result files to.', default=None)
+    parser.add_option('--nrdp-file', help='File to write NRDP checkresults XML to.', default=None)
+    parser.add_option('--workers', type='int', help='Hosts checked concurrently.', default=16)
+    parser.add_option('--host-timeout', type='float', help='Seconds before a host is reported UNKNOWN.', default=30)
+    options, _ = parser.parse_args()
+
+    if not options.inventory:
+        parser.error('Inventory is a required option.')
+    if not (options.command_file or options.spool_dir or options.nrdp_file):
+        options.command_file = '-'
+    if options.workers < 1:
+        parser.error('Workers must be at least 1.')
+    return options
+
+def main():
+    options = parse_args()
+    jobs = load_inventory(options.inventory)
+    timed_out = run_fleet(jobs, options.workers, options.host_timeout)
+    if options.command_file:
+        write_command_file(options.command_file, jobs, timed_out)
+    if options.spool_dir:
+        write_spool(options.spool_dir, jobs, timed_out)
+    if options.nrdp_file:
+        write_nrdp(options.nrdp_file, jobs, timed_out)
+
+if __name__ == '__main__':
+    try:
+        main()
+    except IOError as e:
+        print(e)
+        sys.exit(3)
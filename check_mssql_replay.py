@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+########################################################################
+# check_mssql_replay - Replays the query results captured with --record
+# through the checks, without SQL Server
+# Copyright (C) 2017 Nagios Enterprises
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+################### check_mssql_replay.py ##############################
+# Version    : 1.0.0
+# Date       : 10/18/2026
+# Maintainer : Nagios Enterprises, LLC
+# License    : GPLv2 (LICENSE.md / https://www.gnu.org/licenses/old-licenses/gpl-2.0.html)
+########################################################################
+
+import sys
+import json
+import time
+import shlex
+import shutil
+import tempfile
+from optparse import OptionParser
+
+import mssql_common
+import check_mssql_server
+import check_mssql_database
+import check_mssql
+
+PLUGINS = {
+    'server'    : check_mssql_server,
+    'database'  : check_mssql_database,
+    'combined'  : check_mssql,
+}
+
+class ReplayClock(object):
+
+    #~ Stands in for the time module of the plugins, so delta rates and state ages use the recorded times
+    def __init__(self):
+        self.now = None
+
+    def time(self):
+        if self.now is None:
+            return time.time()
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+class ReplayConnection(object):
+
+    def __init__(self, queries, clock):
+        self.queries = list(queries)
+        self.clock = clock
+
+    def cursor(self):
+        return ReplayCursor(self)
+
+    def close(self):
+        pass
+
+class ReplayCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query, params=None):
+        #~ Results are handed out in the order they were recorded
+        if not self.connection.queries:
+            raise Exception('The check sent more queries than were recorded: %s' % query)
+        when, _, rows = self.connection.queries.pop(0)
+        self.connection.clock.now = when
+        self.rows = [tuple(row) for row in rows]
+
+    def fetchone(self):
+        if not self.rows:
+            return None
+        row, self.rows = self.rows[0], self.rows[1:]
+        return row
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+def read_capture(filename):
+    capture = open(filename)
+    try:
+        for line in capture:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        capture.close()
+
+def replay_run(run, extra_args, clock):
+    module = PLUGINS[run['plugin']]
+    try:
+        options = module.parse_args(run['args'] + extra_args)
+    except SystemExit:
+        return 3, 'UNKNOWN: Recorded arguments rejected: %s' % ' '.join(run['args'] + extra_args)
+    #~ Nothing of the replay may reach the capture, the timings log or a daemon
+    options.record = None
+    options.timings_log = None
+    options.collector = None
+    clock.now = run['time']
+    connection = ReplayConnection(run['queries'], clock)
+    try:
+        module.run_check(connection, options, run['host'], run['total'])
+    except mssql_common.NagiosReturn as e:
+        return e.code, e.message
+    except Exception as e:
+        return 3, 'UNKNOWN: Replay failed: %s: %s' % (type(e).__name__, e)
+    return 3, 'UNKNOWN: The check returned no result'
+
+def format_time(when):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))
+
+def replay(options, extra_args):
+    clock = ReplayClock()
+    #~ mssql_common keeps the state stores, baselines and breakers of all of them
+    for module in list(PLUGINS.values()) + [mssql_common]:
+        module.time = clock
+    counts = {}
+    changed = 0
+    runs = 0
+    start = time.time()
+    for run in read_capture(options.capture):
+        code, output = replay_run(run, extra_args, clock)
+        runs += 1
+        key = (check_mssql_server.STATES[run['code']], check_mssql_server.STATES[code])
+        counts[key] = counts.get(key, 0) + 1
+        if code != run['code']:
+            changed += 1
+        elif options.changed:
+            continue
+        if not options.quiet:
+            state = key[0] == key[1] and key[0] or '%s->%s' % key
+            print('%s %s %s %s' % (format_time(run['time']), run['host'], state, output.split('\n')[0]))
+    elapsed = time.time() - start
+    if options.summary:
+        print('')
+        print('%d runs replayed in %.3fs (%.0f runs/s), %d changed state' % (runs, elapsed, runs / max(elapsed, 1e-6), changed))
+        for (recorded, replayed), count in sorted(counts.items()):
+            print('%-10s -> %-10s %d' % (recorded, replayed, count))
+    return changed
+
+def parse_args():
+    usage = "usage: %prog -f capture [--args 'plugin options'] [--changed] [--summary]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-f', '--capture', help='Capture file written by the plugins with --record.', default=None)
+    parser.add_option('--args', help='Plugin options added to the recorded ones, e.g. "-w 80 -c 90" to try new thresholds.', default='')
+    parser.add_option('--changed', action="store_true", help='Only print runs whose state differs from the recorded state.', default=False)
+    parser.add_option('--quiet', action="store_true", help='Do not print the runs.', default=False)
+    parser.add_option('--summary', action="store_true", help='Print the recorded against the replayed states and the replay speed.', default=False)
+    options, _ = parser.parse_args()
+    if not options.capture:
+        parser.error('Capture is a required option.')
+    return options
+
+def main():
+    options = parse_args()
+    #~ Delta state is rebuilt from the capture in a scratch directory, away from the real state files
+    scratch = tempfile.mkdtemp(prefix='mssql-replay-')
+    tempfile.tempdir = scratch
+    try:
+        changed = replay(options, shlex.split(options.args))
+    finally:
+        shutil.rmtree(scratch)
+    sys.exit(changed and 1 or 0)
+
+if __name__ == '__main__':
+    try:
+        main()
+    except IOError as e:
+        print(e)
+        sys.exit(3)
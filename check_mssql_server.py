@@ -19,43 +19,157 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 #
 ################### check_mssql_server.py ##############################
-# Version    : 2.1.1
-# Date       : 03/12/2019
+# Version    : 2.2.0
+# Date       : 10/18/2026
 # Maintainer : Nagios Enterprises, LLC
 # License    : GPLv2 (LICENSE.md / https://www.gnu.org/licenses/old-licenses/gpl-2.0.html)
 ########################################################################
 
-import pymssql
 import time
 import sys
-import tempfile
-try:
-    import cPickle as pickle
-except:
-    import pickle
+import os
+import re
 from optparse import OptionParser, OptionGroup
 
-BASE_QUERY = "SELECT cntr_value FROM sysperfinfo WHERE counter_name='%s' AND instance_name='';"
-INST_QUERY = "SELECT cntr_value FROM sysperfinfo WHERE counter_name='%s' AND instance_name='%s';"
-OBJE_QUERY = "SELECT cntr_value FROM sysperfinfo WHERE counter_name='%s';"
-DIVI_QUERY = "SELECT cntr_value FROM sysperfinfo WHERE counter_name LIKE '%s%%' AND instance_name='%s';"
-CON_QUERY = "SELECT count(*) FROM sys.sysprocesses;"
+from mssql_common import (PLAN_TAG, STATES, NagiosReturn, execute_sql,
+    host_filename, write_json_file, run_phase, StateStore, login, connection_host, connect_db, unsupported_modes,
+    with_server_time, state_key, mode_options, parse_range, counter_match, counter_patterns, driver_errors, unreachable, mark_phase,
+    run_main, check_plugin, get_states, get_state, return_nagios, get_mode_threshold, evaluate_result,
+    return_nagios_multi, return_probe, MSSQLQuery, MSSQLDivideQuery, MSSQLDeltaQuery,
+    add_startup_options, add_timing_options,
+    add_delta_options, check_delta_options, add_timeout_option,
+    add_breaker_options, add_record_option,
+    add_baseline_options, check_baseline_options, check_collector_options)
+
+#~ pymssql and the modules the state/collector helpers need are imported where they are used,
+#~ so usage errors, the collector client and simple modes start quickly
+
+#~ Statements take their values as sp_executesql parameters, see execute_sql
+BASE_QUERY = "SELECT cntr_value FROM sysperfinfo WHERE counter_name=@counter AND instance_name=@instance;"
+OBJE_QUERY = "SELECT cntr_value FROM sysperfinfo WHERE counter_name=@counter;"
+DIVI_QUERY = "SELECT cntr_value FROM sysperfinfo WHERE counter_name LIKE @counter + N'%' AND instance_name=@instance;"
+#~ The user sessions, counted like the totals of SESSION_QUERY
+CON_QUERY = "SELECT COUNT(*) FROM sys.dm_exec_sessions WHERE is_user_process = 1;"
+#~ Grouped and cut to the top groups on the server; every row carries the totals over all groups
+SESSION_QUERY = "SELECT TOP (@top) %(columns)s, COUNT(*), COUNT(r.session_id), " +\
+    "SUM(COUNT(*)) OVER (), COUNT(*) OVER (), SUM(COUNT(r.session_id)) OVER () " +\
+    "FROM sys.dm_exec_sessions s LEFT JOIN sys.dm_exec_requests r ON r.session_id = s.session_id " +\
+    "WHERE s.is_user_process = 1 GROUP BY %(columns)s ORDER BY COUNT(*) DESC;"
 MEM_QUERY = "SELECT 100*(1.0-(available_physical_memory_kb/(total_physical_memory_kb*1.0))) FROM sys.dm_os_sys_memory;" 
-CPU_QUERY = "SELECT "+\
-    "record.value('(./Record/SchedulerMonitorEvent/SystemHealth/ProcessUtilization)[1]', 'int') AS [CPU] "+\
+#~ The counters of a batch or probe are one @counters parameter, see batch_counters
+BATC_QUERY = "SELECT RTRIM(counter_name), RTRIM(instance_name), cntr_value FROM sysperfinfo WHERE %s;" % counter_match()
+PROBE_QUERY = "SELECT RTRIM(object_name), RTRIM(counter_name), RTRIM(instance_name), cntr_value FROM sysperfinfo " +\
+    "WHERE %s;" % counter_match()
+VERSION_QUERY = "SELECT CAST(SERVERPROPERTY('ProductVersion') AS nvarchar(128));"
+CATALOG_QUERY = "SELECT RTRIM(object_name), RTRIM(counter_name), RTRIM(instance_name), cntr_type FROM sys.dm_os_performance_counters;"
+COUNTER_QUERY = "SELECT cntr_value FROM sys.dm_os_performance_counters WHERE object_name=@object AND instance_name=@instance " +\
+    "AND counter_name=@counter;"
+#~ The counter and its base, the base sorted last as MSSQLDivideQuery expects
+COUNTER_BASE_QUERY = "SELECT cntr_value FROM sys.dm_os_performance_counters WHERE object_name=@object AND instance_name=@instance " +\
+    "AND counter_name IN (@counter, @base) ORDER BY CASE WHEN counter_name=@base THEN 1 ELSE 0 END;"
+#~ The LEFT JOIN keeps the clock row even when no wait has accumulated time yet
+WAIT_QUERY = "SELECT i.ms_ticks, i.sqlserver_start_time_ms_ticks, w.wait_type, w.wait_time_ms, w.signal_wait_time_ms " +\
+    "FROM sys.dm_os_sys_info i LEFT JOIN sys.dm_os_wait_stats w ON w.wait_time_ms > 0;"
+FILE_QUERY = "SELECT i.ms_ticks, i.sqlserver_start_time_ms_ticks, f.database_id, f.file_id, DB_NAME(f.database_id), m.name, " +\
+    "f.num_of_reads, f.num_of_bytes_read, f.io_stall_read_ms, f.num_of_writes, f.num_of_bytes_written, f.io_stall_write_ms " +\
+    "FROM sys.dm_os_sys_info i CROSS JOIN sys.dm_io_virtual_file_stats(NULL, NULL) f " +\
+    "LEFT JOIN sys.master_files m ON m.database_id = f.database_id AND m.file_id = f.file_id;"
+#~ Only records newer than the last one seen (and within CPU_WINDOW) are converted to XML;
+#~ if ms_ticks went backwards the server rebooted and the whole window is read again
+CPU_QUERY = "SELECT x.[timestamp], "+\
+    "x.record.value('(./Record/SchedulerMonitorEvent/SystemHealth/ProcessUtilization)[1]', 'int'), "+\
+    "x.record.value('(./Record/SchedulerMonitorEvent/SystemHealth/SystemIdle)[1]', 'int') "+\
     "FROM ( "+\
-        "SELECT[timestamp], CONVERT(XML, record) AS [record] "+\
-            "FROM sys.dm_os_ring_buffers WITH ( NOLOCK ) "+\
-            "WHERE ring_buffer_type=N'RING_BUFFER_SCHEDULER_MONITOR' "+\
-            "AND record LIKE N'%<SystemHealth>%'"+\
-    ") as x;"
+        "SELECT rb.[timestamp], CONVERT(XML, rb.record) AS [record] "+\
+            "FROM sys.dm_os_ring_buffers rb WITH ( NOLOCK ) CROSS JOIN sys.dm_os_sys_info i "+\
+            "WHERE rb.ring_buffer_type=N'RING_BUFFER_SCHEDULER_MONITOR' "+\
+            "AND rb.record LIKE N'%<SystemHealth>%' "+\
+            "AND rb.[timestamp] > i.ms_ticks - @window "+\
+            "AND (rb.[timestamp] > @since OR i.ms_ticks < @since)"+\
+    ") as x ORDER BY x.[timestamp] DESC;"
+#~ The cached plans of the statements sent by the plugins, recognised by PLAN_TAG: the Prepared plans of
+#~ the parameterized statements, and apart from them the Adhoc EXEC sp_executesql batches that carry the
+#~ values. Only those two kinds of plan have their text looked up
+PLAN_QUERY = "SELECT p.objtype, COUNT(*), SUM(CAST(p.usecounts AS bigint)), SUM(CASE WHEN p.usecounts = 1 THEN 1 ELSE 0 END), " +\
+    "SUM(CAST(p.size_in_bytes AS bigint)) FROM sys.dm_exec_cached_plans p " +\
+    "CROSS APPLY sys.dm_exec_sql_text(p.plan_handle) t WHERE p.cacheobjtype = N'Compiled Plan' " +\
+    "AND p.objtype IN (N'Prepared', N'Adhoc') AND t.[text] LIKE @tag GROUP BY p.objtype;"
+
+CPU_WINDOW = 15 * 60 * 1000
+CATALOG_MAX_AGE = 86400
+
+#~ How --counter computes a value from the counter's cntr_type
+CNTR_TYPES = {
+    65536       : 'standard',   #~ PERF_COUNTER_RAWCOUNT
+    65792       : 'standard',   #~ PERF_COUNTER_LARGE_RAWCOUNT
+    272696320   : 'delta',      #~ PERF_COUNTER_COUNTER
+    272696576   : 'delta',      #~ PERF_COUNTER_BULK_COUNT
+    537003264   : 'divide',     #~ PERF_LARGE_RAW_FRACTION
+    1073874176  : 'average',    #~ PERF_AVERAGE_BULK
+    1073939712  : 'standard',   #~ PERF_LARGE_RAW_BASE
+}
+
+#~ Idle and background waits that say nothing about what queries wait on
+BENIGN_WAITS = frozenset([
+    'BROKER_EVENTHANDLER', 'BROKER_RECEIVE_WAITFOR', 'BROKER_TASK_STOP', 'BROKER_TO_FLUSH', 'BROKER_TRANSMITTER',
+    'CHECKPOINT_QUEUE', 'CHKPT', 'CLR_AUTO_EVENT', 'CLR_MANUAL_EVENT', 'CLR_SEMAPHORE', 'CXCONSUMER',
+    'DBMIRROR_DBM_EVENT', 'DBMIRROR_EVENTS_QUEUE', 'DBMIRROR_WORKER_QUEUE', 'DBMIRRORING_CMD', 'DIRTY_PAGE_POLL',
+    'DISPATCHER_QUEUE_SEMAPHORE', 'EXECSYNC', 'FSAGENT', 'FT_IFTS_SCHEDULER_IDLE_WAIT', 'FT_IFTSHC_MUTEX',
+    'HADR_CLUSAPI_CALL', 'HADR_FILESTREAM_IOMGR_IOCOMPLETION', 'HADR_LOGCAPTURE_WAIT', 'HADR_NOTIFICATION_DEQUEUE',
+    'HADR_TIMER_TASK', 'HADR_WORK_QUEUE', 'KSOURCE_WAKEUP', 'LAZYWRITER_SLEEP', 'LOGMGR_QUEUE',
+    'MEMORY_ALLOCATION_EXT', 'ONDEMAND_TASK_QUEUE', 'PARALLEL_REDO_DRAIN_WORKER', 'PARALLEL_REDO_LOG_CACHE',
+    'PARALLEL_REDO_TRAN_LIST', 'PARALLEL_REDO_WORKER_SYNC', 'PARALLEL_REDO_WORKER_WAIT_WORK',
+    'PREEMPTIVE_OS_FLUSHFILEBUFFERS', 'PREEMPTIVE_XE_GETTARGETSTATE', 'PVS_PREALLOCATE',
+    'PWAIT_ALL_COMPONENTS_INITIALIZED', 'PWAIT_DIRECTLOGCONSUMER_GETNEXT', 'PWAIT_EXTENSIBILITY_CLEANUP_TASK',
+    'QDS_PERSIST_TASK_MAIN_LOOP_SLEEP', 'QDS_ASYNC_QUEUE', 'QDS_CLEANUP_STALE_QUERIES_TASK_MAIN_LOOP_SLEEP',
+    'QDS_SHUTDOWN_QUEUE', 'REDO_THREAD_PENDING_WORK', 'REQUEST_FOR_DEADLOCK_SEARCH', 'RESOURCE_QUEUE',
+    'SERVER_IDLE_CHECK', 'SLEEP_BPOOL_FLUSH', 'SLEEP_DBSTARTUP', 'SLEEP_DCOMSTARTUP', 'SLEEP_MASTERDBREADY',
+    'SLEEP_MASTERMDREADY', 'SLEEP_MASTERUPGRADED', 'SLEEP_MSDBSTARTUP', 'SLEEP_SYSTEMTASK', 'SLEEP_TASK',
+    'SLEEP_TEMPDBSTARTUP', 'SNI_HTTP_ACCEPT', 'SOS_WORK_DISPATCHER', 'SP_SERVER_DIAGNOSTICS_SLEEP',
+    'SQLTRACE_BUFFER_FLUSH', 'SQLTRACE_INCREMENTAL_FLUSH_SLEEP', 'SQLTRACE_WAIT_ENTRIES', 'VDI_CLIENT_OTHER',
+    'WAIT_FOR_RESULTS', 'WAITFOR', 'WAITFOR_TASKSHUTDOWN', 'WAIT_XTP_RECOVERY', 'WAIT_XTP_HOST_WAIT',
+    'WAIT_XTP_OFFLINE_CKPT_NEW_LOG', 'WAIT_XTP_CKPT_CLOSE', 'XE_DISPATCHER_JOIN', 'XE_DISPATCHER_WAIT',
+    'XE_TIMER_EVENT',
+])
+
+#~ Wait type prefixes and the category they are reported under, first match wins
+WAIT_CATEGORIES = [
+    ('LCK_M_', 'lock'),
+    ('PAGEIOLATCH_', 'bufferio'),
+    ('PAGELATCH_', 'bufferlatch'),
+    ('LATCH_', 'latch'),
+    ('WRITELOG', 'tranlogio'),
+    ('LOGBUFFER', 'tranlogio'),
+    ('LOG_RATE_GOVERNOR', 'tranlogio'),
+    ('ASYNC_NETWORK_IO', 'networkio'),
+    ('SOS_SCHEDULER_YIELD', 'cpu'),
+    ('THREADPOOL', 'workerthread'),
+    ('CXPACKET', 'parallelism'),
+    ('RESOURCE_SEMAPHORE', 'memory'),
+    ('CMEMTHREAD', 'memory'),
+    ('IO_COMPLETION', 'diskio'),
+    ('ASYNC_IO_COMPLETION', 'diskio'),
+    ('BACKUPIO', 'diskio'),
+    ('HADR_SYNC_COMMIT', 'replication'),
+    ('PREEMPTIVE_', 'preemptive'),
+]
+WAIT_CATEGORY_NAMES = sorted(set([name for _, name in WAIT_CATEGORIES] + ['other']))
+
+#~ --group-by names and the sys.dm_exec_sessions columns they group on
+SESSION_GROUPS = {
+    'login'     : 's.login_name',
+    'host'      : 's.host_name',
+    'program'   : 's.program_name',
+    'database'  : 'DB_NAME(s.database_id)',
+    'status'    : 's.status',
+}
 
 MODES = {
 
-    'connections'       : { 'help'      : 'Number of open connections',
-                            'stdout'    : 'Number of open connections is %s',
+    'connections'       : { 'help'      : 'Number of user sessions, or with --group-by the sessions of the largest group',
+                            'stdout'    : 'Number of user sessions is %s',
                             'label'     : 'connections',
-                            'type'      : 'standard',
+                            'type'      : 'sessions',
                             'query'     : CON_QUERY 
                             },
 
@@ -67,15 +181,43 @@ MODES = {
 
     'cpu'               : { 'help'      : 'Server CPU utilization',
                             'stdout'    : 'Current CPU utilization is %s%%',
-                            'label'    : 'cpu',
-                            'query'     : CPU_QUERY
+                            'label'     : 'cpu',
+                            'unit'      : '%',
+                            'query'     : CPU_QUERY,
+                            'type'      : 'ringbuffer'
+                            },
+
+    'waitstats'         : { 'help'      : 'Wait time per second from sys.dm_os_wait_stats, with the top waits',
+                            'stdout'    : 'Waiting %s ms/sec',
+                            'label'     : 'wait_time',
+                            'unit'      : 'ms',
+                            'query'     : WAIT_QUERY,
+                            'type'      : 'waitstats'
+                            },
+
+    'filelatency'       : { 'help'      : 'Worst read or write latency of any database file in ms per I/O from '
+                                          'sys.dm_io_virtual_file_stats, with IOPS and throughput per database',
+                            'stdout'    : 'Worst file latency is %s ms',
+                            'label'     : 'file_latency',
+                            'unit'      : 'ms',
+                            'query'     : FILE_QUERY,
+                            'type'      : 'filestats'
+                            },
+
+    'plancache'         : { 'help'      : 'Cached plans of the statements sent by the plugins and how often they are reused',
+                            'stdout'    : 'Plugin statements hold %s prepared plans',
+                            'label'     : 'plugin_plans',
+                            'query'     : PLAN_QUERY,
+                            'type'      : 'plancache'
                             },
 
     'bufferhitratio'    : { 'help'      : 'Buffer Cache Hit Ratio',
                             'stdout'    : 'Buffer Cache Hit Ratio is %s%%',
                             'label'     : 'buffer_cache_hit_ratio',
                             'unit'      : '%',
-                            'query'     : DIVI_QUERY % ('Buffer cache hit ratio', ''),
+                            'query'     : DIVI_QUERY,
+                            'counter'   : 'Buffer cache hit ratio',
+                            'instance'  : '',
                             'type'      : 'divide',
                             'modifier'  : 100,
                             },
@@ -83,7 +225,9 @@ MODES = {
     'pagelooks'         : { 'help'      : 'Page Lookups Per Second',
                             'stdout'    : 'Page Lookups Per Second is %s',
                             'label'     : 'page_lookups',
-                            'query'     : BASE_QUERY % 'Page lookups/sec',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Page lookups/sec',
+                            'instance'  : '',
                             'type'      : 'delta'
                             },
     
@@ -91,48 +235,62 @@ MODES = {
                             'stdout'    : 'Free pages is %s',
                             'label'     : 'free_pages',
                             'type'      : 'standard',
-                            'query'     : BASE_QUERY % 'Free pages'
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Free pages',
+                            'instance'  : '',
                             },
                             
     'totalpages'        : { 'help'      : 'Total Pages (Cumulative)',
                             'stdout'    : 'Total pages is %s',
                             'label'     : 'totalpages',
                             'type'      : 'standard',
-                            'query'     : BASE_QUERY % 'Total pages',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Total pages',
+                            'instance'  : '',
                             },
                             
     'targetpages'       : { 'help'      : 'Target Pages',
                             'stdout'    : 'Target pages are %s',
                             'label'     : 'target_pages',
                             'type'      : 'standard',
-                            'query'     : BASE_QUERY % 'Target pages',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Target pages',
+                            'instance'  : '',
                             },
                             
     'databasepages'     : { 'help'      : 'Database Pages',
                             'stdout'    : 'Database pages are %s',
                             'label'     : 'database_pages',
                             'type'      : 'standard',
-                            'query'     : BASE_QUERY % 'Database pages',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Database pages',
+                            'instance'  : '',
                             },
     
     'stolenpages'       : { 'help'      : 'Stolen Pages',
                             'stdout'    : 'Stolen pages are %s',
                             'label'     : 'stolen_pages',
                             'type'      : 'standard',
-                            'query'     : BASE_QUERY % 'Stolen pages',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Stolen pages',
+                            'instance'  : '',
                             },
     
     'lazywrites'        : { 'help'      : 'Lazy Writes / Sec',
                             'stdout'    : 'Lazy Writes / Sec is %s/sec',
                             'label'     : 'lazy_writes',
-                            'query'     : BASE_QUERY % 'Lazy writes/sec',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Lazy writes/sec',
+                            'instance'  : '',
                             'type'      : 'delta'
                             },
     
     'readahead'         : { 'help'      : 'Readahead Pages / Sec',
                             'stdout'    : 'Readahead Pages / Sec is %s/sec',
                             'label'     : 'readaheads',
-                            'query'     : BASE_QUERY % 'Readahead pages/sec',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Readahead pages/sec',
+                            'instance'  : '',
                             'type'      : 'delta',
                             },
                             
@@ -140,14 +298,18 @@ MODES = {
     'pagereads'         : { 'help'      : 'Page Reads / Sec',
                             'stdout'    : 'Page Reads / Sec is %s/sec',
                             'label'     : 'page_reads',
-                            'query'     : BASE_QUERY % 'Page reads/sec',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Page reads/sec',
+                            'instance'  : '',
                             'type'      : 'delta'
                             },
     
     'checkpoints'       : { 'help'      : 'Checkpoint Pages / Sec',
                             'stdout'    : 'Checkpoint Pages / Sec is %s/sec',
                             'label'     : 'checkpoint_pages',
-                            'query'     : BASE_QUERY % 'Checkpoint pages/Sec',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Checkpoint pages/Sec',
+                            'instance'  : '',
                             'type'      : 'delta'
                             },
                             
@@ -155,35 +317,45 @@ MODES = {
     'pagewrites'        : { 'help'      : 'Page Writes / Sec',
                             'stdout'    : 'Page Writes / Sec is %s/sec',
                             'label'     : 'page_writes',
-                            'query'     : BASE_QUERY % 'Page writes/sec',
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Page writes/sec',
+                            'instance'  : '',
                             'type'      : 'delta',
                             },
     
     'lockrequests'      : { 'help'      : 'Lock Requests / Sec',
                             'stdout'    : 'Lock Requests / Sec is %s/sec',
                             'label'     : 'lock_requests',
-                            'query'     : INST_QUERY % ('Lock requests/sec', '_Total'),
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Lock requests/sec',
+                            'instance'  : '_Total',
                             'type'      : 'delta',
                             },
     
     'locktimeouts'      : { 'help'      : 'Lock Timeouts / Sec',
                             'stdout'    : 'Lock Timeouts / Sec is %s/sec',
                             'label'     : 'lock_timeouts',
-                            'query'     : INST_QUERY % ('Lock timeouts/sec', '_Total'),
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Lock timeouts/sec',
+                            'instance'  : '_Total',
                             'type'      : 'delta',
                             },
     
     'deadlocks'         : { 'help'      : 'Deadlocks / Sec',
                             'stdout'    : 'Deadlocks / Sec is %s/sec',
                             'label'     : 'deadlocks',
-                            'query'     : INST_QUERY % ('Number of Deadlocks/sec', '_Total'),
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Number of Deadlocks/sec',
+                            'instance'  : '_Total',
                             'type'      : 'delta',
                             },
     
     'lockwaits'         : { 'help'      : 'Lockwaits / Sec',
                             'stdout'    : 'Lockwaits / Sec is %s/sec',
                             'label'     : 'lockwaits',
-                            'query'     : INST_QUERY % ('Lock Waits/sec', '_Total'),
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Lock Waits/sec',
+                            'instance'  : '_Total',
                             'type'      : 'delta',
                             },
     
@@ -191,7 +363,9 @@ MODES = {
                             'stdout'    : 'Lock Wait Time (ms) is %sms',
                             'label'     : 'lockwait',
                             'unit'      : 'ms',
-                            'query'     : INST_QUERY % ('Lock Wait Time (ms)', '_Total'),
+                            'query'     : BASE_QUERY,
+                            'counter'   : 'Lock Wait Time (ms)',
+                            'instance'  : '_Total',
                             'type'      : 'standard',
                             },
     
@@ -199,21 +373,27 @@ MODES = {
                             'stdout'    : 'Average Wait Time (ms) is %sms',
                             'label'     : 'averagewait',
                             'unit'      : 'ms',
-                            'query'     : DIVI_QUERY % ('Average Wait Time', '_Total'),
+                            'query'     : DIVI_QUERY,
+                            'counter'   : 'Average Wait Time',
+                            'instance'  : '_Total',
                             'type'      : 'divide',
                             },
     
     'pagesplits'        : { 'help'      : 'Page Splits / Sec',
                             'stdout'    : 'Page Splits / Sec is %s/sec',
                             'label'     : 'page_splits',
-                            'query'     : OBJE_QUERY % 'Page Splits/sec',
+                            'query'     : OBJE_QUERY,
+                            'counter'   : 'Page Splits/sec',
+                            'instance'  : None,
                             'type'      : 'delta',
                             },
     
     'cachehit'          : { 'help'      : 'Cache Hit Ratio',
                             'stdout'    : 'Cache Hit Ratio is %s%%',
                             'label'     : 'cache_hit_ratio',
-                            'query'     : DIVI_QUERY % ('Cache Hit Ratio', '_Total'),
+                            'query'     : DIVI_QUERY,
+                            'counter'   : 'Cache Hit Ratio',
+                            'instance'  : '_Total',
                             'type'      : 'divide',
                             'unit'      : '%',
                             'modifier'  : 100,
@@ -222,156 +402,53 @@ MODES = {
     'batchreq'          : { 'help'      : 'Batch Requests / Sec',
                             'stdout'    : 'Batch Requests / Sec is %s/sec',
                             'label'     : 'batch_requests',
-                            'query'     : OBJE_QUERY % 'Batch Requests/sec',
+                            'query'     : OBJE_QUERY,
+                            'counter'   : 'Batch Requests/sec',
+                            'instance'  : None,
                             'type'      : 'delta',
                             },
     
     'sqlcompilations'   : { 'help'      : 'SQL Compilations / Sec',
                             'stdout'    : 'SQL Compilations / Sec is %s/sec',
                             'label'     : 'sql_compilations',
-                            'query'     : OBJE_QUERY % 'SQL Compilations/sec',
+                            'query'     : OBJE_QUERY,
+                            'counter'   : 'SQL Compilations/sec',
+                            'instance'  : None,
                             'type'      : 'delta',
                             },
     
     'fullscans'         : { 'help'      : 'Full Scans / Sec',
                             'stdout'    : 'Full Scans / Sec is %s/sec',
                             'label'     : 'full_scans',
-                            'query'     : OBJE_QUERY % 'Full Scans/sec',
+                            'query'     : OBJE_QUERY,
+                            'counter'   : 'Full Scans/sec',
+                            'instance'  : None,
                             'type'      : 'delta',
                             },
     
     'pagelife'          : { 'help'      : 'Page Life Expectancy',
                             'stdout'    : 'Page Life Expectancy is %s/sec',
                             'label'     : 'page_life_expectancy',
-                            'query'     : OBJE_QUERY % 'Page life expectancy',
+                            'query'     : OBJE_QUERY,
+                            'counter'   : 'Page life expectancy',
+                            'instance'  : None,
                             'type'      : 'standard'
                             },
     
     #~ 'debug'             : { 'help'      : 'Used as a debugging tool.',
                             #~ 'stdout'    : 'Debugging: ',
                             #~ 'label'     : 'debug',
-                            #~ 'query'     : DIVI_QUERY % ('Average Wait Time', '_Total'),
+                            #~ 'query'     : DIVI_QUERY,
                             #~ 'type'      : 'divide' 
                             #~ },
     
     'time2connect'      : { 'help'      : 'Time to connect to the database.' },
     
-    'test'              : { 'help'      : 'Run tests of all queries against the database.' },
+    'test'              : { 'help'      : 'Probe which modes the server supports and cache the result for later checks.' },
 
 }
 
-def return_nagios(options, stdout='', result='', unit='', label=''):
-    if is_within_range(options.critical, result):
-        prefix = 'CRITICAL: '
-        code = 2
-    elif is_within_range(options.warning, result):
-        prefix = 'WARNING: '
-        code = 1
-    else:
-        prefix = 'OK: '
-        code = 0
-    strresult = str(result)
-    try:
-        stdout = stdout % (strresult)
-    except TypeError as e:
-        pass
-    stdout = '%s%s|%s=%s%s;%s;%s;;' % (prefix, stdout, label, strresult, unit, options.warning or '', options.critical or '')
-    raise NagiosReturn(stdout, code)
-
-class NagiosReturn(Exception):
-    
-    def __init__(self, message, code):
-        self.message = message
-        self.code = code
-
-class MSSQLQuery(object):
-    
-    def __init__(self, query, options, label='', unit='', stdout='', host='', modifier=1, *args, **kwargs):
-        self.query = query
-        self.label = label
-        self.unit = unit
-        self.stdout = stdout
-        self.options = options
-        self.host = host
-        self.modifier = modifier
-    
-    def run_on_connection(self, connection):
-        cur = connection.cursor()
-        cur.execute(self.query)
-        self.query_result = cur.fetchone()[0]
-    
-    def finish(self):
-        return_nagios(  self.options,
-                        self.stdout,
-                        self.result,
-                        self.unit,
-                        self.label )
-    
-    def calculate_result(self):
-        self.result = float(self.query_result) * self.modifier
-    
-    def do(self, connection):
-        self.run_on_connection(connection)
-        self.calculate_result()
-        self.finish()
-
-class MSSQLDivideQuery(MSSQLQuery):
-    
-    def __init__(self, *args, **kwargs):
-        super(MSSQLDivideQuery, self).__init__(*args, **kwargs)
-    
-    def calculate_result(self):
-        if self.query_result[1] != 0:
-            self.result = (float(self.query_result[0]) / self.query_result[1]) * self.modifier
-        else:
-            self.result = float(self.query_result[0]) * self.modifier
-    
-    def run_on_connection(self, connection):
-        cur = connection.cursor()
-        cur.execute(self.query)
-        self.query_result = [x[0] for x in cur.fetchall()]
-
-class MSSQLDeltaQuery(MSSQLQuery):
-    
-    def make_pickle_name(self):
-        tmpdir = tempfile.gettempdir()
-        tmpname = hash(self.host + self.query)
-        self.picklename = '%s/mssql-%s.tmp' % (tmpdir, tmpname)
-    
-    def calculate_result(self):
-        self.make_pickle_name()
-        
-        try:
-            tmpfile = open(self.picklename)
-        except IOError:
-            tmpfile = open(self.picklename, 'w')
-            tmpfile.close()
-            tmpfile = open(self.picklename)
-        try:
-            try:
-                last_run = pickle.load(tmpfile)
-            except EOFError as ValueError:
-                last_run = { 'time' : None, 'value' : None }
-        finally:
-            tmpfile.close()
-        
-        if last_run['time']:
-            old_time = last_run['time']
-            new_time = time.time()
-            old_val  = last_run['query_result']
-            new_val  = self.query_result
-            self.result = ((new_val - old_val) / (new_time - old_time)) * self.modifier
-        else:
-            self.result = None
-        
-        new_run = { 'time' : time.time(), 'query_result' : self.query_result }
-        
-        #~ Will throw IOError, leaving it to acquiesce
-        tmpfile = open(self.picklename, 'w')
-        pickle.dump(new_run, tmpfile)
-        tmpfile.close()
-
-def parse_args():
+def parse_args(args=None, add_options=None, check_options=None):
     usage = "usage: %prog -H hostname -U user -P password -T table --mode"
     parser = OptionParser(usage=usage)
     
@@ -384,19 +461,62 @@ def parse_args():
     connection = OptionGroup(parser, "Optional Connection Information")
     connection.add_option('-I', '--instance', help='Specify instance', default=None)
     connection.add_option('-p', '--port', help='Specify port.', default=None)
+    connection.add_option('--collector', help='Run the check through the check_mssql_collector.py daemon '
+                          'listening on this Unix socket, connecting directly if it is not running.', default=None)
+    connection.add_option('--snapshot-ttl', type='float', help='Share one snapshot of all sysperfinfo counters between '
+                          'the checks of the host and credentials for this many seconds, so only the first check of a '
+                          'burst logs in. Keep it below the check interval.', default=None)
     parser.add_option_group(connection)
     
+    add_breaker_options(parser)
+    
     nagios = OptionGroup(parser, "Nagios Plugin Information")
     nagios.add_option('-w', '--warning', help='Specify warning range.', default=None)
     nagios.add_option('-c', '--critical', help='Specify critical range.', default=None)
+    add_timeout_option(nagios)
     parser.add_option_group(nagios)
     
+    add_timing_options(nagios)
+    add_record_option(nagios)
+    add_startup_options(nagios)
+    
+    add_delta_options(parser)
+    
+    waits = OptionGroup(parser, "Wait Statistics Options")
+    waits.add_option('--top', type='int', help='Number of waits listed by --waitstats, files by --filelatency and '
+                     'groups by --connections --group-by.', default=5)
+    waits.add_option('--category-warning', help='Warning ranges per wait category in ms/sec, e.g. lock=100,bufferio=200. '
+                     'Categories: %s.' % ', '.join(WAIT_CATEGORY_NAMES), default=None)
+    waits.add_option('--category-critical', help='Critical ranges per wait category in ms/sec.', default=None)
+    parser.add_option_group(waits)
+    
+    files = OptionGroup(parser, "File Latency Options")
+    files.add_option('--min-ios', type='int', help='Reads or writes a file needs since the last run before --filelatency '
+                     'counts its latency, so a single slow I/O on an idle file does not alert.', default=1)
+    parser.add_option_group(files)
+    
+    add_baseline_options(parser)
+    
+    sessions = OptionGroup(parser, "Connection Options")
+    sessions.add_option('--group-by', help='Group the user sessions counted by --connections by a comma separated '
+                        'list of %s, applying the thresholds to the largest group.' % ', '.join(sorted(SESSION_GROUPS)), default=None)
+    parser.add_option_group(sessions)
+    
+    #~ check_mssql.py adds its database options through these hooks
+    if add_options:
+        add_options(parser)
+    
     mode = OptionGroup(parser, "Mode Options")
     global MODES
-    for k, v in zip(list(MODES.keys()), list(MODES.values())):
+    mode.add_option('--modes', help='Comma separated list of modes (or "all") to check in one run. '
+                    'Thresholds may be given per mode, e.g. -w pagelife=300:,cpu=80', default=None)
+    mode.add_option('--counter', help='Check any performance counter, given as object:counter[:instance], '
+                    'e.g. "Buffer Manager:Page life expectancy". Raw, rate, ratio or average is chosen from its cntr_type.', default=None)
+    for k in mode_options(parser, args, MODES):
+        v = MODES[k]
         mode.add_option('--%s' % k, action="store_true", help=v.get('help'), default=False)
     parser.add_option_group(mode)
-    options, _ = parser.parse_args()
+    options, _ = parser.parse_args(args)
     
     if not options.hostname:
         parser.error('Hostname is a required option.')
@@ -410,49 +530,77 @@ def parse_args():
     
     options.mode = None
     for arg in mode.option_list:
+        if arg.dest not in MODES:
+            continue
         if getattr(options, arg.dest) and options.mode:
             parser.error("Must choose one and only Mode Option.")
         elif getattr(options, arg.dest):
             options.mode = arg.dest
     
+    check_delta_options(parser, options)
+    
+    for nagstring in (options.category_warning, options.category_critical):
+        for item in (nagstring or '').split(','):
+            if '=' in item and item.partition('=')[0].strip() not in WAIT_CATEGORY_NAMES:
+                parser.error("Unknown wait category: %s" % item)
+    
+    check_baseline_options(parser, options)
+    check_collector_options(parser, options)
+    
+    if options.group_by:
+        options.group_by = [g.strip() for g in options.group_by.split(',') if g.strip()]
+        for g in options.group_by:
+            if g not in SESSION_GROUPS:
+                parser.error("Unknown --group-by column: %s" % g)
+    
+    if options.counter:
+        if options.mode or options.modes:
+            parser.error("Cannot combine --counter with other Mode Options.")
+        options.counter = parse_counter(options.counter)
+        if not options.counter:
+            parser.error("--counter must be given as object:counter[:instance].")
+        options.mode = 'counter'
+    
+    if options.modes:
+        if options.mode:
+            parser.error("Cannot combine --modes with a single Mode Option.")
+        if options.modes == 'all':
+            options.modes = [k for k in MODES if k != 'test']
+        else:
+            options.modes = [k.strip() for k in options.modes.split(',') if k.strip()]
+        for k in options.modes:
+            if k not in MODES or k == 'test':
+                parser.error("Unknown mode in --modes: %s" % k)
+    
+    if check_options:
+        check_options(parser, options)
     return options
 
 def is_within_range(nagstring, value):
     if not nagstring:
         return False
-    import re
-    import operator
-    first_float = r'(?P<first>(-?[0-9]+(\.[0-9]+)?))'
-    second_float= r'(?P<second>(-?[0-9]+(\.[0-9]+)?))'
-    actions = [ (r'^%s$' % first_float,lambda y: (value > float(y.group('first'))) or (value < 0)),
-                (r'^%s:$' % first_float,lambda y: value < float(y.group('first'))),
-                (r'^~:%s$' % first_float,lambda y: value > float(y.group('first'))),
-                (r'^%s:%s$' % (first_float,second_float), lambda y: (value < float(y.group('first'))) or (value > float(y.group('second')))),
-                (r'^@%s:%s$' % (first_float,second_float), lambda y: not((value < float(y.group('first'))) or (value > float(y.group('second')))))]
-    for regstr,func in actions:
-        res = re.match(regstr,nagstring)
-        if res: 
-            return func(res)
-    raise Exception('Improper warning/critical format.')
-
-def connect_db(options):
-    host = options.hostname
-    if options.instance:
-        host += "\\" + options.instance
-    elif options.port:
-        host += ":" + options.port
-    start = time.time()
-    mssql = pymssql.connect(host = host, user = options.user, password = options.password, database='master')
-    total = time.time() - start
-    return mssql, total, host
+    return parse_range(nagstring).alert(value)
 
 def main():
-    options = parse_args()
-    
-    mssql, total, host = connect_db(options)
-    
+    run_main('server', parse_args, check)
+
+def check(options, connection=None):
+    check_supported(options, connection_host(options))
+    check_plugin(options, 'server', run_check, snapshot=check_snapshot, connection=connection)
+
+def check_snapshot(options, login_timeout, timeout):
+    #~ A run answered from the snapshot sends no queries to record
+    if options.snapshot_ttl and not options.record and options.mode != 'test' and snapshot_modes(options):
+        host = connection_host(options)
+        snapshot = read_snapshot(options, host, login_timeout, timeout)
+        run_phase(options, 'snapshot', run_snapshot_check, options, host, snapshot)
+
+def run_check(mssql, options, host, total):
     if options.mode =='test':
-        run_tests(mssql, options, host)
+        run_probe(mssql, options, host)
+    
+    elif options.modes:
+        execute_batch(mssql, options, host, total)
         
     elif not options.mode or options.mode == 'time2connect':
         return_nagios(  options,
@@ -460,47 +608,775 @@ def main():
                         label='time',
                         unit='s',
                         result=total )
+    
+    elif options.mode == 'counter':
+        execute_counter(mssql, options, host)
                         
     else:
         execute_query(mssql, options, host)
 
-def execute_query(mssql, options, host=''):
-    sql_query = MODES[options.mode]
+def check_supported(options, host):
+    #~ Consulted before the login, a mode the last --test probe found missing costs no connection
+    if options.modes or options.mode in (None, 'time2connect', 'test', 'counter'):
+        return
+    if unsupported_modes(host, [options.mode]):
+        raise NagiosReturn('UNKNOWN: Mode %s is not supported by %s according to the last --test probe.' % (options.mode, host), 3)
+
+class MSSQLRingBufferQuery(MSSQLQuery):
+    
+    store = None
+    
+    def state(self, value=None):
+        #~ Reads the last window when called without a value, stores it otherwise
+        if self.options.no_state:
+            return None
+        store = self.store or StateStore(self.host, deadline=getattr(self.options, 'deadline', None)).open()
+        try:
+            key = state_key(self.host, 'ringbuffer', self.label)
+            if value is None:
+                last_run = store.get(key)
+                return last_run and last_run[1]
+            store.set(key, time.time(), value)
+        finally:
+            if store is not self.store:
+                store.close()
+    
+    def run_on_connection(self, connection):
+        self.last_window = self.state()
+        since = self.last_window and self.last_window[0] or 0
+        cur = connection.cursor()
+        execute_sql(cur, self.query, { 'since' : since, 'window' : CPU_WINDOW })
+        mark_phase(self.options, 'execute')
+        self.query_result = cur.fetchall()
+        mark_phase(self.options, 'fetch')
+    
+    def calculate_result(self):
+        rows = [row for row in self.query_result if row[1] is not None]
+        if rows:
+            latest = max(rows, key=lambda row: row[0])
+            process = [row[1] for row in rows]
+            idle = [row[2] for row in rows]
+            window = [latest[0], latest[1], float(sum(process)) / len(rows), max(process),
+                      latest[2], float(sum(idle)) / len(rows), len(rows)]
+            self.state(window)
+        elif self.last_window:
+            #~ No new record since the last run (one is written every minute), repeat its window
+            window = self.last_window
+        else:
+            raise Exception('No scheduler monitor records found in the ring buffer.')
+        _, latest, average, peak, idle, average_idle, samples = window
+        self.result = float(latest) * self.modifier
+        detail = ' (avg %.1f%%, max %d%% over %d samples), system idle %d%%' % (average, peak, samples, idle)
+        self.stdout = self.stdout + detail.replace('%', '%%')
+        self.options.perfdata = list(getattr(self.options, 'perfdata', None) or []) + [
+            '%s_avg=%.1f%%;;;0;100' % (self.label, average),
+            '%s_max=%d%%;;;0;100' % (self.label, peak),
+            'system_idle=%d%%;;;0;100' % idle,
+            'system_idle_avg=%.1f%%;;;0;100' % average_idle ]
+
+def session_query(group_by):
+    columns = ', '.join([SESSION_GROUPS[name] for name in group_by])
+    return SESSION_QUERY % { 'columns' : columns }
+
+class MSSQLSessionsQuery(MSSQLQuery):
+    
+    #~ With --group-by the sessions are grouped on the server and only the top groups come back
+    
+    def run_on_connection(self, connection):
+        if not self.options.group_by:
+            return super(MSSQLSessionsQuery, self).run_on_connection(connection)
+        cur = connection.cursor()
+        execute_sql(cur, session_query(self.options.group_by), { 'top' : max(1, self.options.top) })
+        mark_phase(self.options, 'execute')
+        self.query_result = cur.fetchall()
+        mark_phase(self.options, 'fetch')
+    
+    def calculate_result(self):
+        if not self.options.group_by:
+            return super(MSSQLSessionsQuery, self).calculate_result()
+        rows = self.query_result
+        width = len(self.options.group_by)
+        total = rows and rows[0][width + 2] or 0
+        groups = rows and rows[0][width + 3] or 0
+        active = rows and rows[0][width + 4] or 0
+        self.result = rows and rows[0][width] or 0
+        self.label = 'largest_group'
+        self.stdout = 'Largest connection group has %s sessions'
+        detail = ''
+        if rows:
+            detail = ' (%s)' % self.group_name(rows[0][:width])
+        detail += ', %d user sessions (%d active) in %d groups' % (total, active, groups)
+        if rows:
+            detail += ', top: ' + ', '.join(['%s %d (%d active)' % (self.group_name(row[:width]), row[width], row[width + 1])
+                                             for row in rows])
+        self.stdout = self.stdout + detail.replace('%', '%%')
+        perfdata = ['connections=%d;;;0;' % total, 'connection_groups=%d;;;0;' % groups,
+                    'active_sessions=%d;;;0;' % active]
+        self.options.perfdata = list(getattr(self.options, 'perfdata', None) or []) + perfdata
+    
+    def group_name(self, values):
+        return ' '.join(['%s=%s' % (name, value or '(none)') for name, value in zip(self.options.group_by, values)])
+
+class MSSQLPlanCacheQuery(MSSQLQuery):
+    
+    #~ One plan per statement that keeps being reused shows the parameterized statements at work;
+    #~ a growing count or many single use plans mean the cache gets a new plan per run
+    
+    def run_on_connection(self, connection):
+        cur = connection.cursor()
+        execute_sql(cur, self.query, { 'tag' : '%%%s%%' % PLAN_TAG })
+        mark_phase(self.options, 'execute')
+        self.query_result = cur.fetchall()
+        mark_phase(self.options, 'fetch')
+    
+    def calculate_result(self):
+        kinds = dict([(row[0], [value or 0 for value in row[1:]]) for row in self.query_result])
+        plans, uses, single_use, size = kinds.get('Prepared', [0, 0, 0, 0])
+        adhoc, _, adhoc_single_use, adhoc_size = kinds.get('Adhoc', [0, 0, 0, 0])
+        self.result = plans
+        detail = ', used %d times (%.1f per plan), %d single use, %d KB; %d ad hoc batches, %d single use, %d KB' % (
+            uses, float(uses) / max(plans, 1), single_use, size // 1024, adhoc, adhoc_single_use, adhoc_size // 1024)
+        self.stdout = self.stdout + detail.replace('%', '%%')
+        self.options.perfdata = list(getattr(self.options, 'perfdata', None) or []) + [
+            'plugin_plan_uses=%dc;;;0;' % uses,
+            'single_use_plans=%d;;;0;' % single_use,
+            'plugin_plan_size=%dKB;;;0;' % (size // 1024),
+            'adhoc_plans=%d;;;0;' % adhoc,
+            'adhoc_single_use_plans=%d;;;0;' % adhoc_single_use,
+            'adhoc_plan_size=%dKB;;;0;' % (adhoc_size // 1024) ]
+
+def wait_category(wait_type):
+    for prefix, name in WAIT_CATEGORIES:
+        if wait_type.startswith(prefix):
+            return name
+    return 'other'
+
+class MSSQLWaitStatsQuery(MSSQLQuery):
+    
+    store = None
+    
+    def run_on_connection(self, connection):
+        cur = connection.cursor()
+        execute_sql(cur, self.query)
+        mark_phase(self.options, 'execute')
+        self.query_result = cur.fetchall()
+        mark_phase(self.options, 'fetch')
+    
+    def snapshot(self):
+        #~ Stored as parallel arrays sorted by wait type, a few KB for the whole DMV
+        ms_ticks, start_ticks = self.query_result[0][:2]
+        rows = sorted([row[2:] for row in self.query_result if row[2] and row[2] not in BENIGN_WAITS])
+        return [ms_ticks, [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows]], start_ticks
+    
+    def state(self, snapshot):
+        if self.options.no_state:
+            return None
+        store = self.store or StateStore(self.host, deadline=getattr(self.options, 'deadline', None)).open()
+        try:
+            key = state_key(self.host, 'waitstats')
+            last_run = store.get(key)
+            store.set(key, time.time(), snapshot)
+        finally:
+            if store is not self.store:
+                store.close()
+        return last_run and last_run[1]
+    
+    def calculate_result(self):
+        snapshot, start_ticks = self.snapshot()
+        ms_ticks, types, waits, signals = snapshot
+        last = self.state(snapshot)
+        deltas = None
+        if last and start_ticks <= last[0] < ms_ticks:
+            old_index = dict(zip(last[1], range(len(last[1]))))
+            deltas = []
+            for wait_type, wait, signal in zip(types, waits, signals):
+                i = old_index.get(wait_type)
+                if i is not None:
+                    wait, signal = wait - last[2][i], signal - last[3][i]
+                if wait < 0:
+                    #~ DBCC SQLPERF cleared the statistics since the last run
+                    deltas = None
+                    break
+                deltas.append((wait_type, wait, signal))
+            elapsed = (ms_ticks - last[0]) / 1000.0
+        if deltas is None:
+            #~ First run or a restart: the averages since SQL Server started
+            deltas = list(zip(types, waits, signals))
+            elapsed = max(1.0, (ms_ticks - start_ticks) / 1000.0)
+        total = sum([d[1] for d in deltas])
+        total_signal = sum([d[2] for d in deltas])
+        categories = dict([(name, 0.0) for name in WAIT_CATEGORY_NAMES])
+        for wait_type, wait, signal in deltas:
+            categories[wait_category(wait_type)] += wait / elapsed
+        #~ Rounded like --filelatency, so the state is decided on the value shown
+        for name in WAIT_CATEGORY_NAMES:
+            categories[name] = round(categories[name], 3)
+        self.result = round(total / elapsed, 3)
+        signal_pct = total and 100.0 * total_signal / total or 0.0
+        top = sorted([d for d in deltas if d[1] > 0], key=lambda d: -d[1])[:self.options.top]
+        detail = ', signal wait %.1f%%' % signal_pct
+        if top:
+            detail += ', top: ' + ', '.join(['%s %.1f ms/sec (%.0f%% signal)' % (
+                wait_type, wait / elapsed, 100.0 * signal / wait) for wait_type, wait, signal in top])
+        perfdata = ['signal_wait=%.1f%%;;;0;100' % signal_pct]
+        self.category_code = 0
+        for name in WAIT_CATEGORY_NAMES:
+            warning = get_mode_threshold(self.options.category_warning, name)
+            critical = get_mode_threshold(self.options.category_critical, name)
+            code = get_state(categories[name], warning, critical)
+            if code:
+                detail += ', %s waits %.1f ms/sec (%s)' % (name, categories[name], STATES[code])
+            self.category_code = max(self.category_code, code)
+            perfdata.append('wait_%s=%.3fms;%s;%s;0;' % (name, categories[name], warning or '', critical or ''))
+        self.stdout = self.stdout + detail.replace('%', '%%')
+        self.options.perfdata = list(getattr(self.options, 'perfdata', None) or []) + perfdata
+    
+    def finish(self):
+        #~ A category over its range raises the state of the whole check
+        try:
+            super(MSSQLWaitStatsQuery, self).finish()
+        except NagiosReturn as e:
+            if self.category_code > e.code:
+                e.message = STATES[self.category_code] + e.message[len(STATES[e.code]):]
+                e.code = self.category_code
+            raise
+
+class MSSQLFileStatsQuery(MSSQLQuery):
+    
+    store = None
+    
+    def run_on_connection(self, connection):
+        cur = connection.cursor()
+        execute_sql(cur, self.query)
+        mark_phase(self.options, 'execute')
+        self.query_result = cur.fetchall()
+        mark_phase(self.options, 'fetch')
+    
+    def snapshot(self):
+        #~ Stored as parallel arrays sorted by database_id * 65536 + file_id, so thousands of
+        #~ files take a few ints each and are matched up with one dict lookup per file
+        ms_ticks, start_ticks = self.query_result[0][:2]
+        rows = sorted([(row[2] * 65536 + row[3],) + tuple(row[6:12]) for row in self.query_result])
+        self.names = dict([(row[2] * 65536 + row[3], (row[4] or str(row[2]), row[5] or str(row[3])))
+                           for row in self.query_result])
+        return [ms_ticks] + [list(column) for column in zip(*rows)], start_ticks
+    
+    def state(self, snapshot):
+        if self.options.no_state:
+            return None
+        store = self.store or StateStore(self.host, deadline=getattr(self.options, 'deadline', None)).open()
+        try:
+            key = state_key(self.host, 'filestats')
+            last_run = store.get(key)
+            store.set(key, time.time(), snapshot)
+        finally:
+            if store is not self.store:
+                store.close()
+        return last_run and last_run[1]
+    
+    def deltas(self, snapshot, start_ticks):
+        ms_ticks, keys, counters = snapshot[0], snapshot[1], snapshot[2:]
+        last = self.state(snapshot)
+        if not last or not start_ticks <= last[0] < ms_ticks:
+            #~ First run or a restart: the averages since SQL Server started
+            return list(zip(keys, *counters)), max(1.0, (ms_ticks - start_ticks) / 1000.0)
+        old_index = dict(zip(last[1], range(len(last[1]))))
+        old_counters = last[2:]
+        deltas = []
+        for row in zip(keys, *counters):
+            i = old_index.get(row[0])
+            if i is None:
+                #~ A new file: its counters since it was added are not for this interval, the
+                #~ snapshot stored above is its baseline for the next run
+                continue
+            delta = tuple([value - old[i] for value, old in zip(row[1:], old_counters)])
+            if min(delta) < 0:
+                #~ Dropped and added again with the same id, likewise only a baseline this run
+                continue
+            deltas.append((row[0],) + delta)
+        return deltas, (ms_ticks - last[0]) / 1000.0
+    
+    def calculate_result(self):
+        snapshot, start_ticks = self.snapshot()
+        deltas, elapsed = self.deltas(snapshot, start_ticks)
+        min_ios = self.options.min_ios
+        import heapq
+        files = []
+        databases = {}
+        for row in deltas:
+            database, name = self.names[row[0]]
+            sums = databases.get(database)
+            if sums is None:
+                databases[database] = list(row[1:])
+            else:
+                databases[database] = [a + b for a, b in zip(sums, row[1:])]
+            read, write = file_latency(row[1:], min_ios)
+            worst = worst_latency((read, write))
+            if worst is not None:
+                files.append((worst, database, name, read, write))
+        totals = [sum(column) for column in zip(*databases.values())] or [0] * 6
+        #~ Only the worst files are listed, no need to sort thousands of them
+        files = heapq.nlargest(max(1, self.options.top), files)
+        self.result = round(files[0][0], 3) if files else 0.0
+        read_latency, write_latency = file_latency(totals, 1)
+        detail = ', read %s, write %s, %.1f IOPS, %s read, %s written' % (
+            format_latency(read_latency), format_latency(write_latency), (totals[0] + totals[3]) / elapsed,
+            format_throughput(totals[1] / elapsed), format_throughput(totals[4] / elapsed))
+        if files:
+            detail = ' (%s/%s)' % files[0][1:3] + detail + ', top: ' + ', '.join(['%s/%s read %s write %s' % (
+                database, name, format_latency(read), format_latency(write))
+                for _, database, name, read, write in files[:self.options.top]])
+        self.stdout = self.stdout + detail.replace('%', '%%')
+        self.long_output = []
+        for database in sorted(databases, key=lambda d: -(worst_latency(file_latency(databases[d], min_ios)) or 0)):
+            counters = databases[database]
+            read, write = file_latency(counters, min_ios)
+            self.long_output.append('%s: read %s, write %s, %.1f IOPS, %s read, %s written' % (database,
+                format_latency(read), format_latency(write), (counters[0] + counters[3]) / elapsed,
+                format_throughput(counters[1] / elapsed), format_throughput(counters[4] / elapsed)))
+        perfdata = ['read_latency=%.3fms;;;0;' % (read_latency or 0), 'write_latency=%.3fms;;;0;' % (write_latency or 0),
+                    'read_iops=%.3f;;;0;' % (totals[0] / elapsed), 'write_iops=%.3f;;;0;' % (totals[3] / elapsed),
+                    'read_bytes=%.0fB;;;0;' % (totals[1] / elapsed), 'write_bytes=%.0fB;;;0;' % (totals[4] / elapsed)]
+        self.options.perfdata = list(getattr(self.options, 'perfdata', None) or []) + perfdata
+    
+    def finish(self):
+        #~ One line per database as Nagios long output, worst first
+        try:
+            super(MSSQLFileStatsQuery, self).finish()
+        except NagiosReturn as e:
+            e.message += '\n' + '\n'.join(self.long_output)
+            raise
+
+def file_latency(counters, min_ios):
+    #~ counters are reads, bytes read, read stall, writes, bytes written, write stall;
+    #~ a latency over fewer than min_ios I/Os is left out as None
+    reads, _, read_stall, writes, _, write_stall = counters
+    #~ Spelled out, as a genuine 0.0 ms latency must not turn into None
+    if reads and reads >= min_ios:
+        read = float(read_stall) / reads
+    else:
+        read = None
+    if writes and writes >= min_ios:
+        write = float(write_stall) / writes
+    else:
+        write = None
+    return read, write
+
+def worst_latency(latencies):
+    latencies = [latency for latency in latencies if latency is not None]
+    return max(latencies) if latencies else None
+
+def format_latency(latency):
+    if latency is None:
+        return 'idle'
+    return '%.1f ms' % latency
+
+def format_throughput(rate):
+    return '%.1f MB/s' % (rate / 1048576.0)
+
+class MSSQLAverageQuery(MSSQLDeltaQuery):
+    
+    #~ PERF_AVERAGE_BULK: the value and its base both grow, the result is the ratio of their increases
+    
+    def run_on_connection(self, connection):
+        cur = connection.cursor()
+        execute_sql(cur, self.query, self.params)
+        mark_phase(self.options, 'execute')
+        self.query_result = [x[0] for x in cur.fetchall()]
+        mark_phase(self.options, 'fetch')
+    
+    def calculate_result(self):
+        value, base = self.query_result
+        if self.options.no_state:
+            #~ Both grow from SQL Server start-up, so their ratio is the average since then
+            self.result = (float(value) / base) * self.modifier if base else None
+            return
+        store = self.store or StateStore(self.host, deadline=getattr(self.options, 'deadline', None)).open()
+        try:
+            key = self.delta_key()
+            last_run = store.get(key)
+            if last_run and last_run[1][1] < base:
+                old_value, old_base = last_run[1]
+                self.result = (float(value - old_value) / (base - old_base)) * self.modifier
+            else:
+                self.result = None
+            store.set(key, time.time(), [value, base])
+        finally:
+            if store is not self.store:
+                store.close()
+
+def parse_counter(counter):
+    #~ object:counter[:instance]; the object may carry its SQLServer: or MSSQL$NAME: prefix
+    parts = counter.split(':')
+    if len(parts) > 2 and (parts[0].upper() in ('SQLSERVER', 'SQLAGENT') or parts[0].upper().startswith(('MSSQL$', 'SQLAGENT$'))):
+        parts = parts[1:]
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        return None
+    return parts[0].strip(), parts[1].strip(), ':'.join(parts[2:]).strip()
+
+def counter_key(obj, counter, instance):
+    if ':' in obj:
+        obj = obj.split(':', 1)[1]
+    return '|'.join([obj, counter, instance]).lower()
+
+def find_base(counter, bases):
+    #~ The base of a fraction or average counter is the base counter in the same object
+    #~ and instance sharing the longest name prefix, e.g. Average Wait Time (ms) -> Average Wait Time Base
+    best = None
+    best_length = 0
+    for base in bases:
+        length = 0
+        for a, b in zip(counter.lower(), base.lower()):
+            if a != b:
+                break
+            length += 1
+        if length > best_length:
+            best, best_length = base, length
+    return best
+
+def build_catalog(rows):
+    counters = {}
+    bases = {}
+    for obj, counter, instance, cntr_type in rows:
+        if cntr_type == 1073939712:
+            bases.setdefault((obj, instance), []).append(counter)
+    for obj, counter, instance, cntr_type in rows:
+        base = None
+        if CNTR_TYPES.get(cntr_type) in ('divide', 'average'):
+            base = find_base(counter, bases.get((obj, instance), []))
+        counters[counter_key(obj, counter, instance)] = [obj, counter, instance, cntr_type, base]
+    return { 'time' : time.time(), 'counters' : counters }
+
+def load_catalog(mssql, options, host, refresh=False):
+    #~ The counter list only changes with SQL Server upgrades, so it is fetched once a day
+    import json
+    catalog = None
+    filename = host_filename(host, 'counters')
+    if not refresh:
+        try:
+            catalogfile = open(filename)
+            try:
+                catalog = json.load(catalogfile)
+            finally:
+                catalogfile.close()
+        except (IOError, ValueError):
+            catalog = None
+    if not catalog or time.time() - catalog.get('time', 0) > CATALOG_MAX_AGE:
+        cur = mssql.cursor()
+        execute_sql(cur, CATALOG_QUERY)
+        catalog = build_catalog(cur.fetchall())
+        mark_phase(options, 'catalog')
+        write_json_file(filename, catalog, getattr(options, 'deadline', None))
+    return catalog
+
+def counter_query(options, entry):
+    obj, counter, instance, cntr_type, base = entry
+    query_type = CNTR_TYPES.get(cntr_type)
+    if query_type is None:
+        raise NagiosReturn('UNKNOWN: cntr_type %s of counter %s is not supported.' % (cntr_type, counter), 3)
+    name = '%s:%s' % (obj.split(':', 1)[-1], counter)
+    if instance:
+        name += ':%s' % instance
+    sql_query = { 'label'     : re.sub(r'[^a-z0-9]+', '_', counter.lower()).strip('_') or 'counter',
+                  'stdout'    : '%s is %%s' % name.replace('%', '%%'),
+                  'type'      : query_type }
+    if query_type in ('divide', 'average'):
+        if not base:
+            raise NagiosReturn('UNKNOWN: No base counter found for %s.' % name, 3)
+        sql_query['query'] = COUNTER_BASE_QUERY
+        sql_query['base'] = base
+    else:
+        sql_query['query'] = COUNTER_QUERY
+    sql_query['object'] = obj
+    sql_query['counter'] = counter
+    sql_query['instance'] = instance
+    if query_type == 'divide':
+        sql_query['stdout'] += '%%'
+        sql_query['unit'] = '%'
+        sql_query['modifier'] = 100
+    elif query_type == 'delta':
+        sql_query['stdout'] += '/sec'
+    return sql_query
+
+def execute_counter(mssql, options, host=''):
+    key = counter_key(*options.counter)
+    catalog = load_catalog(mssql, options, host)
+    if key not in catalog['counters'] and time.time() - catalog['time'] > 60:
+        #~ Counters can appear later (a new database, an instance restart); refresh once
+        catalog = load_catalog(mssql, options, host, refresh=True)
+    if key not in catalog['counters']:
+        name = ':'.join([part for part in options.counter if part])
+        raise NagiosReturn('UNKNOWN: Counter %s not found in sys.dm_os_performance_counters.' % name, 3)
+    mssql_query = make_query('counter', options, host, { 'counter' : counter_query(options, catalog['counters'][key]) })
+    mssql_query.do(mssql)
+
+def make_query(mode, options, host='', queries=None):
+    sql_query = dict((queries or MODES)[mode])
     sql_query['options'] = options
     sql_query['host'] = host
     query_type = sql_query.get('type')
     if query_type == 'delta':
-        mssql_query = MSSQLDeltaQuery(**sql_query)
+        return MSSQLDeltaQuery(**sql_query)
     elif query_type == 'divide':
-        mssql_query = MSSQLDivideQuery(**sql_query)
-    else:
-        mssql_query = MSSQLQuery(**sql_query)
+        return MSSQLDivideQuery(**sql_query)
+    elif query_type == 'ringbuffer':
+        return MSSQLRingBufferQuery(**sql_query)
+    elif query_type == 'average':
+        return MSSQLAverageQuery(**sql_query)
+    elif query_type == 'waitstats':
+        return MSSQLWaitStatsQuery(**sql_query)
+    elif query_type == 'filestats':
+        return MSSQLFileStatsQuery(**sql_query)
+    elif query_type == 'sessions':
+        return MSSQLSessionsQuery(**sql_query)
+    elif query_type == 'plancache':
+        return MSSQLPlanCacheQuery(**sql_query)
+    return MSSQLQuery(**sql_query)
+
+def execute_query(mssql, options, host=''):
+    mssql_query = make_query(options.mode, options, host)
     mssql_query.do(mssql)
 
-def run_tests(mssql, options, host):
-    failed = 0
-    total  = 0
-    del MODES['time2connect']
-    del MODES['test']
-    for mode in list(MODES.keys()):
-        total += 1
-        options.mode = mode
-        try:
-            execute_query(mssql, options, host)
-        except NagiosReturn:
-            print("%s passed!" % mode)
-        except Exception as e:
-            failed += 1
-            print("%s failed with: %s" % (mode, e))
-    print('%d/%d tests failed.' % (failed, total))
+def batch_counters(modes, queries=None):
+    #~ The @counters of BATC_QUERY and PROBE_QUERY; a ratio is matched by prefix like DIVI_QUERY, with its base
+    names = []
+    prefixes = []
+    for mode in modes:
+        sql_query = (queries or MODES)[mode]
+        if sql_query.get('type') == 'divide':
+            prefixes.append(sql_query['counter'])
+        else:
+            names.append(sql_query['counter'])
+    return counter_patterns(names, prefixes)
+
+def match_counter_values(rows, sql_query):
+    counter = sql_query['counter'].lower()
+    instance = sql_query.get('instance')
+    matched = []
+    for counter_name, instance_name, value in rows:
+        counter_name = counter_name.lower()
+        if instance is not None and instance_name.lower() != instance.lower():
+            continue
+        if sql_query.get('type') == 'divide':
+            if counter_name.startswith(counter):
+                #~ The base counter sorts after the ratio counter, as with DIVI_QUERY
+                matched.append((counter_name.endswith(' base'), value))
+        elif counter_name == counter:
+            matched.append((False, value))
+    return [value for _, value in sorted(matched, key=lambda x: x[0])]
+
+def execute_batch(mssql, options, host='', total=None):
+    return_nagios_multi(options, collect_batch(mssql, options, host, total))
+
+def collect_batch(mssql, options, host='', total=None, queries=None, snapshot=None):
+    #~ queries maps the names in options.modes to MODES style entries, MODES by default;
+    #~ a --snapshot-ttl snapshot answers the counter modes instead of mssql
+    queries = queries or MODES
+    results = []
+    #~ Modes the last --test probe found unsupported are left out rather than failing the batch
+    skipped = unsupported_modes(host, options.modes)
+    modes = [k for k in options.modes if k not in skipped]
+    if not modes:
+        raise NagiosReturn('UNKNOWN: None of the modes are supported by %s according to the last --test probe.' % host, 3)
+    counter_modes = [k for k in modes if 'counter' in queries[k]]
+    rows = []
+    ticks = None
+    if counter_modes and snapshot:
+        rows = snapshot['rows']
+        ticks = options.server_time and snapshot['ticks']
+    elif counter_modes:
+        cur = mssql.cursor()
+        query = BATC_QUERY
+        if options.server_time:
+            query = with_server_time(query)
+        execute_sql(cur, query, { 'counters' : batch_counters(counter_modes, queries) })
+        mark_phase(options, 'execute')
+        rows = cur.fetchall()
+        mark_phase(options, 'fetch')
+        if options.server_time and rows:
+            ticks = rows[0][3:5]
+            rows = [row[:3] for row in rows]
+    store = None
+    if not options.no_state and [k for k in modes if queries[k].get('type') in ('delta', 'ringbuffer', 'waitstats', 'filestats')]:
+        store = StateStore(host, deadline=getattr(options, 'deadline', None)).open()
+    try:
+        for mode in modes:
+            sql_query = queries[mode]
+            if mode == 'time2connect':
+                results.append((mode, 'Time to connect was %ss', total, 's', 'time'))
+                continue
+            mssql_query = make_query(mode, options, host, queries)
+            mssql_query.store = store
+            if mode in counter_modes:
+                values = match_counter_values(rows, sql_query)
+                if not values:
+                    raise Exception('No sysperfinfo entry found for mode %s.' % mode)
+                mssql_query.load_values(values)
+                if ticks and sql_query.get('type') == 'delta':
+                    mssql_query.ms_ticks, mssql_query.start_ticks = ticks
+                elif snapshot:
+                    mssql_query.sampled = snapshot['time']
+            else:
+                mssql_query.run_on_connection(mssql)
+            mssql_query.calculate_result()
+            mark_phase(options, 'calculate')
+            results.append((mode, mssql_query.stdout, mssql_query.result, mssql_query.unit, mssql_query.label,
+                            mssql_query.baseline_key()))
+    finally:
+        if store:
+            store.close()
+    return results
+
+class SnapshotStore(StateStore):
+    
+    #~ One file per host and credentials, so a login without access to the server never reads it.
+    #~ The credentials are keyed with a local secret, a plain hash of them would be open to a dictionary attack
+    def __init__(self, host, options):
+        StateStore.__init__(self, host, deadline=getattr(options, 'deadline', None))
+        import hmac
+        import hashlib
+        credentials = hmac.new(snapshot_secret(), ('%s\0%s' % (options.user, options.password)).encode('utf-8'),
+                               hashlib.sha256).hexdigest()
+        self.filename = host_filename(host, 'snapshot-%s' % credentials[:16])
+    
+    def fresh(self, options):
+        snapshot = self.entries
+        if not snapshot or time.time() - snapshot['time'] >= options.snapshot_ttl:
+            return None
+        if options.server_time and not snapshot['ticks']:
+            return None
+        return snapshot
     
+    def save(self):
+        write_json_file(self.filename, self.entries, self.deadline)
+
+def snapshot_secret():
+    #~ Made once per temp directory and only readable by the user running the checks, like the state files
+    import tempfile
+    import binascii
+    filename = os.path.join(tempfile.gettempdir(), 'mssql-snapshot.key')
+    for attempt in (0, 1):
+        try:
+            keyfile = open(filename, 'rb')
+            try:
+                secret = keyfile.read()
+            finally:
+                keyfile.close()
+            if secret:
+                return secret
+        except IOError:
+            if attempt:
+                raise
+        #~ Linked into place whole, so a check racing this one reads either no key or the full key
+        fd, tmpname = tempfile.mkstemp(prefix='mssql-', suffix='.tmp', dir=os.path.dirname(filename))
+        try:
+            os.write(fd, binascii.hexlify(os.urandom(32)))
+            os.close(fd)
+            try:
+                os.link(tmpname, filename)
+            except OSError:
+                pass
+        finally:
+            os.remove(tmpname)
+
+def snapshot_modes(options):
+    modes = options.modes or [options.mode]
+    return len([k for k in modes if 'counter' in MODES.get(k, {})]) == len(modes)
+
+def read_snapshot(options, host, login_timeout, timeout):
+    #~ The first check of a burst logs in and fetches every counter mode, the others wait for
+    #~ the lock and read its file; a snapshot older than --snapshot-ttl is fetched again
+    store = SnapshotStore(host, options)
+    #~ Files are replaced atomically, so a fresh one can be read without the lock
+    store.load()
+    snapshot = store.fresh(options)
+    if snapshot:
+        return snapshot
+    store.open()
+    try:
+        snapshot = store.fresh(options)
+        if snapshot:
+            return snapshot
+        mssql, _, _ = login(options, login_timeout, timeout)
+        mark_phase(options, 'connect')
+        try:
+            store.entries = run_phase(options, 'query', fetch_snapshot, mssql, options)
+        finally:
+            mssql.close()
+        store.dirty = True
+        return store.entries
+    finally:
+        store.close()
+
+def fetch_snapshot(mssql, options):
+    query = BATC_QUERY
+    if options.server_time:
+        query = with_server_time(query)
+    cur = mssql.cursor()
+    execute_sql(cur, query, { 'counters' : batch_counters([k for k in MODES if 'counter' in MODES[k]]) })
+    mark_phase(options, 'execute')
+    rows = cur.fetchall()
+    mark_phase(options, 'fetch')
+    ticks = None
+    if options.server_time and rows:
+        ticks = list(rows[0][3:5])
+    return { 'time' : time.time(), 'ticks' : ticks, 'rows' : [list(row[:3]) for row in rows] }
+
+def run_snapshot_check(options, host, snapshot):
+    if options.modes:
+        return_nagios_multi(options, collect_batch(None, options, host, snapshot=snapshot))
+    options.modes = [options.mode]
+    result = collect_batch(None, options, host, snapshot=snapshot)[0]
+    return_nagios(options, *result[1:])
+
+def supports_counter(rows, sql_query):
+    values = match_counter_values(rows, sql_query)
+    if sql_query.get('type') == 'divide':
+        return len(values) > 1
+    return len(values) > 0
+
+def run_probe(mssql, options, host):
+    #~ Every sysperfinfo mode is answered by one query; the DMV modes need their own
+    modes = {}
+    cur = mssql.cursor()
+    execute_sql(cur, VERSION_QUERY)
+    version = cur.fetchone()[0]
+    counter_modes = [k for k in MODES if 'counter' in MODES[k]]
+    start = time.time()
+    execute_sql(cur, PROBE_QUERY, { 'counters' : batch_counters(counter_modes) })
+    rows = cur.fetchall()
+    latency = time.time() - start
+    prefixes = sorted(set([row[0].split(':')[0] for row in rows if ':' in row[0]]))
+    counter_rows = [row[1:] for row in rows]
+    for mode in counter_modes:
+        modes[mode] = supports_counter(counter_rows, MODES[mode]) or None
+    #~ The DMV modes are only executed: calculating a result would store their state and
+    #~ take the window of the next real check. no_state keeps the reads of that state out too
+    options.no_state = True
+    import pymssql
+    for mode in MODES:
+        if mode in modes or mode in ('time2connect', 'test'):
+            continue
+        start = time.time()
+        try:
+            make_query(mode, options, host).run_on_connection(mssql)
+            modes[mode] = time.time() - start
+        except pymssql.DatabaseError as e:
+            #~ Missing DMV or permission; connection failures are not a verdict on the mode
+            if unreachable(e):
+                raise
+            modes[mode] = None
+    capabilities = { 'time'     : time.time(),
+                     'version'  : version,
+                     'prefixes' : prefixes,
+                     'modes'    : modes }
+    write_json_file(host_filename(host, 'capabilities'), capabilities, getattr(options, 'deadline', None))
+    return_probe(options, host, capabilities, latency)
+
 if __name__ == '__main__':
     try:
         main()
-    except pymssql.OperationalError as e:
-        print(e)
-        sys.exit(3)
-    except pymssql.InterfaceError as e:
+    except driver_errors() as e:
         print(e)
         sys.exit(3)
     except IOError as e:
@@ -0,0 +1,1143 @@
+#!/usr/bin/env python
+
+########################################################################
+# mssql_common - Shared helpers of the check_mssql Nagios plugins
+# Copyright (C) 2017 Nagios Enterprises
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+################### mssql_common.py ####################################
+# Version    : 2.2.0
+# Date       : 10/18/2026
+# Maintainer : Nagios Enterprises, LLC
+# License    : GPLv2 (LICENSE.md / https://www.gnu.org/licenses/old-licenses/gpl-2.0.html)
+########################################################################
+
+#~ Installed next to check_mssql_server.py and check_mssql_database.py, which both import it.
+#~ Like the plugins it leaves pymssql, json and the state helpers' modules to where they are used
+
+import time
+import sys
+import os
+import re
+from optparse import OptionGroup
+
+PLAN_TAG = '/* check_mssql */'
+#~ sp_executesql declaration of every parameter the statements of both plugins use
+PARAM_TYPES = {
+    'counter'   : 'nvarchar(128)',
+    'instance'  : 'nvarchar(128)',
+    'object'    : 'nvarchar(128)',
+    'base'      : 'nvarchar(128)',
+    'tag'       : 'nvarchar(128)',
+    'since'     : 'bigint',
+    'window'    : 'int',
+    'top'       : 'int',
+    'table_id'  : 'int',
+    'index_id'  : 'int',
+    'scan_mode' : 'nvarchar(8)',
+    'pages'     : 'bigint',
+    'counters'  : 'xml',
+    'database_counters' : 'xml',
+}
+
+COLLECTOR_TIMEOUT = 60
+#~ Shares of the --timeout budget for the login and the queries; the rest is kept for state I/O
+LOGIN_SHARE = 0.4
+QUERY_SHARE = 0.4
+STATE_MAX_AGE = 86400
+CAPABILITY_MAX_AGE = 86400
+BREAKER_MAX_BACKOFF = 600
+#~ DB-Lib errors of a host that cannot be reached: connection failed, timed out, read, write,
+#~ unable to connect, unexpected EOF. Server errors such as 18456 Login failed prove it is up
+BREAKER_ERRORS = frozenset([20002, 20003, 20004, 20006, 20009, 20017])
+BASELINE_MAX_AGE = 35 * 86400
+BASELINE_MIN_SIGMA = 0.01
+
+STATES = ['OK', 'WARNING', 'CRITICAL', 'UNKNOWN']
+RANGE_REGEX = re.compile(r'^(?P<inside>@)?(?P<start>(~|[-+]?([0-9]+(\.[0-9]*)?|\.[0-9]+))?:)?(?P<end>[-+]?([0-9]+(\.[0-9]*)?|\.[0-9]+))?$')
+RANGES = {}
+#~ Fallback start of the process for --startup-time
+IMPORTED = time.time()
+
+class NagiosReturn(Exception):
+    
+    def __init__(self, message, code):
+        self.message = message
+        self.code = code
+
+def query_params(query, values):
+    #~ The values of the @parameters the statement uses, e.g. from its MODES entry
+    return dict([(name, values.get(name)) for name in PARAM_TYPES if re.search(r'@%s\b' % name, query)])
+
+def execute_sql(cur, query, params=None):
+    #~ Sent through sp_executesql, so the statement text is the same whatever the counter or
+    #~ database and the server compiles one plan for it; values never become part of the SQL
+    statement = '%s %s' % (PLAN_TAG, query)
+    if not params:
+        cur.execute("EXEC sp_executesql N'%s';" % statement.replace("'", "''"))
+        return
+    names = sorted(params)
+    declare = ', '.join(['@%s %s' % (name, PARAM_TYPES[name]) for name in names])
+    assign = ', '.join(['@%s=%%s' % name for name in names])
+    #~ The driver fills in the quoted values with %, so a % of the statement is doubled
+    cur.execute("EXEC sp_executesql N'%s', N'%s', %s;" % (statement.replace("'", "''").replace('%', '%%'), declare, assign),
+                tuple([params[name] for name in names]))
+
+def host_filename(host, extension):
+    import tempfile
+    safe_host = re.sub(r'[^A-Za-z0-9_.-]', '_', host)
+    return os.path.join(tempfile.gettempdir(), 'mssql-%s.%s' % (safe_host, extension))
+
+def write_json_file(filename, data, deadline=None):
+    #~ Written to a temporary file and renamed, so readers never see a partial file.
+    #~ A -t deadline running out meanwhile only takes effect once the file is in place
+    import tempfile
+    import json
+    if deadline:
+        deadline.hold()
+    try:
+        fd, tmpname = tempfile.mkstemp(prefix='mssql-', suffix='.tmp', dir=os.path.dirname(filename))
+        try:
+            tmpfile = os.fdopen(fd, 'w')
+            try:
+                #~ dumps runs the C encoder, dump streams through the much slower pure Python one
+                tmpfile.write(json.dumps(data, separators=(',', ':'), default=float))
+            finally:
+                tmpfile.close()
+            os.rename(tmpname, filename)
+        except Exception:
+            os.remove(tmpname)
+            raise
+    finally:
+        if deadline:
+            deadline.release()
+
+class Deadline(object):
+    
+    def __init__(self, budget):
+        self.budget = budget
+        self.end = time.time() + budget
+        self.phase = 'start-up'
+        self.held = 0
+        self.expired = False
+        self.alarmed = False
+    
+    def remaining(self):
+        return self.end - time.time()
+    
+    def enter(self, phase):
+        self.phase = phase
+        if self.remaining() <= 0:
+            self.expire()
+    
+    def expire(self, error=None):
+        message = 'UNKNOWN: The %ss timeout ran out during %s' % (self.budget, self.phase)
+        if error:
+            message += ' (%s)' % str(error).replace('\n', ' ').strip()
+        raise NagiosReturn(message, 3)
+    
+    def alarm(self, signum, frame):
+        #~ SIGALRM arrives at any point; in the middle of a state file write it waits for release
+        if self.held:
+            self.expired = True
+        else:
+            self.expire()
+    
+    def hold(self):
+        self.held += 1
+    
+    def release(self):
+        self.held -= 1
+        if self.expired and not self.held:
+            self.expire()
+    
+    def timeouts(self):
+        #~ pymssql takes whole seconds and 0 means no timeout at all
+        return max(1, int(self.budget * LOGIN_SHARE)), max(1, int(self.budget * QUERY_SHARE))
+
+def add_timeout_option(group):
+    group.add_option('-t', '--timeout', type='float', help='Seconds the whole check may take, split across login, '
+                     'queries and state file I/O. UNKNOWN is returned with the phase that ran out of time.', default=None)
+
+def start_deadline(options):
+    #~ Returns the login and query timeouts for connect_db
+    if not getattr(options, 'timeout', None):
+        return 60, 0
+    import signal
+    deadline = options.deadline = Deadline(options.timeout)
+    #~ A backstop for anything that ignores its own timeout, e.g. a hanging name lookup. Signals only
+    #~ reach the main thread: in check_mssql_collector.py the phases and driver timeouts still apply
+    try:
+        signal.signal(signal.SIGALRM, deadline.alarm)
+    except ValueError:
+        return deadline.timeouts()
+    deadline.alarmed = True
+    signal.alarm(max(1, int(options.timeout + 0.999)))
+    return deadline.timeouts()
+
+def stop_deadline(options):
+    #~ The check is done, nothing may be interrupted while its result is printed
+    if getattr(getattr(options, 'deadline', None), 'alarmed', False):
+        import signal
+        signal.alarm(0)
+
+def run_phase(options, phase, function, *args):
+    deadline = getattr(options, 'deadline', None)
+    if not deadline:
+        return function(*args)
+    deadline.enter(phase)
+    try:
+        return function(*args)
+    except driver_errors() as e:
+        if deadline.remaining() <= 0 or 'timed out' in str(e).lower() or 'timeout' in str(e).lower():
+            deadline.expire(e)
+        raise
+
+class StateStore(object):
+    
+    #~ deadline is the -t Deadline of the check, if any: lock waits end with it, writes are not cut short
+    def __init__(self, host, max_age=STATE_MAX_AGE, deadline=None):
+        self.filename = host_filename(host, 'state')
+        self.max_age = max_age
+        self.deadline = deadline
+        self.entries = {}
+        self.dirty = False
+        self.lockfile = None
+    
+    def open(self):
+        import fcntl
+        #~ The state file is replaced on every write, so the lock lives in its own file
+        self.lockfile = open(self.filename + '.lock', 'a')
+        if self.deadline:
+            self.lock_until_deadline(fcntl)
+        else:
+            fcntl.flock(self.lockfile.fileno(), fcntl.LOCK_EX)
+        self.load()
+        return self
+    
+    def load(self):
+        import json
+        try:
+            statefile = open(self.filename)
+            try:
+                self.entries = json.load(statefile)
+            finally:
+                statefile.close()
+        except (IOError, ValueError):
+            self.entries = {}
+    
+    def lock_until_deadline(self, fcntl):
+        phase = self.deadline.phase
+        self.deadline.phase = 'state file lock'
+        while True:
+            try:
+                fcntl.flock(self.lockfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.deadline.phase = phase
+                return
+            except (IOError, OSError):
+                if self.deadline.remaining() <= 0:
+                    self.lockfile.close()
+                    self.deadline.expire()
+                time.sleep(0.01)
+    
+    def get(self, key):
+        return self.entries.get(key)
+    
+    def set(self, key, when, value):
+        self.entries[key] = [when, value]
+        self.dirty = True
+    
+    def close(self):
+        try:
+            if self.dirty:
+                self.save()
+        finally:
+            self.lockfile.close()
+    
+    def save(self):
+        cutoff = time.time() - self.max_age
+        for key in list(self.entries.keys()):
+            if self.entries[key][0] < cutoff:
+                del self.entries[key]
+        write_json_file(self.filename, self.entries, self.deadline)
+
+def add_breaker_options(parser):
+    breaker = OptionGroup(parser, "Circuit Breaker Options")
+    breaker.add_option('--breaker', type='int', help='After this many failed logins in a row, skip the login for every '
+                       'check of the host and return the last error at once, letting one check probe the host after a '
+                       'backoff. Shared by all checks of the host, 0 disables.', default=0)
+    breaker.add_option('--breaker-window', type='float', help='Seconds in which the failed logins must happen.', default=300)
+    breaker.add_option('--breaker-backoff', type='float', help='Seconds before the first probe, doubled after every '
+                       'failed probe up to %d.' % BREAKER_MAX_BACKOFF, default=30)
+    breaker.add_option('--breaker-state', choices=['UNKNOWN', 'CRITICAL'], help='State returned while the breaker '
+                       'is open, UNKNOWN or CRITICAL.', default='UNKNOWN')
+    parser.add_option_group(breaker)
+
+class CircuitBreaker(object):
+    
+    #~ Shared by every check of a host, so once it is down only one of them waits out a login
+    def __init__(self, host, options):
+        self.host = host
+        self.filename = host_filename(host, 'breaker')
+        self.failures = options.breaker
+        self.window = options.breaker_window
+        self.backoff = options.breaker_backoff
+        self.code = STATES.index(options.breaker_state)
+        self.deadline = getattr(options, 'deadline', None)
+    
+    def read(self):
+        import json
+        try:
+            breakerfile = open(self.filename)
+            try:
+                return json.load(breakerfile)
+            finally:
+                breakerfile.close()
+        except (IOError, ValueError):
+            return None
+    
+    def lock(self):
+        import fcntl
+        lockfile = open(self.filename + '.lock', 'a')
+        fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+        return lockfile
+    
+    def before_login(self, login_timeout):
+        #~ Returns whether there is a failure streak for a successful login to clear
+        breaker = self.read()
+        if not breaker:
+            return False
+        if breaker['failures'] < self.failures:
+            return True
+        if time.time() < breaker['open_until']:
+            self.fail_fast(breaker)
+        #~ Half-open: the first check past open_until probes the host, the others keep failing fast
+        lockfile = self.lock()
+        try:
+            breaker = self.read()
+            if breaker and time.time() < breaker['open_until']:
+                self.fail_fast(breaker)
+            if breaker:
+                #~ Held for as long as the probe may take, so a killed probe does not keep the host shut
+                breaker['open_until'] = time.time() + login_timeout + 1
+                write_json_file(self.filename, breaker, self.deadline)
+        finally:
+            lockfile.close()
+        return True
+    
+    def fail_fast(self, breaker):
+        raise NagiosReturn('%s: Not logging in to %s after %d failed logins, next try in %ds. Last error: %s' % (
+            STATES[self.code], self.host, breaker['failures'], max(1, breaker['open_until'] - time.time()),
+            breaker['error']), self.code)
+    
+    def failed(self, error):
+        message = getattr(error, 'message', None) or str(error) or str(type(error))
+        message = re.sub(r'^UNKNOWN: ', '', str(message).replace('\n', ' ').strip())
+        lockfile = self.lock()
+        try:
+            now = time.time()
+            breaker = self.read()
+            if not breaker or (breaker['failures'] < self.failures and now - breaker['first_failure'] > self.window):
+                breaker = { 'failures' : 0, 'first_failure' : now, 'open_until' : 0, 'backoff' : 0 }
+            breaker['failures'] += 1
+            breaker['error'] = message
+            if breaker['failures'] >= self.failures:
+                #~ Doubles with every failed probe
+                breaker['backoff'] = min(max(BREAKER_MAX_BACKOFF, self.backoff), breaker['backoff'] * 2 or self.backoff)
+                breaker['open_until'] = now + breaker['backoff']
+            write_json_file(self.filename, breaker, self.deadline)
+        finally:
+            lockfile.close()
+    
+    def succeeded(self):
+        lockfile = self.lock()
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+        finally:
+            lockfile.close()
+
+def login(options, login_timeout, timeout, database='master'):
+    #~ connect_db behind the --breaker circuit breaker of the host
+    if not getattr(options, 'breaker', None):
+        return run_phase(options, 'login', connect_db, options, login_timeout, timeout, database)
+    breaker = CircuitBreaker(connection_host(options), options)
+    streak = breaker.before_login(login_timeout)
+    try:
+        connection = run_phase(options, 'login', connect_db, options, login_timeout, timeout, database)
+    except driver_errors() + (NagiosReturn,) as e:
+        if unreachable(e):
+            breaker.failed(e)
+        elif streak:
+            #~ Wrong credentials or database: the host answered, failing fast would only hide the error
+            breaker.succeeded()
+        raise
+    if streak:
+        breaker.succeeded()
+    return connection
+
+def unreachable(error):
+    #~ Whether a failed login means the host is down, as opposed to refusing the login
+    if isinstance(error, NagiosReturn):
+        #~ The --timeout budget ran out during the login
+        return True
+    number = error.args and error.args[0]
+    if isinstance(number, int):
+        return number in BREAKER_ERRORS
+    #~ No error number, e.g. an InterfaceError; only a timeout or refused connection counts
+    text = str(error).lower()
+    return 'timed out' in text or 'unable to connect' in text
+
+class BaselineStore(StateStore):
+    
+    #~ Kept apart from the delta state, as hourly baselines are only updated once a week
+    def __init__(self, host, deadline=None):
+        StateStore.__init__(self, host, BASELINE_MAX_AGE, deadline)
+        self.filename = host_filename(host, 'baseline')
+
+def baseline_enabled(options):
+    return getattr(options, 'baseline_warning', None) is not None or getattr(options, 'baseline_critical', None) is not None
+
+def add_baseline_options(parser, scope='host and mode'):
+    baseline = OptionGroup(parser, "Baseline Options")
+    baseline.add_option('--baseline-warning', type='float', help='Warn when the result is this many standard deviations '
+                        'from its baseline, an exponentially weighted mean and variance kept per %s.' % scope, default=None)
+    baseline.add_option('--baseline-critical', type='float', help='Critical when the result is this many standard '
+                        'deviations from its baseline.', default=None)
+    baseline.add_option('--baseline-alpha', type='float', help='Weight of each new sample in the baseline.', default=0.05)
+    baseline.add_option('--baseline-warmup', type='int', help='Samples a baseline needs before it alerts.', default=30)
+    baseline.add_option('--baseline-hourly', action="store_true", help='Keep a baseline per hour of the week.', default=False)
+    baseline.add_option('--baseline-direction', choices=['both', 'above', 'below'], help='Deviations alerted on: '
+                        'both, above or below the baseline.', default='both')
+    parser.add_option_group(baseline)
+
+def check_baseline_options(parser, options):
+    if not 0 < options.baseline_alpha <= 1:
+        parser.error('--baseline-alpha must be above 0 and at most 1.')
+
+def baseline_scope(options):
+    #~ The modes of the service: a mode checked alone and in a --modes batch keeps a baseline in each,
+    #~ rather than both services adding their samples to one
+    return ','.join(getattr(options, 'modes', None) or [options.mode or 'time2connect'])
+
+def check_baseline(options, key, label, result, store=None):
+    #~ Returns the state, text and perfdata of result against its baseline, then adds result to it.
+    #~ The baseline is an exponentially weighted mean and variance: three numbers, whatever its age
+    import math
+    if options.baseline_hourly:
+        now = time.localtime()
+        key = '%s:%d' % (key, now.tm_wday * 24 + now.tm_hour)
+    baseline = store or BaselineStore(connection_host(options), getattr(options, 'deadline', None)).open()
+    try:
+        entry = baseline.get(key)
+        samples, mean, variance = entry and entry[1] or (0, 0.0, 0.0)
+        result = float(result)
+        code = 0
+        warmup = max(1, options.baseline_warmup)
+        if samples < warmup:
+            detail = ', baseline warming up (%d/%d samples)' % (samples, warmup)
+            perfdata = ''
+        else:
+            #~ A counter that never moved gets a sigma of 1% of its mean, so it does not alert on noise
+            sigma = max(math.sqrt(variance), abs(mean) * BASELINE_MIN_SIGMA, 1e-9)
+            deviation = (result - mean) / sigma
+            alerting = {'above': deviation, 'below': -deviation}.get(options.baseline_direction, abs(deviation))
+            if options.baseline_critical is not None and alerting >= options.baseline_critical:
+                code = 2
+            elif options.baseline_warning is not None and alerting >= options.baseline_warning:
+                code = 1
+            detail = ', %.1f sigma %s baseline %.6g' % (abs(deviation), deviation < 0 and 'below' or 'above', mean)
+            perfdata = ' %s_baseline=%.6g;;;; %s_sigma=%.3f;%s;%s;;' % (label, mean, label, deviation,
+                options.baseline_warning or '', options.baseline_critical or '')
+        #~ The plain mean of the samples so far while it warms up, then a fixed weight
+        samples += 1
+        alpha = max(options.baseline_alpha, 1.0 / samples)
+        difference = result - mean
+        mean += alpha * difference
+        variance = (1 - alpha) * (variance + alpha * difference * difference)
+        baseline.set(key, time.time(), [samples, mean, variance])
+    finally:
+        if store is None:
+            baseline.close()
+    return code, detail, perfdata
+
+def load_capabilities(host, extension='capabilities'):
+    #~ The map written by the --test probe; missing or older than CAPABILITY_MAX_AGE means unknown
+    import json
+    try:
+        capfile = open(host_filename(host, extension))
+        try:
+            capabilities = json.load(capfile)
+        finally:
+            capfile.close()
+    except (IOError, ValueError):
+        return None
+    if time.time() - capabilities.get('time', 0) > CAPABILITY_MAX_AGE:
+        return None
+    return capabilities
+
+def unsupported_modes(host, modes, extension='capabilities'):
+    capabilities = load_capabilities(host, extension)
+    if not capabilities:
+        return []
+    probed = capabilities['modes']
+    return [mode for mode in modes if mode in probed and probed[mode] is None]
+
+def with_server_time(query):
+    #~ Reads the server's millisecond clock in the same statement as the counters
+    return query.replace(' FROM ', ', i.ms_ticks, i.sqlserver_start_time_ms_ticks FROM sys.dm_os_sys_info i CROSS JOIN ', 1)
+
+def add_delta_options(parser):
+    delta = OptionGroup(parser, "Delta Options")
+    delta.add_option('--server-time', action="store_true", help='Calculate per second rates with the SQL Server clock '
+                     '(ms_ticks) instead of the local clock, using the average since start-up when there is no previous sample.', default=False)
+    delta.add_option('--no-state', action="store_true", help='Do not keep any state, always report the average since '
+                     'SQL Server start-up. Implies --server-time.', default=False)
+    parser.add_option_group(delta)
+
+def check_delta_options(parser, options):
+    if options.no_state:
+        options.server_time = True
+
+def server_rate(new_val, ms_ticks, start_ticks, last_run=None):
+    #~ last_run is the [value, ms_ticks] of the previous sample; without a usable one
+    #~ (cold start, SQL Server or OS restart) the average since SQL Server started is used
+    if last_run:
+        old_val, old_ticks = last_run
+        if start_ticks <= old_ticks < ms_ticks and old_val <= new_val:
+            return (new_val - old_val) / ((ms_ticks - old_ticks) / 1000.0)
+    uptime = (ms_ticks - start_ticks) / 1000.0
+    if uptime <= 0:
+        return None
+    return new_val / uptime
+
+def state_key(*parts):
+    import hashlib
+    return hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+def mode_options(parser, args, modes):
+    #~ Only the selected mode gets an option; --help and abbreviated or unknown
+    #~ options fall back to the full list so optparse can resolve or report them
+    if args is None:
+        args = sys.argv[1:]
+    selected = []
+    for arg in args:
+        name = arg.split('=', 1)[0]
+        if not name.startswith('-') or parser.has_option(name) and name not in ('-h', '--help'):
+            continue
+        if name.startswith('--') and name[2:] in modes:
+            selected.append(name[2:])
+        else:
+            return list(modes.keys())
+    return selected
+
+class NagiosRange(object):
+    
+    def __init__(self, nagstring):
+        match = RANGE_REGEX.match(nagstring)
+        if not match or not (match.group('end') or (match.group('start') or '').rstrip(':')):
+            raise Exception('Improper warning/critical format.')
+        self.inside = bool(match.group('inside'))
+        start = match.group('start')
+        end = match.group('end')
+        if start is None:
+            #~ A bare number means 0:number
+            self.start = 0.0
+        elif start.rstrip(':') in ('~', ''):
+            self.start = float('-inf')
+        else:
+            self.start = float(start.rstrip(':'))
+        if end:
+            self.end = float(end)
+        else:
+            self.end = float('inf')
+    
+    def alert(self, value):
+        outside = value < self.start or value > self.end
+        return outside != self.inside
+    
+    def alerts(self, values):
+        start, end, inside = self.start, self.end, self.inside
+        return [(v < start or v > end) != inside for v in values]
+
+def parse_range(nagstring):
+    nagrange = RANGES.get(nagstring)
+    if nagrange is None:
+        nagrange = RANGES[nagstring] = NagiosRange(nagstring)
+    return nagrange
+
+def connection_host(options):
+    host = options.hostname
+    if options.instance:
+        host += "\\" + options.instance
+    elif options.port:
+        host += ":" + options.port
+    return host
+
+def connect_db(options, login_timeout=60, timeout=0, database='master'):
+    host = connection_host(options)
+    import pymssql
+    start = time.time()
+    mssql = pymssql.connect(host = host, user = options.user, password = options.password, database=database,
+                            login_timeout = login_timeout, timeout = timeout)
+    total = time.time() - start
+    return mssql, total, host
+
+def ask_collector(path, plugin, args):
+    #~ Only falls back to a direct connection when the daemon is not listening;
+    #~ anything going wrong after the request was sent is reported as UNKNOWN
+    import socket
+    import json
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(COLLECTOR_TIMEOUT)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return
+    try:
+        request = json.dumps({ 'plugin' : plugin, 'args' : args }) + '\n'
+        sock.sendall(request.encode('utf-8'))
+        reply = b''
+        while not reply.endswith(b'\n'):
+            data = sock.recv(65536)
+            if not data:
+                raise IOError('Collector at %s closed the connection.' % path)
+            reply += data
+    finally:
+        sock.close()
+    reply = json.loads(reply.decode('utf-8'))
+    raise NagiosReturn(reply['message'], reply['code'])
+
+def counter_match(param='counters'):
+    #~ True for the counters listed in an xml parameter made by counter_patterns: one parameter
+    #~ however many counters, so the statement text and its plan stay the same
+    return "EXISTS (SELECT 1 FROM @%s.nodes(N'/c') AS n(c) WHERE RTRIM(counter_name) LIKE c.value(N'.', N'nvarchar(256)'))" % param
+
+def counter_patterns(names, prefixes=()):
+    #~ The value for counter_match: a LIKE pattern per counter name, and per prefix followed by anything
+    patterns = set([like_escape(name) for name in names] + [like_escape(prefix) + '%' for prefix in prefixes])
+    return ''.join(['<c>%s</c>' % pattern.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+                    for pattern in sorted(patterns)])
+
+def like_escape(value):
+    return value.replace('[', '[[]').replace('%', '[%]').replace('_', '[_]')
+
+def driver_errors():
+    #~ Only consulted once something failed; pymssql may never have been imported
+    pymssql = sys.modules.get('pymssql')
+    if pymssql is None:
+        return ()
+    return (pymssql.OperationalError, pymssql.InterfaceError)
+
+def process_age():
+    #~ Wall time since the process started, from /proc; elsewhere since this module was imported
+    try:
+        stat = open('/proc/self/stat')
+        try:
+            #~ starttime is field 22, counted in clock ticks since boot; the name in field 2 may hold spaces
+            started = float(stat.read().rpartition(')')[2].split()[19]) / os.sysconf('SC_CLK_TCK')
+        finally:
+            stat.close()
+        uptime = open('/proc/uptime')
+        try:
+            return float(uptime.read().split()[0]) - started
+        finally:
+            uptime.close()
+    except (IOError, OSError, ValueError, IndexError):
+        return time.time() - IMPORTED
+
+def add_startup_options(group):
+    group.add_option('--startup-time', action="store_true", help='Add the wall time from process start to the login as perfdata.', default=False)
+    group.add_option('--startup-budget', type='float', help='Start-up time in seconds; a longer start-up turns an OK result into WARNING.', default=None)
+
+def startup_perfdata(options):
+    #~ Covers interpreter start-up, imports and argument parsing; pymssql is imported with the login
+    options.startup = process_age()
+    return 'startup=%.4fs;%s;;;' % (options.startup, options.startup_budget or '')
+
+def startup_result(options, e):
+    #~ An OK result becomes WARNING when the start-up took longer than --startup-budget
+    startup = getattr(options, 'startup', None)
+    if e.code != 0 or startup is None or not options.startup_budget or startup <= options.startup_budget:
+        return e
+    stdout, bar, perfdata = e.message[len('OK: '):].partition('|')
+    return NagiosReturn('WARNING: %s, start-up took %.2fs of a %ss budget%s%s' % (
+        stdout, startup, options.startup_budget, bar, perfdata), 1)
+
+def extra_perfdata(options):
+    perfdata = list(getattr(options, 'perfdata', None) or [])
+    timer = getattr(options, 'timer', None)
+    if timer:
+        timer.mark('format')
+        if options.timings:
+            perfdata.extend(timer.perfdata())
+    if not perfdata:
+        return ''
+    return ' ' + ' '.join(perfdata)
+
+def mark_phase(options, phase):
+    timer = getattr(options, 'timer', None)
+    if timer:
+        timer.mark(phase)
+
+def add_record_option(group):
+    group.add_option('--record', help='Append the raw query results and outcome of every run to this capture file, '
+                     'for check_mssql_replay.py.', default=None)
+
+class RecordingConnection(object):
+    
+    #~ --record: keeps every query result of the run for check_mssql_replay.py
+    def __init__(self, connection, filename, plugin, host, total):
+        self.connection = connection
+        self.filename = filename
+        self.plugin = plugin
+        self.host = host
+        self.total = total
+        self.queries = []
+    
+    def cursor(self):
+        return RecordingCursor(self.connection.cursor(), self.queries)
+    
+    def close(self):
+        self.connection.close()
+    
+    def save(self, result):
+        import json
+        entry = { 'time'    : time.time(),
+                  'plugin'  : self.plugin,
+                  'args'    : scrub_args(sys.argv[1:]),
+                  'host'    : self.host,
+                  'total'   : self.total,
+                  'queries' : self.queries,
+                  'code'    : getattr(result, 'code', 3),
+                  'output'  : getattr(result, 'message', None) or '%s: %s' % (type(result).__name__, result) }
+        #~ One line per run, appended with a single write. Saved while the result is on its way
+        #~ out, so a capture that cannot be written must not replace it
+        try:
+            capture = open(self.filename, 'a')
+            try:
+                capture.write(json.dumps(entry, separators=(',', ':'), default=record_value) + '\n')
+            finally:
+                capture.close()
+        except (IOError, OSError) as e:
+            sys.stderr.write('Cannot write --record %s: %s\n' % (self.filename, e))
+
+class RecordingCursor(object):
+    
+    def __init__(self, cursor, queries):
+        self.cursor = cursor
+        self.queries = queries
+        self.rows = []
+    
+    def execute(self, query, params=None):
+        if params is None:
+            self.cursor.execute(query)
+        else:
+            self.cursor.execute(query, params)
+        self.rows = [tuple(row) for row in self.cursor.fetchall()]
+        self.queries.append([time.time(), query, self.rows])
+    
+    def fetchone(self):
+        if not self.rows:
+            return None
+        row, self.rows = self.rows[0], self.rows[1:]
+        return row
+    
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+def record_value(value):
+    #~ Decimal columns become floats, anything else JSON has no type for its text
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+def scrub_args(args):
+    #~ The capture keeps the command line for the replay, but not the password
+    scrubbed = []
+    password = False
+    for arg in args:
+        if password:
+            arg = '-'
+        elif arg.startswith('--password='):
+            arg = '--password=-'
+        elif arg.startswith('-P') and len(arg) > 2:
+            arg = '-P-'
+        password = arg in ('-P', '--password')
+        scrubbed.append(arg)
+    return scrubbed
+
+def add_timing_options(group):
+    group.add_option('--timings', action="store_true", help='Add the time spent in each phase of the check as perfdata.', default=False)
+    group.add_option('--timings-log', help='Append the phase timings of every run to this file as JSON lines.', default=None)
+
+class PhaseTimer(object):
+    
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.last = time.time()
+        self.phases = []
+        self.totals = {}
+    
+    def mark(self, phase):
+        #~ Charges the time since the previous mark to this phase
+        now = time.time()
+        if phase not in self.totals:
+            self.phases.append(phase)
+            self.totals[phase] = 0.0
+        self.totals[phase] += now - self.last
+        self.last = now
+    
+    def perfdata(self):
+        return ['phase_%s=%.6fs;;;;' % (phase, self.totals[phase]) for phase in self.phases]
+    
+    def log(self, filename, options):
+        import json
+        entry = { 'time'    : time.time(),
+                  'plugin'  : self.plugin,
+                  'host'    : options.hostname,
+                  'mode'    : options.mode or ','.join(getattr(options, 'modes', None) or []),
+                  'phases'  : self.totals }
+        #~ Runs after the check, so a log that cannot be written must not replace its result
+        try:
+            logfile = open(filename, 'a')
+            try:
+                logfile.write(json.dumps(entry, sort_keys=True) + '\n')
+            finally:
+                logfile.close()
+        except (IOError, OSError) as e:
+            sys.stderr.write('Cannot write --timings-log %s: %s\n' % (filename, e))
+
+
+def run_main(plugin, parse_args, check):
+    #~ The main() of every plugin: check() raises the NagiosReturn with the result
+    timer = PhaseTimer(plugin)
+    options = parse_args()
+    timer.mark('parse')
+    if options.timings or options.timings_log:
+        options.timer = timer
+    try:
+        check(options)
+    except Exception as e:
+        if getattr(options, 'recording', None):
+            options.recording.save(e)
+        if isinstance(e, NagiosReturn):
+            raise startup_result(options, e)
+        raise
+    finally:
+        stop_deadline(options)
+        if options.timings_log:
+            timer.log(options.timings_log, options)
+
+def check_plugin(options, plugin, run_check, database='master', snapshot=None, connection=None):
+    #~ Collector, start-up, deadline, login and --record around run_check(mssql, options, host, total);
+    #~ snapshot(options, login_timeout, timeout) may answer the check before the login. A connection
+    #~ (mssql, host) from the pool of check_mssql_collector.py replaces the login and stays open
+    if options.collector and options.mode != 'test':
+        ask_collector(options.collector, plugin, sys.argv[1:])
+    
+    if options.startup_time:
+        options.perfdata = [startup_perfdata(options)]
+    elif options.startup_budget:
+        #~ Measured for startup_result all the same, only without the perfdata
+        options.startup = process_age()
+    
+    login_timeout, timeout = start_deadline(options)
+    if snapshot:
+        snapshot(options, login_timeout, timeout)
+    if connection:
+        (mssql, host), total = connection, None
+    else:
+        mssql, total, host = login(options, login_timeout, timeout, database)
+    mark_phase(options, 'connect')
+    if options.record:
+        mssql = options.recording = RecordingConnection(mssql, options.record, plugin, host, total)
+    try:
+        run_phase(options, 'query', run_check, mssql, options, host, total)
+    finally:
+        if not connection:
+            mssql.close()
+
+def check_collector_options(parser, options):
+    #~ The start-up measured is that of the process, which with --collector is not the one running the check
+    if options.collector and (options.startup_time or options.startup_budget):
+        parser.error('--startup-time and --startup-budget cannot be combined with --collector.')
+
+def measures_login(options):
+    #~ Whether the result includes the time to connect, which a pooled connection cannot give
+    modes = list(getattr(options, 'modes', None) or [])
+    if not modes and not getattr(options, 'database_modes', None):
+        modes = [options.mode]
+    return None in modes or 'time2connect' in modes
+
+def get_states(results, warning=None, critical=None, invert=False):
+    #~ Results without a value yet (first delta sample) are never alerted on
+    states = [0] * len(results)
+    indexes = [i for i, r in enumerate(results) if r is not None]
+    values = [results[i] for i in indexes]
+    for code, nagstring in ((1, warning), (2, critical)):
+        if not nagstring:
+            continue
+        for i, alert in zip(indexes, parse_range(nagstring).alerts(values)):
+            if alert != invert:
+                states[i] = code
+    return states
+
+def get_state(result, warning=None, critical=None, invert=False):
+    return get_states([result], warning, critical, invert)[0]
+
+def inverted_ranges(warning, critical):
+    #~ check_mssql_database.py inverts the ranges when critical ends below warning (this should change someday)
+    return bool(warning and critical and parse_range(critical).end < parse_range(warning).end)
+
+def return_nagios(options, stdout='', result='', unit='', label='', key=None, invert=False):
+    #~ key is the baseline of the result, by default the one of its label; see MSSQLQuery.baseline_key
+    code = get_state(result, options.warning, options.critical, invert)
+    strresult = str(result)
+    try:
+        stdout = stdout % (strresult)
+    except TypeError as e:
+        pass
+    perfdata = ''
+    if baseline_enabled(options) and result is not None:
+        baseline_code, detail, perfdata = check_baseline(options, key or state_key(baseline_scope(options), label), label, result)
+        code = max(code, baseline_code)
+        stdout += detail
+    prefix = STATES[code] + ': '
+    stdout = '%s%s|%s=%s%s;%s;%s;;%s' % (prefix, stdout, label, strresult, unit, options.warning or '', options.critical or '', perfdata)
+    raise NagiosReturn(stdout + extra_perfdata(options), code)
+
+def get_mode_threshold(nagstring, mode):
+    #~ Batch thresholds are given as mode=range,mode=range; a plain range applies to every mode
+    if not nagstring or '=' not in nagstring:
+        return nagstring
+    for item in nagstring.split(','):
+        name, _, value = item.partition('=')
+        if name.strip() == mode:
+            return value.strip() or None
+    if '.' in mode:
+        #~ Database modes of check_mssql.py are named database.mode and fall back to mode=range
+        return get_mode_threshold(nagstring, mode.rpartition('.')[2])
+    return None
+
+def evaluate_result(options, mode, stdout='', result='', unit='', label='', key=None, baseline=None):
+    warning = get_mode_threshold(options.warning, mode)
+    critical = get_mode_threshold(options.critical, mode)
+    if result is None:
+        code = 0
+        strresult = 'U'
+    else:
+        code = get_state(result, warning, critical)
+        strresult = str(result)
+    try:
+        stdout = stdout % str(result)
+    except TypeError as e:
+        pass
+    perfdata = '%s=%s%s;%s;%s;;' % (label, strresult, unit, warning or '', critical or '')
+    if baseline_enabled(options) and result is not None:
+        key = key or state_key(baseline_scope(options), label)
+        baseline_code, detail, baseline_perfdata = check_baseline(options, key, label, result, baseline)
+        code = max(code, baseline_code)
+        stdout += detail
+        perfdata += baseline_perfdata
+    return code, stdout, perfdata
+
+def return_nagios_multi(options, results):
+    worst = 0
+    messages = []
+    perfdata = []
+    baseline = baseline_enabled(options) and BaselineStore(connection_host(options), getattr(options, 'deadline', None)).open() or None
+    try:
+        for result in results:
+            code, stdout, perf = evaluate_result(options, *result, baseline=baseline)
+            if code:
+                stdout = '%s (%s)' % (stdout, STATES[code])
+            if code > worst:
+                worst = code
+            messages.append(stdout)
+            perfdata.append(perf)
+    finally:
+        if baseline:
+            baseline.close()
+    stdout = '%s: %s|%s' % (STATES[worst], ', '.join(messages), ' '.join(perfdata))
+    raise NagiosReturn(stdout + extra_perfdata(options), worst)
+
+def return_probe(options, target, capabilities, latency):
+    #~ A mode is None when unsupported, True when found by the one counter query taking latency,
+    #~ otherwise the seconds its own query took
+    modes = capabilities['modes']
+    supported = [k for k in sorted(modes) if modes[k] is not None]
+    code = len(supported) < len(modes) and 1 or 0
+    lines = []
+    for mode in sorted(modes):
+        if modes[mode] is None:
+            lines.append('%s: not supported' % mode)
+        elif modes[mode] is True:
+            lines.append('%s: supported' % mode)
+        else:
+            lines.append('%s: supported, %.1fms' % (mode, modes[mode] * 1000))
+    stdout = '%s: %d/%d modes supported by %s (SQL Server %s, object prefix %s), counters probed in %.1fms|probe=%.6fs;;;;' % (
+        STATES[code], len(supported), len(modes), target, capabilities['version'],
+        ', '.join(capabilities['prefixes']) or 'unknown', latency * 1000, latency)
+    raise NagiosReturn(stdout + extra_perfdata(options) + '\n' + '\n'.join(lines), code)
+
+class MSSQLQuery(object):
+    
+    #~ Built from a MODES entry. Where the plugins differ it is a key of the entry, see DATABASE_ENTRY
+    #~ of check_mssql_database.py: instance is the @instance parameter, invert_ranges is handed to
+    #~ return_nagios, first_result and zero_base are for MSSQLDeltaQuery and MSSQLDivideQuery
+    def __init__(self, query, options, label='', unit='', stdout='', host='', modifier=1, *args, **kwargs):
+        self.query = query
+        self.params = query_params(query, kwargs)
+        self.label = label
+        self.unit = unit
+        self.stdout = stdout
+        self.options = options
+        self.host = host
+        self.modifier = modifier
+        self.instance = kwargs.get('instance')
+        self.invert_ranges = kwargs.get('invert_ranges', False)
+    
+    def delta_key(self, *parts):
+        #~ The statement is shared by many counters and databases, its parameter values tell them apart
+        values = ['%s' % self.params[name] for name in sorted(self.params)]
+        return state_key(*([self.host, self.query] + values + list(parts)))
+    
+    def baseline_key(self):
+        #~ Per statement and parameter values like the delta state, so --counter keeps a baseline per object,
+        #~ counter and instance, and per database through the instance, which not every statement takes
+        return self.delta_key('baseline', baseline_scope(self.options), '%s' % self.instance, self.label)
+    
+    def run_on_connection(self, connection):
+        cur = connection.cursor()
+        execute_sql(cur, self.query, self.params)
+        mark_phase(self.options, 'execute')
+        self.query_result = cur.fetchone()[0]
+        mark_phase(self.options, 'fetch')
+    
+    def load_values(self, values):
+        self.query_result = values[0]
+    
+    def finish(self):
+        return_nagios(  self.options,
+                        self.stdout,
+                        self.result,
+                        self.unit,
+                        self.label,
+                        self.baseline_key(),
+                        self.invert_ranges and inverted_ranges(self.options.warning, self.options.critical) )
+    
+    def calculate_result(self):
+        self.result = float(self.query_result) * self.modifier
+    
+    def do(self, connection):
+        self.run_on_connection(connection)
+        self.calculate_result()
+        mark_phase(self.options, 'calculate')
+        self.finish()
+
+class MSSQLDivideQuery(MSSQLQuery):
+    
+    def __init__(self, *args, **kwargs):
+        super(MSSQLDivideQuery, self).__init__(*args, **kwargs)
+        #~ The result over a zero base; None keeps the value itself, as check_mssql_server.py always did
+        self.zero_base = kwargs.get('zero_base')
+    
+    def calculate_result(self):
+        if self.query_result[1] != 0:
+            self.result = (float(self.query_result[0]) / self.query_result[1]) * self.modifier
+        elif self.zero_base is not None:
+            self.result = self.zero_base
+        else:
+            self.result = float(self.query_result[0]) * self.modifier
+    
+    def run_on_connection(self, connection):
+        cur = connection.cursor()
+        execute_sql(cur, self.query, self.params)
+        mark_phase(self.options, 'execute')
+        self.query_result = [x[0] for x in cur.fetchall()]
+        mark_phase(self.options, 'fetch')
+    
+    def load_values(self, values):
+        self.query_result = values
+
+class MSSQLDeltaQuery(MSSQLQuery):
+    
+    store = None
+    ms_ticks = None
+    sampled = None
+    
+    def __init__(self, *args, **kwargs):
+        super(MSSQLDeltaQuery, self).__init__(*args, **kwargs)
+        #~ The result without a previous sample: None is not alerted on, check_mssql_database.py reports 0
+        self.first_result = kwargs.get('first_result')
+    
+    def run_on_connection(self, connection):
+        if not self.options.server_time:
+            return super(MSSQLDeltaQuery, self).run_on_connection(connection)
+        cur = connection.cursor()
+        execute_sql(cur, with_server_time(self.query), self.params)
+        mark_phase(self.options, 'execute')
+        self.query_result, self.ms_ticks, self.start_ticks = cur.fetchone()
+        mark_phase(self.options, 'fetch')
+    
+    def calculate_server_rate(self):
+        if self.options.no_state:
+            last_run = None
+        else:
+            store = self.store or StateStore(self.host, deadline=getattr(self.options, 'deadline', None)).open()
+            try:
+                key = self.delta_key('ms_ticks')
+                last_run = store.get(key)
+                store.set(key, time.time(), [self.query_result, self.ms_ticks])
+            finally:
+                if store is not self.store:
+                    store.close()
+            last_run = last_run and last_run[1]
+        self.result = server_rate(self.query_result, self.ms_ticks, self.start_ticks, last_run)
+        if self.result is not None:
+            self.result *= self.modifier
+    
+    def calculate_result(self):
+        if self.ms_ticks is not None:
+            self.calculate_server_rate()
+            return
+        #~ Batches share one open store, single checks lock the host file just for this update
+        store = self.store or StateStore(self.host, deadline=getattr(self.options, 'deadline', None)).open()
+        try:
+            key = self.delta_key()
+            last_run = store.get(key)
+            new_time = self.sampled or time.time()
+            
+            if last_run and last_run[0] >= new_time:
+                #~ The same --snapshot-ttl sample again, there is no newer value to compare with
+                self.result = None
+                return
+            elif last_run:
+                old_time, old_val = last_run
+                new_val = self.query_result
+                self.result = ((new_val - old_val) / (new_time - old_time)) * self.modifier
+            else:
+                self.result = self.first_result
+            
+            store.set(key, new_time, self.query_result)
+        finally:
+            if store is not self.store:
+                store.close()
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+import subprocess
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(TESTS_DIR)
+DRIVER_DIR = os.path.join(PLUGIN_DIR, 'bench', 'fakedriver')
+
+#~ The plugins import pymssql lazily, the stand-in driver answers them without a SQL Server
+sys.path.insert(0, PLUGIN_DIR)
+sys.path.insert(0, DRIVER_DIR)
+
+CREDENTIALS = ['-U', 'monitor', '-P', 'secret']
+
+@pytest.fixture(autouse=True)
+def scratch(tmp_path, monkeypatch):
+    #~ State, baseline, breaker and capture files of every test go to its own directory
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    monkeypatch.setenv('TMPDIR', str(tmp_path))
+    for name in list(os.environ):
+        if name.startswith('FAKE_PYMSSQL_'):
+            monkeypatch.delenv(name)
+    return tmp_path
+
+def server_options(*args):
+    import check_mssql_server
+    return check_mssql_server.parse_args(['-H', 'testhost'] + CREDENTIALS + list(args))
+
+def database_options(*args):
+    import check_mssql_database
+    return check_mssql_database.parse_args(['-H', 'testhost'] + CREDENTIALS + list(args))
+
+def run_plugin(script, *args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([DRIVER_DIR, PLUGIN_DIR])
+    process = subprocess.Popen([sys.executable, os.path.join(PLUGIN_DIR, script)] + list(args), env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0].decode('utf-8')
+    return process.returncode, output
@@ -0,0 +1,76 @@
+import mssql_common
+
+from conftest import server_options
+
+def baseline_entry(options, key):
+    store = mssql_common.BaselineStore(mssql_common.connection_host(options)).open()
+    try:
+        return store.get(key)[1]
+    finally:
+        store.close()
+
+def test_warmup_uses_plain_mean():
+    options = server_options('--pagelife', '--baseline-warning', '2', '--baseline-warmup', '4')
+    for value in (10, 20, 30):
+        code, detail, perfdata = mssql_common.check_baseline(options, 'key', 'pagelife', value)
+        assert code == 0
+        assert 'warming up' in detail
+        assert perfdata == ''
+    samples, mean, variance = baseline_entry(options, 'key')
+    assert samples == 3
+    assert abs(mean - 20.0) < 1e-9
+
+def test_ewma_update():
+    options = server_options('--pagelife', '--baseline-warning', '2', '--baseline-warmup', '1', '--baseline-alpha', '0.5')
+    mssql_common.check_baseline(options, 'key', 'pagelife', 10)
+    assert baseline_entry(options, 'key') == [1, 10.0, 0.0]
+    mssql_common.check_baseline(options, 'key', 'pagelife', 20)
+    samples, mean, variance = baseline_entry(options, 'key')
+    assert samples == 2
+    assert abs(mean - 15.0) < 1e-9
+    assert abs(variance - 25.0) < 1e-9
+    #~ On the mean: no deviation, the new sample pulls it nowhere
+    code, detail, perfdata = mssql_common.check_baseline(options, 'key', 'pagelife', 15)
+    assert code == 0
+    assert '0.0 sigma' in detail
+    assert 'pagelife_baseline=15' in perfdata
+
+def test_thresholds_and_direction():
+    options = server_options('--pagelife', '--baseline-warning', '2', '--baseline-critical', '3', '--baseline-warmup', '3')
+    #~ A counter that never moved has a sigma of 1% of its mean
+    for key, value, code in (('warning', 102.5, 1), ('critical', 104, 2), ('below', 96, 2)):
+        for _ in range(3):
+            mssql_common.check_baseline(options, key, 'pagelife', 100)
+        assert mssql_common.check_baseline(options, key, 'pagelife', value)[0] == code
+    options.baseline_direction = 'above'
+    for _ in range(3):
+        mssql_common.check_baseline(options, 'above', 'pagelife', 100)
+    assert mssql_common.check_baseline(options, 'above', 'pagelife', 96)[0] == 0
+
+def counter_key(*args):
+    import check_mssql_server
+    options = server_options('--baseline-warning', '2', *args)
+    entry = check_mssql_server.counter_query(options, ['SQLServer:Locks', 'Lock Requests/sec', args[1].rsplit(':', 1)[1], 272696320, None])
+    return check_mssql_server.make_query('counter', options, 'testhost', { 'counter' : entry }).baseline_key()
+
+def test_counter_keyed_by_instance():
+    #~ Both counters get the label lock_requests_sec, their baselines stay apart
+    assert counter_key('--counter', 'Locks:Lock Requests/sec:Page') != counter_key('--counter', 'Locks:Lock Requests/sec:Key')
+
+def test_mode_alone_and_in_batch_keyed_apart():
+    import check_mssql_server
+    keys = []
+    for args in (['--batchreq'], ['--modes', 'batchreq,pagelife']):
+        options = server_options('--baseline-warning', '2', *args)
+        keys.append(check_mssql_server.make_query('batchreq', options, 'testhost').baseline_key())
+    assert keys[0] != keys[1]
+
+def test_database_keyed_by_database():
+    import check_mssql_database
+    from conftest import database_options
+    keys = []
+    for database in ('appdb001', 'appdb002'):
+        options = database_options('-T', database, '--fragmentation', '--baseline-warning', '2')
+        entry = dict(check_mssql_database.MODES['fragmentation'], instance=database)
+        keys.append(check_mssql_database.MSSQLFragmentationQuery(options=options, host='testhost', **entry).baseline_key())
+    assert keys[0] != keys[1]
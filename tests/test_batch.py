@@ -0,0 +1,52 @@
+import re
+
+import mssql_common
+
+from conftest import run_plugin, CREDENTIALS
+
+def check(*args):
+    return run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + list(args)))
+
+def test_one_query_for_the_counters(scratch, monkeypatch):
+    log = scratch / 'queries.log'
+    monkeypatch.setenv('FAKE_PYMSSQL_QUERY_LOG', str(log))
+    code, output = check('--modes', 'pagelife,bufferhitratio,freepages,averagewait')
+    assert code == 0, output
+    assert 'page_life_expectancy=3600.0' in output
+    assert 'buffer_cache_hit_ratio=99.0%' in output
+    assert 'free_pages=2048.0' in output
+    assert 'averagewait=' in output
+    queries = [line for line in open(str(log)) if 'sysperfinfo' in line]
+    assert len(queries) == 1
+
+def test_dmv_modes_in_batch():
+    code, output = check('--modes', 'pagelife,memory,connections')
+    assert code == 0, output
+    assert 'memory=63.5' in output
+    assert 'connections=201' in output
+
+def test_per_mode_thresholds():
+    code, output = check('--modes', 'pagelife,memory', '-w', 'pagelife=5000:,memory=90', '-c', 'pagelife=1000:')
+    assert code == 1
+    assert 'Page Life Expectancy is 3600.0/sec (WARNING)' in output
+    assert 'memory=63.5;90;;;' in output
+
+def test_plain_threshold_for_every_mode():
+    code, output = check('--modes', 'freepages,stolenpages', '-c', '10000')
+    assert code == 2
+    assert output.count('(CRITICAL)') == 1
+
+def test_mode_threshold_lookup():
+    assert mssql_common.get_mode_threshold('pagelife=300:,cpu=80', 'cpu') == '80'
+    assert mssql_common.get_mode_threshold('pagelife=300:', 'cpu') is None
+    assert mssql_common.get_mode_threshold('80', 'cpu') == '80'
+    #~ Database modes of check_mssql.py fall back to the mode name
+    assert mssql_common.get_mode_threshold('logfileusage=80', 'appdb001.logfileusage') == '80'
+
+def test_first_run_of_rates():
+    code, output = check('--modes', 'batchreq,pagelife')
+    #~ A rate without a previous sample is reported but never alerted on
+    assert code == 0
+    code, output = check('--modes', 'batchreq,pagelife', '-w', 'batchreq=0:1')
+    assert code == 1
+    assert re.search(r'batch_requests=[\d.]+;0:1', output)
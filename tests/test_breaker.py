@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import mssql_common
+
+from conftest import server_options
+
+def breaker(*args):
+    options = server_options('--time2connect', '--breaker', '2', '--breaker-backoff', '30', *args)
+    return mssql_common.CircuitBreaker('testhost', options)
+
+def reopen(circuit):
+    #~ Moves the end of the backoff into the past instead of waiting for it
+    state = circuit.read()
+    state['open_until'] = time.time() - 1
+    mssql_common.write_json_file(circuit.filename, state)
+
+def test_closed_without_failures():
+    assert breaker().before_login(5) is False
+
+def test_opens_after_failures():
+    circuit = breaker()
+    circuit.failed(Exception('Unable to connect'))
+    #~ Below --breaker the login still happens, there is a streak to clear
+    assert circuit.before_login(5) is True
+    circuit.failed(Exception('Unable to connect'))
+    with pytest.raises(mssql_common.NagiosReturn) as e:
+        circuit.before_login(5)
+    assert e.value.code == 3
+    assert 'after 2 failed logins' in e.value.message
+    assert 'Unable to connect' in e.value.message
+
+def test_breaker_state():
+    circuit = breaker('--breaker-state', 'CRITICAL')
+    circuit.failed(Exception('down'))
+    circuit.failed(Exception('down'))
+    with pytest.raises(mssql_common.NagiosReturn) as e:
+        circuit.before_login(5)
+    assert e.value.code == 2
+
+def test_half_open_probe():
+    circuit = breaker()
+    circuit.failed(Exception('down'))
+    circuit.failed(Exception('down'))
+    reopen(circuit)
+    #~ The first check past the backoff probes, the others keep failing fast meanwhile
+    assert circuit.before_login(5) is True
+    with pytest.raises(mssql_common.NagiosReturn):
+        circuit.before_login(5)
+    circuit.failed(Exception('still down'))
+    assert circuit.read()['backoff'] == 60
+    reopen(circuit)
+    circuit.before_login(5)
+    circuit.succeeded()
+    assert circuit.read() is None
+    assert circuit.before_login(5) is False
+
+def test_window():
+    circuit = breaker('--breaker-window', '60')
+    circuit.failed(Exception('down'))
+    state = circuit.read()
+    state['first_failure'] -= 61
+    mssql_common.write_json_file(circuit.filename, state)
+    #~ The earlier failure is outside the window, the count starts over
+    circuit.failed(Exception('down'))
+    assert circuit.read()['failures'] == 1
+
+def test_login_counts_unreachable_hosts(monkeypatch):
+    import pymssql
+    options = server_options('--time2connect', '--breaker', '2')
+    monkeypatch.setenv('FAKE_PYMSSQL_DOWN_HOSTS', 'testhost')
+    for _ in range(2):
+        with pytest.raises(pymssql.OperationalError):
+            mssql_common.login(options, 5, 0)
+    with pytest.raises(mssql_common.NagiosReturn):
+        mssql_common.login(options, 5, 0)
+
+def test_login_ignores_refused_logins(monkeypatch):
+    import pymssql
+    options = server_options('--time2connect', '--breaker', '2')
+    monkeypatch.setenv('FAKE_PYMSSQL_PASSWORD', 'other')
+    for _ in range(3):
+        with pytest.raises(pymssql.OperationalError) as e:
+            mssql_common.login(options, 5, 0)
+        assert e.value.args[0] == 18456
+    assert mssql_common.CircuitBreaker('testhost', options).read() is None
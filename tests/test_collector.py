@@ -0,0 +1,89 @@
+import json
+import threading
+
+import pytest
+
+import check_mssql_collector
+import check_mssql_server
+
+from conftest import CREDENTIALS
+
+ARGS = ['-H', 'testhost'] + CREDENTIALS
+
+def run(pool, *args, **kwargs):
+    #~ Like a request of the daemon, in a thread of its own
+    result = []
+    thread = threading.Thread(target=lambda: result.append(
+        check_mssql_collector.run_plugin(pool, kwargs.get('plugin', 'server'), ARGS + list(args))))
+    thread.start()
+    thread.join()
+    return result[0]
+
+@pytest.fixture
+def closed(monkeypatch):
+    import pymssql
+    closed = []
+    monkeypatch.setattr(pymssql.Connection, 'close', lambda self: closed.append(self))
+    return closed
+
+def test_pooled_connection_kept(closed):
+    pool = check_mssql_collector.ConnectionPool()
+    message, code = run(pool, '--pagelife')
+    assert code == 0, message
+    assert 'page_life_expectancy=3600.0' in message
+    [(mssql, _, _)] = list(pool.idle.values())[0]
+    message, code = run(pool, '--memory')
+    assert code == 0, message
+    #~ The same connection served both checks and was never closed
+    assert list(pool.idle.values())[0][0][0] is mssql
+    assert closed == []
+
+def test_login_time_not_pooled(closed):
+    pool = check_mssql_collector.ConnectionPool()
+    message, code = run(pool, '--time2connect', '-w', '10')
+    assert code == 0, message
+    assert 'time=' in message
+    assert pool.idle == {}
+    assert len(closed) == 1
+    message, code = run(pool, '--modes', 'pagelife,time2connect')
+    assert 'Time to connect was None' not in message
+    assert pool.idle == {}
+
+def test_timeout_in_worker_thread():
+    pool = check_mssql_collector.ConnectionPool()
+    message, code = run(pool, '--pagelife', '-t', '10')
+    assert code == 0, message
+
+def test_record(scratch):
+    pool = check_mssql_collector.ConnectionPool()
+    capture = str(scratch / 'capture.jsonl')
+    message, code = run(pool, '--pagelife', '--record', capture)
+    [recorded] = [json.loads(line) for line in open(capture)]
+    assert recorded['code'] == code
+    assert recorded['output'] == message
+
+def test_timings():
+    pool = check_mssql_collector.ConnectionPool()
+    message, code = run(pool, '--pagelife', '--timings')
+    assert code == 0, message
+    assert 'phase_execute=' in message
+
+def test_breaker(monkeypatch):
+    pool = check_mssql_collector.ConnectionPool()
+    monkeypatch.setenv('FAKE_PYMSSQL_DOWN_HOSTS', 'testhost')
+    for _ in range(2):
+        message, code = run(pool, '--pagelife', '--breaker', '2')
+        assert 'Unable to connect' in message
+    message, code = run(pool, '--pagelife', '--breaker', '2')
+    assert 'after 2 failed logins' in message
+
+def test_database_plugin():
+    pool = check_mssql_collector.ConnectionPool()
+    message, code = run(pool, '-T', 'appdb001', '--logfileusage', plugin='database')
+    assert code == 0, message
+    assert list(pool.idle)[0][5] == 'appdb001'
+
+def test_client_rejects_startup_options():
+    for option in (['--startup-time'], ['--startup-budget', '1']):
+        with pytest.raises(SystemExit):
+            check_mssql_server.parse_args(ARGS + ['--pagelife', '--collector', '/nonexistent.sock'] + option)
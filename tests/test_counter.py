@@ -0,0 +1,90 @@
+import json
+import re
+import time
+
+import pytest
+
+import check_mssql_server
+import mssql_common
+
+from conftest import run_plugin, CREDENTIALS
+
+def counter(name, *args):
+    return run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--counter', name] + list(args)))
+
+def test_parse_counter():
+    assert check_mssql_server.parse_counter('Buffer Manager:Page life expectancy') == \
+        ('Buffer Manager', 'Page life expectancy', '')
+    assert check_mssql_server.parse_counter('MSSQL$REPORTING:Databases:Transactions/sec:sales') == \
+        ('Databases', 'Transactions/sec', 'sales')
+    assert check_mssql_server.parse_counter('Buffer Manager') is None
+
+def test_base_found_by_prefix():
+    rows = [('SQLServer:Locks', 'Average Wait Time (ms)', '_Total', 1073874176),
+            ('SQLServer:Locks', 'Average Wait Time Base', '_Total', 1073939712),
+            ('SQLServer:Locks', 'Lock Wait Time (ms)', '_Total', 272696576),
+            ('SQLServer:Locks', 'Average Wait Time Base', 'Object', 1073939712)]
+    catalog = check_mssql_server.build_catalog(rows)['counters']
+    assert catalog['locks|average wait time (ms)|_total'][4] == 'Average Wait Time Base'
+    assert catalog['locks|lock wait time (ms)|_total'][4] is None
+
+@pytest.mark.parametrize('cntr_type, query_type, unit', [
+    (65792, 'standard', ''),
+    (272696576, 'delta', ''),
+    (537003264, 'divide', '%'),
+    (1073874176, 'average', ''),
+])
+def test_cntr_type_mapping(cntr_type, query_type, unit):
+    sql_query = check_mssql_server.counter_query(None, ['SQLServer:Test', 'Some counter', '', cntr_type, 'Some counter base'])
+    assert sql_query['type'] == query_type
+    assert sql_query.get('unit', '') == unit
+    assert sql_query['label'] == 'some_counter'
+
+def test_unsupported_cntr_type():
+    with pytest.raises(mssql_common.NagiosReturn) as e:
+        check_mssql_server.counter_query(None, ['SQLServer:Test', 'Odd', '', 1, None])
+    assert 'cntr_type 1' in e.value.message
+    with pytest.raises(mssql_common.NagiosReturn) as e:
+        check_mssql_server.counter_query(None, ['SQLServer:Test', 'Ratio', '', 537003264, None])
+    assert 'No base counter' in e.value.message
+
+def test_counter_values():
+    code, output = counter('SQLServer:Buffer Manager:Buffer cache hit ratio', '-w', '99.5:')
+    assert code == 1
+    assert 'buffer_cache_hit_ratio=99.0%' in output
+    counter('Databases:Transactions/sec:appdb001')
+    code, output = counter('Databases:Transactions/sec:appdb001')
+    assert re.search(r'transactions_sec=[\d.]+;', output)
+
+def catalog_queries(log):
+    return len([line for line in open(log) if 'FROM sys.dm_os_performance_counters;' in line])
+
+def age_catalog(seconds):
+    filename = mssql_common.host_filename('testhost', 'counters')
+    catalog = json.load(open(filename))
+    catalog['time'] = time.time() - seconds
+    json.dump(catalog, open(filename, 'w'))
+
+def test_catalog_refresh(scratch, monkeypatch):
+    log = str(scratch / 'queries.log')
+    monkeypatch.setenv('FAKE_PYMSSQL_QUERY_LOG', log)
+    counter('Buffer Manager:Page life expectancy')
+    counter('Buffer Manager:Free pages')
+    #~ Fetched once, then read from the cache
+    assert catalog_queries(log) == 1
+    age_catalog(check_mssql_server.CATALOG_MAX_AGE + 1)
+    counter('Buffer Manager:Free pages')
+    assert catalog_queries(log) == 2
+
+def test_unknown_counter_refreshes_once(scratch, monkeypatch):
+    log = str(scratch / 'queries.log')
+    monkeypatch.setenv('FAKE_PYMSSQL_QUERY_LOG', log)
+    code, output = counter('Nope:Nothing')
+    assert code == 3
+    assert 'not found' in output
+    #~ A fresh catalog is not fetched again for an unknown counter
+    counter('Nope:Nothing')
+    assert catalog_queries(log) == 1
+    age_catalog(120)
+    counter('Nope:Nothing')
+    assert catalog_queries(log) == 2
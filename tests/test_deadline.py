@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+import mssql_common
+import pymssql
+
+from conftest import run_plugin, CREDENTIALS
+
+def deadline(budget, phase=None):
+    #~ A Deadline without the SIGALRM backstop, as in a worker thread
+    options = type('Options', (object,), {'deadline': mssql_common.Deadline(budget)})()
+    if phase:
+        options.deadline.phase = phase
+    return options
+
+def test_timeouts_split_the_budget():
+    assert mssql_common.Deadline(10).timeouts() == (4, 4)
+    #~ pymssql takes whole seconds and 0 would mean none at all
+    assert mssql_common.Deadline(1).timeouts() == (1, 1)
+
+def test_enter_after_the_budget():
+    options = deadline(-1)
+    with pytest.raises(mssql_common.NagiosReturn) as e:
+        mssql_common.run_phase(options, 'query', lambda: 'not run')
+    assert e.value.code == 3
+    assert e.value.message == 'UNKNOWN: The -1s timeout ran out during query'
+
+def test_phase_within_the_budget():
+    options = deadline(30)
+    assert mssql_common.run_phase(options, 'query', lambda value: value, 'done') == 'done'
+    assert options.deadline.phase == 'query'
+
+def test_driver_timeout_names_the_phase():
+    def timed_out():
+        raise pymssql.OperationalError('Adaptive Server connection timed out\n(testhost)')
+    with pytest.raises(mssql_common.NagiosReturn) as e:
+        mssql_common.run_phase(deadline(30), 'login', timed_out)
+    assert e.value.message == 'UNKNOWN: The 30s timeout ran out during login (Adaptive Server connection timed out (testhost))'
+
+def test_other_driver_errors_pass():
+    def failed():
+        raise pymssql.OperationalError('Login failed for user')
+    with pytest.raises(pymssql.OperationalError):
+        mssql_common.run_phase(deadline(30), 'login', failed)
+
+def test_alarm_waits_for_release():
+    options = deadline(30, 'state')
+    options.deadline.hold()
+    #~ Not in the middle of a state file write
+    options.deadline.alarm(None, None)
+    assert options.deadline.expired
+    with pytest.raises(mssql_common.NagiosReturn) as e:
+        options.deadline.release()
+    assert 'ran out during state' in e.value.message
+
+def test_no_alarm_outside_the_main_thread():
+    options = type('Options', (object,), {'timeout': 5.0})()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(mssql_common.start_deadline(options)))
+    thread.start()
+    thread.join()
+    assert result == [(2, 2)]
+    assert not options.deadline.alarmed
+
+def test_login_runs_out(monkeypatch):
+    monkeypatch.setenv('FAKE_PYMSSQL_CONNECT_MS', '5000')
+    code, output = run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--pagelife', '-t', '2']))
+    assert code == 3
+    assert output.startswith('UNKNOWN: The 2.0s timeout ran out during login')
+
+def test_query_runs_out(monkeypatch):
+    monkeypatch.setenv('FAKE_PYMSSQL_QUERY_MS', '5000')
+    code, output = run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--pagelife', '-t', '2']))
+    assert code == 3
+    assert output.startswith('UNKNOWN: The 2.0s timeout ran out during query')
+
+def test_within_the_timeout():
+    code, output = run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--pagelife', '-t', '10']))
+    assert code == 0, output
@@ -0,0 +1,49 @@
+import check_mssql
+import check_mssql_database
+import check_mssql_server
+import mssql_common
+
+from conftest import server_options, database_options, run_plugin, CREDENTIALS
+
+def divide(options, **entry):
+    query = mssql_common.MSSQLDivideQuery(check_mssql_server.DIVI_QUERY, options, modifier=100, **entry)
+    query.load_values([5, 0])
+    query.calculate_result()
+    return query.result
+
+def test_zero_base():
+    options = server_options('--bufferhitratio')
+    assert divide(options) == 500.0
+    assert divide(options, **check_mssql_database.DATABASE_ENTRY) == 0
+
+def delta(options, **entry):
+    query = mssql_common.MSSQLDeltaQuery(check_mssql_database.BASE_QUERY, options, host='testhost',
+                                         counter='Transactions/sec', instance='appdb001', **entry)
+    query.load_values([1000])
+    query.calculate_result()
+    return query.result
+
+def test_first_result():
+    assert delta(server_options('--batchreq')) is None
+    assert delta(database_options('-T', 'appdb002', '--transpsec'), **check_mssql_database.DATABASE_ENTRY) == 0
+
+def test_database_modes_match_database_plugin():
+    #~ The same counter gives the same first result through both plugins
+    code, output = run_plugin('check_mssql_database.py', '-H', 'testhost', *(CREDENTIALS + ['-T', 'appdb001', '--transpsec']))
+    assert code == 0
+    assert 'transactions_per_sec=0;' in output
+    code, output = run_plugin('check_mssql.py', '-H', 'testhost', *(CREDENTIALS + ['-T', 'appdb002', '--database-modes', 'transpsec']))
+    assert code == 0
+    assert 'appdb002_transactions_per_sec=0;' in output
+
+def test_database_entry_in_database_queries():
+    queries, names = check_mssql.database_queries(['appdb001'], ['logcachehit'])
+    assert names == ['appdb001.logcachehit']
+    assert queries['appdb001.logcachehit']['instance'] == 'appdb001'
+    assert queries['appdb001.logcachehit']['zero_base'] == 0
+
+def test_inverted_ranges():
+    assert mssql_common.inverted_ranges('20', '10')
+    assert not mssql_common.inverted_ranges('10', '20')
+    assert not mssql_common.inverted_ranges('10', None)
+    assert mssql_common.get_states([15, 5], '20', '10', True) == [1, 2]
@@ -0,0 +1,63 @@
+import re
+
+import pytest
+
+import check_mssql_database
+import check_mssql_exporter
+import check_mssql_server
+import mssql_common
+
+from conftest import CREDENTIALS
+
+def collect():
+    options = check_mssql_exporter.parse_args(['-H', 'testhost'] + CREDENTIALS)
+    return check_mssql_exporter.Collector(options, 15).collect()
+
+def samples(text):
+    return dict([line.rsplit(' ', 1) for line in text.split('\n') if line and not line.startswith('#')])
+
+@pytest.mark.parametrize('modes, names', [
+    (check_mssql_server.MODES, check_mssql_exporter.SERVER_METRICS),
+    (check_mssql_database.MODES, check_mssql_exporter.DATABASE_METRICS),
+])
+def test_every_counter_mode_named(modes, names):
+    assert sorted(names) == sorted([mode for mode in modes if 'counter' in modes[mode]])
+    for name in names.values():
+        assert re.match(r'^mssql_[a-z_]+$', name)
+        assert not name.endswith('_total')
+
+def test_names_unique():
+    names = list(check_mssql_exporter.SERVER_METRICS.values()) + list(check_mssql_exporter.SERVER_BASE_METRICS.values()) +\
+        list(check_mssql_exporter.DATABASE_METRICS.values())
+    assert len(set(names)) == len(names)
+
+def test_collect():
+    values = samples(collect())
+    assert values['mssql_buffer_database_pages'] == '200000.0'
+    assert values['mssql_database_data_size_kilobytes{database="appdb001"}'] == '1048581.0'
+    assert 'mssql_sql_batch_requests_total' in values
+    assert 'mssql_lock_average_wait_base_total' in values
+    assert values['mssql_up'] == '1.0'
+    assert values['mssql_collect_error{part="counters"}'] == '0.0'
+
+def test_failing_part(monkeypatch):
+    def fail(self, metrics, mssql):
+        raise ValueError('no permission')
+    monkeypatch.setattr(check_mssql_exporter.Collector, 'collect_waitstats', fail)
+    values = samples(collect())
+    assert values['mssql_collect_error{part="waitstats"}'] == '1.0'
+    assert 'mssql_wait_time_milliseconds_total{category="lock"}' not in values
+    assert values['mssql_up'] == '1.0'
+
+@pytest.mark.parametrize('error', [RuntimeError('unexpected'), KeyError('server')])
+def test_unreachable_target(monkeypatch, error):
+    def connect_db(options):
+        raise error
+    monkeypatch.setattr(mssql_common, 'connect_db', connect_db)
+    values = samples(collect())
+    assert values['mssql_up'] == '0.0'
+    assert values['mssql_collect_error{part="counters"}'] == '1.0'
+
+def test_down_host(monkeypatch):
+    monkeypatch.setenv('FAKE_PYMSSQL_DOWN_HOSTS', 'testhost')
+    assert samples(collect())['mssql_up'] == '0.0'
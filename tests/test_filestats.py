@@ -0,0 +1,82 @@
+import check_mssql_server
+
+from conftest import server_options
+
+def file_rows(ms_ticks, files, start_ticks=1000):
+    #~ Rows of FILE_QUERY from (database_id, file_id, reads, read stall, writes, write stall)
+    return [(ms_ticks, start_ticks, database_id, file_id, 'db%d' % database_id, 'file%d' % file_id,
+             reads, reads * 8192, read_stall, writes, writes * 8192, write_stall)
+            for database_id, file_id, reads, read_stall, writes, write_stall in files]
+
+def latency(options, ms_ticks, files, start_ticks=1000):
+    options.perfdata = None
+    query = check_mssql_server.make_query('filelatency', options, 'testhost')
+    query.query_result = file_rows(ms_ticks, files, start_ticks)
+    query.calculate_result()
+    return query
+
+def test_first_run_since_start():
+    query = latency(server_options('--filelatency'), 11000, [(5, 1, 100, 500, 10, 20), (5, 2, 0, 0, 50, 50)])
+    assert query.result == 5.0
+    assert '(db5/file1)' in query.stdout
+    #~ 10 seconds since SQL Server started
+    assert 'read_iops=10.000;;;0;' in query.options.perfdata
+
+def test_delta_between_runs():
+    options = server_options('--filelatency')
+    latency(options, 11000, [(5, 1, 100, 500, 10, 20)])
+    query = latency(options, 21000, [(5, 1, 200, 2500, 10, 20)])
+    assert query.result == 20.0
+    assert 'read_iops=10.000;;;0;' in query.options.perfdata
+
+def test_zero_latency_kept():
+    options = server_options('--filelatency')
+    latency(options, 11000, [(5, 1, 100, 500, 0, 0)])
+    query = latency(options, 21000, [(5, 1, 200, 500, 0, 0)])
+    assert query.result == 0.0
+    assert 'read 0.0 ms' in query.stdout
+
+def test_min_ios():
+    options = server_options('--filelatency', '--min-ios', '10')
+    latency(options, 11000, [(5, 1, 100, 500, 0, 0)])
+    #~ One slow read on an otherwise idle file is not counted
+    query = latency(options, 21000, [(5, 1, 101, 1500, 0, 0)])
+    assert query.result == 0.0
+
+def test_file_recreated():
+    options = server_options('--filelatency')
+    latency(options, 11000, [(5, 1, 100, 500, 10, 20), (5, 2, 100, 100, 0, 0)])
+    #~ File 1 was dropped and added again with the same id, its counters restarted
+    query = latency(options, 21000, [(5, 1, 10, 90, 0, 0), (5, 2, 200, 200, 0, 0)])
+    assert query.result == 1.0
+    assert 'db5/file1' not in query.stdout
+    assert 'read_iops=10.000;;;0;' in query.options.perfdata
+    #~ The next run has a baseline for it
+    query = latency(options, 31000, [(5, 1, 20, 190, 0, 0), (5, 2, 300, 300, 0, 0)])
+    assert query.result == 10.0
+
+def test_new_file():
+    options = server_options('--filelatency')
+    latency(options, 11000, [(5, 1, 100, 100, 0, 0)])
+    #~ Added since the last run: its lifetime counters are not divided by the 10 seconds
+    query = latency(options, 21000, [(5, 1, 200, 200, 0, 0), (6, 1, 1000, 50000, 0, 0)])
+    assert query.result == 1.0
+    assert 'read_iops=10.000;;;0;' in query.options.perfdata
+    assert 'db6' not in query.stdout
+    query = latency(options, 31000, [(5, 1, 300, 300, 0, 0), (6, 1, 1100, 50500, 0, 0)])
+    assert query.result == 5.0
+    assert '(db6/file1)' in query.stdout
+
+def test_sql_server_restart():
+    options = server_options('--filelatency')
+    latency(options, 11000, [(5, 1, 100, 500, 10, 20)])
+    #~ ms_ticks went back: the averages since the restart at 5000 ms
+    query = latency(options, 7000, [(5, 1, 10, 80, 0, 0)], start_ticks=5000)
+    assert query.result == 8.0
+    assert 'read_iops=5.000;;;0;' in query.options.perfdata
+
+def test_no_state():
+    options = server_options('--filelatency', '--no-state')
+    latency(options, 11000, [(5, 1, 100, 500, 10, 20)])
+    query = latency(options, 21000, [(5, 1, 200, 2500, 10, 20)])
+    assert query.result == 12.5
@@ -0,0 +1,44 @@
+import time
+import threading
+
+import check_mssql_fleet
+
+from conftest import CREDENTIALS
+
+def job(name, *args):
+    return check_mssql_fleet.FleetJob(name, ['-H', name] + CREDENTIALS + list(args), 'MSSQL ')
+
+def test_results_per_mode():
+    jobs = [job('db1', '--modes', 'pagelife,memory'), job('db2')]
+    assert check_mssql_fleet.run_fleet(jobs, 2, 10) == []
+    assert [(mode, code) for mode, code, _ in jobs[0].service_results()] == [('pagelife', 0), ('memory', 0)]
+    assert jobs[1].service_results()[0][0] == 'time2connect'
+
+def test_job_gives_up_within_host_timeout(monkeypatch):
+    monkeypatch.setenv('FAKE_PYMSSQL_CONNECT_MS', '10000')
+    slow = job('db1', '--modes', 'pagelife')
+    #~ Run in a thread of its own like in run_fleet
+    thread = threading.Thread(target=slow.run, args=(2,))
+    thread.start()
+    thread.join()
+    #~ The login got the login share of the host timeout, not the whole of it
+    assert slow.finish_time - slow.start_time < 2
+    assert slow.error_code == 3
+    assert 'timed out' in slow.error or 'timeout ran out' in slow.error
+    assert slow.service_results()[0][1] == 3
+
+def test_abandoned_job_keeps_its_worker(monkeypatch):
+    monkeypatch.setenv('FAKE_PYMSSQL_CONNECT_MS', '10000')
+    jobs = [job('db1'), job('db2')]
+    timed_out = check_mssql_fleet.run_fleet(jobs, 1, 0.2)
+    assert timed_out == jobs
+    #~ The second host only started once the thread of the first had ended
+    assert jobs[1].start_time >= jobs[0].finish_time
+    assert 'did not finish within the host timeout' in jobs[0].service_results(True)[0][2]
+
+def test_fast_hosts_not_held_up():
+    start = time.time()
+    jobs = [job('db%d' % i, '--modes', 'pagelife') for i in range(8)]
+    assert check_mssql_fleet.run_fleet(jobs, 2, 5) == []
+    assert time.time() - start < 5
+    assert all(j.service_results()[0][1] == 0 for j in jobs)
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+import check_mssql_database
+
+from conftest import database_options, CREDENTIALS
+
+@pytest.fixture
+def connection(monkeypatch):
+    import pymssql
+    monkeypatch.setenv('FAKE_PYMSSQL_INDEXES', '6')
+    return pymssql.connect(host='testhost', user=CREDENTIALS[1], password=CREDENTIALS[3], database='appdb001')
+
+def scan(connection, *args):
+    options = database_options('-T', 'appdb001', '--fragmentation', '--min-pages', '1', *args)
+    query = check_mssql_database.MSSQLFragmentationQuery(options=options, host='testhost',
+                                                         **check_mssql_database.MODES['fragmentation'])
+    query.run_on_connection(connection)
+    query.calculate_result()
+    return query
+
+def stored():
+    store = check_mssql_database.FragmentationStore('testhost', 'appdb001').open()
+    try:
+        return store.get('fragmentation')[1]
+    finally:
+        store.close()
+
+def test_resumes_where_last_run_stopped(connection):
+    for run in range(1, 7):
+        #~ --scan-pages 1 still scans one index per run
+        query = scan(connection, '--scan-pages', '1')
+        assert query.scanned == 1
+        assert stored()['next'] == run
+        assert len(query.scan['results']) == run
+    assert '6 of 6 indexes' in query.stdout
+
+def test_new_pass(connection):
+    query = scan(connection, '--scan-pages', '10000000')
+    assert query.scanned == 6
+    assert stored()['next'] == 6
+    #~ Every index was scanned, the next run starts over with a fresh index list
+    query = scan(connection, '--scan-pages', '1')
+    assert stored()['next'] == 1
+    assert len(query.scan['results']) == 6
+
+def test_unfinished_index_skipped(connection):
+    query = scan(connection, '--scan-pages', '1')
+    state = stored()
+    #~ As if the run had been killed while scanning the second index
+    key = '%d.%d' % tuple(state['indexes'][1][:2])
+    state['current'] = key
+    state['next'] = 2
+    store = check_mssql_database.FragmentationStore('testhost', 'appdb001').open()
+    store.set('fragmentation', time.time(), state)
+    store.close()
+    query = scan(connection, '--scan-pages', '1')
+    assert stored()['failed'] == [key]
+    assert key not in query.scan['results']
+    assert '1 failed or timed out this pass' in query.stdout
+    #~ The next pass gives it another chance
+    scan(connection, '--scan-pages', '10000000')
+    query = scan(connection, '--scan-pages', '10000000')
+    assert stored()['failed'] == []
+    assert key in query.scan['results']
@@ -0,0 +1,51 @@
+import json
+
+import check_mssql_exporter
+import check_mssql_server
+import mssql_common
+
+from conftest import run_plugin, CREDENTIALS
+
+def test_counter_patterns():
+    patterns = mssql_common.counter_patterns(['Page life expectancy', 'Log Flush Wait Time', 'Page life expectancy'],
+                                             ['Cache Hit Ratio'])
+    assert patterns == '<c>Cache Hit Ratio%</c><c>Log Flush Wait Time</c><c>Page life expectancy</c>'
+    #~ LIKE wildcards in a name match only themselves, markup is escaped for the xml
+    assert mssql_common.counter_patterns(['100%_[x] <a&b>']) == '<c>100[%][_][[]x] &lt;a&amp;b&gt;</c>'
+
+def test_batch_counters():
+    patterns = check_mssql_server.batch_counters(['bufferhitratio', 'pagelife'])
+    assert patterns == '<c>Buffer cache hit ratio%</c><c>Page life expectancy</c>'
+
+def prepared_plans(filename):
+    return dict([(plan, uses) for plan, uses in json.load(open(filename)).items() if plan.startswith('Prepared:')])
+
+def test_one_plan_for_every_mode_set(scratch, monkeypatch):
+    plans = str(scratch / 'plans.json')
+    monkeypatch.setenv('FAKE_PYMSSQL_PLAN_CACHE', plans)
+    for modes in ('pagelife,bufferhitratio', 'cachehit,deadlocks,freepages', 'averagewait'):
+        code, output = run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--modes', modes]))
+        assert code == 0, output
+    batches = [(plan, uses) for plan, uses in prepared_plans(plans).items() if 'FROM sysperfinfo WHERE' in plan]
+    assert len(batches) == 1
+    plan, uses = batches[0]
+    assert uses == 3
+    assert '@counters xml' in plan
+    assert 'Page life expectancy' not in plan
+
+def test_probe_finds_counters():
+    code, output = run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--test']))
+    assert code == 0, output
+    assert 'not supported' not in output
+    code, output = run_plugin('check_mssql_database.py', '-H', 'testhost', *(CREDENTIALS + ['-T', 'appdb001', '--test']))
+    assert code == 0, output
+    assert '10/10 modes supported' in output
+
+def test_exporter_counters():
+    options = check_mssql_exporter.parse_args(['-H', 'testhost'] + CREDENTIALS)
+    text = check_mssql_exporter.Collector(options, 15).collect()
+    assert 'mssql_buffer_page_life_expectancy_seconds 3600.0' in text
+    assert 'mssql_database_active_transactions{database="appdb001"} 8.0' in text
+    #~ Only the database counters of the :Databases object, not their _Total
+    assert '_Total' not in text
+    assert 'mssql_up 1' in text
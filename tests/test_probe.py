@@ -0,0 +1,47 @@
+import json
+
+import mssql_common
+
+from conftest import run_plugin, CREDENTIALS
+
+def probe(script, *args):
+    code, output = run_plugin(script, '-H', 'testhost', *(CREDENTIALS + list(args) + ['--test']))
+    lines = output.strip().split('\n')
+    return code, lines[0], dict([line.split(': ', 1) for line in lines[1:]])
+
+def test_counter_latency_reported_once():
+    code, summary, modes = probe('check_mssql_server.py')
+    assert code == 0
+    assert 'counters probed in' in summary
+    assert '|probe=' in summary
+    #~ The counter modes share the one query, the DMV modes were timed each
+    assert modes['pagelife'] == 'supported'
+    assert modes['batchreq'] == 'supported'
+    assert modes['cpu'].startswith('supported, ') and modes['cpu'].endswith('ms')
+    assert modes['waitstats'].startswith('supported, ')
+
+def test_capability_map(scratch):
+    probe('check_mssql_server.py')
+    capabilities = json.load(open(mssql_common.host_filename('testhost', 'capabilities')))
+    assert capabilities['modes']['pagelife'] is True
+    assert isinstance(capabilities['modes']['memory'], float)
+    assert 'time2connect' not in capabilities['modes']
+
+def test_missing_counter(monkeypatch):
+    monkeypatch.setenv('FAKE_PYMSSQL_MISSING', 'Page life expectancy')
+    code, summary, modes = probe('check_mssql_server.py')
+    assert code == 1
+    assert modes['pagelife'] == 'not supported'
+    #~ Later checks of the mode fail before the login
+    monkeypatch.setenv('FAKE_PYMSSQL_DOWN_HOSTS', 'testhost')
+    code, output = run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--pagelife']))
+    assert code == 3
+    assert 'not supported by testhost according to the last --test probe' in output
+
+def test_database_probe(monkeypatch):
+    monkeypatch.setenv('FAKE_PYMSSQL_MISSING', 'Log Cache Hit Ratio Base')
+    code, summary, modes = probe('check_mssql_database.py', '-T', 'appdb001')
+    assert code == 1
+    assert '9/10 modes supported by testhost database appdb001' in summary
+    assert modes['logcachehit'] == 'not supported'
+    assert modes['logfileusage'] == 'supported'
@@ -0,0 +1,38 @@
+import pytest
+
+import mssql_common
+
+@pytest.mark.parametrize('nagstring, value, alert', [
+    ('10', 0, False),
+    ('10', 10, False),
+    ('10', 10.1, True),
+    ('10', -1, True),
+    ('10:', 9.9, True),
+    ('10:', 1e9, False),
+    ('~:10', -1e9, False),
+    ('~:10', 11, True),
+    ('10:20', 9, True),
+    ('10:20', 15, False),
+    ('10:20', 21, True),
+    ('@10:20', 15, True),
+    ('@10:20', 10, True),
+    ('@10:20', 21, False),
+    ('1.5:2.5', 2.0, False),
+    ('1.5:2.5', 2.6, True),
+    ('-5:-1', -3, False),
+    ('-5:-1', 0, True),
+    ('.5', 0.6, True),
+])
+def test_range_alert(nagstring, value, alert):
+    assert mssql_common.NagiosRange(nagstring).alert(value) == alert
+    assert mssql_common.NagiosRange(nagstring).alerts([value]) == [alert]
+
+@pytest.mark.parametrize('nagstring', ['', ':', '@', 'abc', '10:20:30', '1,2'])
+def test_range_rejected(nagstring):
+    with pytest.raises(Exception):
+        mssql_common.NagiosRange(nagstring)
+
+def test_range_cached():
+    mssql_common.RANGES.clear()
+    assert mssql_common.parse_range('300:') is mssql_common.parse_range('300:')
+    assert list(mssql_common.RANGES) == ['300:']
@@ -0,0 +1,52 @@
+import re
+
+import check_mssql_server
+import mssql_common
+
+from conftest import server_options, run_plugin, CREDENTIALS
+
+def test_server_rate_between_samples():
+    #~ 500 more in 10 seconds of server clock
+    assert mssql_common.server_rate(1500, 20000, 1000, [1000, 10000]) == 50.0
+
+def test_server_rate_first_run():
+    #~ No previous sample: the average over the 10 seconds since start-up
+    assert mssql_common.server_rate(1000, 11000, 1000) == 100.0
+    assert mssql_common.server_rate(1000, 1000, 1000) is None
+
+def test_server_rate_after_restart():
+    #~ The previous sample is from before the last start-up, or the counter went back
+    assert mssql_common.server_rate(100, 6000, 5000, [5000, 90000]) == 100.0
+    assert mssql_common.server_rate(100, 6000, 1000, [5000, 3000]) == 20.0
+
+def delta(options, value, ms_ticks, start_ticks=1000):
+    query = check_mssql_server.make_query('batchreq', options, 'testhost')
+    query.query_result, query.ms_ticks, query.start_ticks = value, ms_ticks, start_ticks
+    query.calculate_result()
+    return query.result
+
+def test_server_time_keeps_state():
+    options = server_options('--batchreq', '--server-time')
+    assert delta(options, 1000, 11000) == 100.0
+    assert delta(options, 1600, 13000) == 300.0
+
+def test_no_state():
+    options = server_options('--batchreq', '--no-state')
+    assert options.server_time
+    assert delta(options, 1000, 11000) == 100.0
+    #~ Always since start-up, nothing was stored
+    assert delta(options, 1600, 13000) == 1600 / 12.0
+
+def rate(*args):
+    code, output = run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--batchreq'] + list(args)))
+    assert code == 0, output
+    return output
+
+def test_local_clock_first_run():
+    #~ Without --server-time the first run has nothing to compare with
+    assert 'batch_requests=None' in rate()
+    assert re.search(r'batch_requests=[\d.]+;', rate())
+
+def test_server_time_first_run():
+    assert re.search(r'batch_requests=[\d.]+;', rate('--server-time'))
+    assert re.search(r'batch_requests=[\d.]+;', rate('--no-state'))
@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from conftest import run_plugin, CREDENTIALS
+
+@pytest.mark.parametrize('script, args', [
+    ('check_mssql_server.py', ['--batchreq', '-w', '5000', '-c', '10000']),
+    ('check_mssql_server.py', ['--modes', 'all']),
+    ('check_mssql_server.py', ['--waitstats']),
+    ('check_mssql_server.py', ['--filelatency']),
+    ('check_mssql_database.py', ['-T', 'appdb001', '--transpsec']),
+    ('check_mssql.py', ['--modes', 'pagelife', '--all-databases', '--database-modes', 'logfileusage']),
+])
+def test_round_trip(scratch, script, args):
+    capture = str(scratch / 'capture.jsonl')
+    outputs = []
+    for _ in range(3):
+        code, output = run_plugin(script, '-H', 'testhost', *(CREDENTIALS + args + ['--record', capture]))
+        outputs.append((code, output.strip().split('\n')[0]))
+    runs = [json.loads(line) for line in open(capture)]
+    assert [(run['code'], run['output'].split('\n')[0]) for run in runs] == outputs
+    #~ The password stays out of the capture
+    assert CREDENTIALS[3] not in [arg for run in runs for arg in run['args']]
+    code, output = run_plugin('check_mssql_replay.py', '-f', capture, '--summary')
+    assert code == 0, output
+    assert '3 runs replayed' in output
+    assert '0 changed state' in output
+
+def test_replay_with_new_thresholds(scratch):
+    capture = str(scratch / 'capture.jsonl')
+    run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--pagelife', '--record', capture]))
+    code, output = run_plugin('check_mssql_replay.py', '-f', capture, '--args', '-w 1000000000:', '--changed')
+    assert code == 1
+    assert 'OK->WARNING' in output
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+import check_mssql_server
+import mssql_common
+
+from conftest import server_options, CREDENTIALS
+
+@pytest.fixture
+def connection():
+    import pymssql
+    return pymssql.connect(host='testhost', user=CREDENTIALS[1], password=CREDENTIALS[3])
+
+def cpu(connection, *args):
+    options = server_options('--cpu', *args)
+    options.perfdata = None
+    query = check_mssql_server.make_query('cpu', options, 'testhost')
+    query.run_on_connection(connection)
+    query.calculate_result()
+    return query
+
+def stored():
+    store = mssql_common.StateStore('testhost').open()
+    try:
+        return store.get(mssql_common.state_key('testhost', 'ringbuffer', 'cpu'))[1]
+    finally:
+        store.close()
+
+def store_window(window):
+    store = mssql_common.StateStore('testhost').open()
+    store.set(mssql_common.state_key('testhost', 'ringbuffer', 'cpu'), time.time(), window)
+    store.close()
+
+def test_first_run_reads_the_window(connection):
+    query = cpu(connection)
+    samples = check_mssql_server.CPU_WINDOW // 60000
+    assert len(query.query_result) == samples
+    assert stored()[-1] == samples
+    assert stored()[0] == max(row[0] for row in query.query_result)
+
+def test_only_newer_records(connection):
+    first = cpu(connection)
+    latest = stored()
+    #~ Nothing newer was written since: the last window is repeated
+    query = cpu(connection)
+    assert query.query_result == []
+    assert query.result == first.result
+    assert stored() == latest
+    #~ A run two records back reads just those two
+    store_window([latest[0] - 120000] + latest[1:])
+    query = cpu(connection)
+    assert len(query.query_result) == 2
+    assert stored()[-1] == 2
+
+def test_after_reboot(connection):
+    cpu(connection)
+    #~ The stored timestamp is ahead of ms_ticks, as after a reboot
+    store_window([10 ** 12, 50, 50.0, 50, 50, 50.0, 1])
+    query = cpu(connection)
+    assert len(query.query_result) == check_mssql_server.CPU_WINDOW // 60000
+    assert stored()[0] < 10 ** 12
+
+def test_no_state(connection):
+    cpu(connection)
+    query = cpu(connection, '--no-state')
+    #~ Never reads the last window, always the whole one
+    assert len(query.query_result) == check_mssql_server.CPU_WINDOW // 60000
+    assert 'system idle' in query.stdout
@@ -0,0 +1,32 @@
+import re
+
+from conftest import run_plugin, CREDENTIALS
+
+def connections(*args):
+    code, output = run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--connections'] + list(args)))
+    perfdata = dict(re.findall(r'(\w+)=([\d.]+)', output.split('|')[1]))
+    return code, output, perfdata
+
+def test_total_same_with_and_without_group_by(monkeypatch):
+    monkeypatch.setenv('FAKE_PYMSSQL_SESSIONS', '50')
+    code, output, perfdata = connections()
+    assert code == 0
+    assert float(perfdata['connections']) == 51
+    code, output, perfdata = connections('--group-by', 'login')
+    assert int(perfdata['connections']) == 51
+    assert int(perfdata['largest_group']) == 50
+    assert 'login=app_user 50' in output
+
+def test_thresholds_on_largest_group():
+    code, output, perfdata = connections('--group-by', 'host', '-w', '50', '-c', '90')
+    #~ web01 holds the leaked pooled connections
+    assert code == 2
+    assert '(host=web01)' in output
+    assert int(perfdata['connection_groups']) == 6
+
+def test_top_groups():
+    code, output, perfdata = connections('--group-by', 'host,program', '--top', '2')
+    assert code == 0
+    assert len(output.split('top: ')[1].split('|')[0].split(', ')) == 2
+    #~ The totals still cover every group
+    assert int(perfdata['connections']) == 201
@@ -0,0 +1,65 @@
+import json
+import os
+
+import check_mssql_server
+
+from conftest import run_plugin, server_options, CREDENTIALS
+
+def check(*args):
+    return run_plugin('check_mssql_server.py', '-H', 'testhost', *(list(args) or CREDENTIALS) +
+                      ['--pagelife', '--snapshot-ttl', '60'])
+
+def snapshot_file(*args):
+    return check_mssql_server.SnapshotStore('testhost', server_options(*args)).filename
+
+def test_second_check_within_the_ttl(monkeypatch):
+    code, output = check()
+    assert code == 0, output
+    assert os.path.exists(snapshot_file())
+    #~ Answered from the snapshot, the host is not logged in to again
+    monkeypatch.setenv('FAKE_PYMSSQL_DOWN_HOSTS', 'testhost')
+    code, output = check()
+    assert code == 0, output
+    assert output.startswith('OK: Page Life Expectancy is 3600.0')
+
+def test_expired_snapshot_fetched_again(monkeypatch):
+    code, output = check()
+    assert code == 0, output
+    filename = snapshot_file()
+    snapshot = json.load(open(filename))
+    snapshot['time'] -= 61
+    json.dump(snapshot, open(filename, 'w'))
+    monkeypatch.setenv('FAKE_PYMSSQL_DOWN_HOSTS', 'testhost')
+    code, output = check()
+    assert code != 0
+    assert 'Unable to connect' in output
+
+def test_damaged_snapshot_fetched_again(monkeypatch):
+    code, output = check()
+    assert code == 0, output
+    open(snapshot_file(), 'w').write('{"time": ')
+    monkeypatch.setenv('FAKE_PYMSSQL_QUERY_LOG', os.path.join(os.path.dirname(snapshot_file()), 'queries.log'))
+    code, output = check()
+    assert code == 0, output
+    assert 'FROM sysperfinfo' in open(os.environ['FAKE_PYMSSQL_QUERY_LOG']).read()
+
+def test_other_credentials_not_answered(monkeypatch):
+    monkeypatch.setenv('FAKE_PYMSSQL_PASSWORD', 'secret')
+    code, output = check()
+    assert code == 0, output
+    #~ The HMAC of other credentials names another file, a wrong password still has to log in
+    assert snapshot_file('-P', 'wrong') != snapshot_file()
+    code, output = check('-U', 'monitor', '-P', 'wrong')
+    assert code != 0
+    assert 'Login failed' in output
+
+def test_new_secret_not_answered(monkeypatch):
+    code, output = check()
+    assert code == 0, output
+    filename = snapshot_file()
+    #~ Without the key the snapshot was written under, its file is not found again
+    os.remove(os.path.join(os.path.dirname(filename), 'mssql-snapshot.key'))
+    assert snapshot_file() != filename
+    monkeypatch.setenv('FAKE_PYMSSQL_DOWN_HOSTS', 'testhost')
+    code, output = check()
+    assert code != 0
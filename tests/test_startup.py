@@ -0,0 +1,29 @@
+import mssql_common
+
+from conftest import server_options, run_plugin, CREDENTIALS
+
+def test_over_budget():
+    options = server_options('--startup-budget', '0.5')
+    options.startup = 0.75
+    e = mssql_common.startup_result(options, mssql_common.NagiosReturn('OK: Time to connect was 0.1s|time=0.1s;;;;', 0))
+    assert e.code == 1
+    assert e.message == 'WARNING: Time to connect was 0.1s, start-up took 0.75s of a 0.5s budget|time=0.1s;;;;'
+
+def test_within_budget_or_not_ok():
+    options = server_options('--startup-budget', '1')
+    options.startup = 0.75
+    ok = mssql_common.NagiosReturn('OK: fine|x=1;;;;', 0)
+    assert mssql_common.startup_result(options, ok) is ok
+    options.startup = 2
+    critical = mssql_common.NagiosReturn('CRITICAL: bad|x=1;;;;', 2)
+    assert mssql_common.startup_result(options, critical) is critical
+
+def test_budget_without_startup_time():
+    #~ A budget no start-up can meet, measured without --startup-time and its perfdata
+    code, output = run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--startup-budget', '0.000001']))
+    assert code == 1
+    assert 'start-up took' in output
+    assert 'startup=' not in output
+    code, output = run_plugin('check_mssql_server.py', '-H', 'testhost', *(CREDENTIALS + ['--startup-time']))
+    assert code == 0
+    assert 'startup=' in output
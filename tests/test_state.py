@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+
+import pytest
+
+import mssql_common
+
+def store(**kwargs):
+    return mssql_common.StateStore('testhost', **kwargs).open()
+
+def test_round_trip():
+    state = store()
+    state.set('a', time.time(), [1, 2])
+    state.close()
+    assert store().get('a')[1] == [1, 2]
+
+def test_nothing_written_without_changes():
+    state = store()
+    state.get('a')
+    state.close()
+    assert not os.path.exists(state.filename)
+
+def test_old_entries_evicted():
+    state = store(max_age=60)
+    state.set('old', time.time() - 61, 1)
+    state.set('new', time.time(), 2)
+    state.close()
+    state = store(max_age=60)
+    assert state.get('old') is None
+    assert state.get('new')[1] == 2
+    state.close()
+
+def test_unreadable_file_starts_over():
+    state = store()
+    open(state.filename, 'w').write('{not json')
+    state.load()
+    assert state.entries == {}
+    state.close()
+
+def test_no_lost_updates():
+    #~ Every thread increments the same counter under the lock
+    def increment():
+        for _ in range(20):
+            state = store()
+            last = state.get('count')
+            state.set('count', time.time(), (last and last[1] or 0) + 1)
+            state.close()
+    threads = [threading.Thread(target=increment) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store().get('count')[1] == 100
+
+def test_lock_wait_ends_with_deadline():
+    holder = store()
+    try:
+        start = time.time()
+        with pytest.raises(mssql_common.NagiosReturn) as e:
+            store(deadline=mssql_common.Deadline(0.2))
+        assert e.value.code == 3
+        assert 'during state file lock' in e.value.message
+        assert time.time() - start < 1
+    finally:
+        holder.close()
+    #~ Released, the next check gets the lock at once
+    store(deadline=mssql_common.Deadline(0.2)).close()
@@ -0,0 +1,40 @@
+import re
+
+from conftest import run_plugin, CREDENTIALS
+
+def sweep(*args):
+    code, output = run_plugin('check_mssql_database.py', '-H', 'testhost', *(CREDENTIALS + ['--all-databases'] + list(args)))
+    return code, output, sorted(re.findall(r"(\w+)_log_file_usage=", output))
+
+def test_every_database():
+    code, output, databases = sweep('--logfileusage')
+    assert code == 0
+    assert 'All 8 databases OK' in output
+    assert databases == ['appdb000', 'appdb001', 'appdb002', 'appdb003', 'master', 'model', 'msdb', 'tempdb']
+
+def test_include_and_exclude():
+    code, output, databases = sweep('--logfileusage', '--include', '^appdb', '--exclude', '00[23]$')
+    assert databases == ['appdb000', 'appdb001']
+    assert 'All 2 databases OK' in output
+
+def test_problems_listed_worst_first():
+    code, output, databases = sweep('--logfileusage', '-w', '39', '-c', '41')
+    assert code == 2
+    assert len(databases) == 8
+    summary = output.split('|')[0]
+    assert summary.startswith('CRITICAL: 3 of 8 databases not OK: appdb003')
+    #~ Then the WARNING ones by name
+    assert summary.endswith('appdb001 Log File Usage is 40.0% (WARNING), appdb002 Log File Usage is 41.0% (WARNING)')
+
+def test_ratio_per_database():
+    code, output = run_plugin('check_mssql_database.py', '-H', 'testhost',
+                              *(CREDENTIALS + ['--all-databases', '--logcachehit', '--include', 'appdb001']))
+    assert code == 0
+    assert re.search(r'appdb001_log_cache_hit_ratio=6[\d.]+%', output)
+
+def test_rates_kept_per_database():
+    sweep('--transpsec')
+    code, output = run_plugin('check_mssql_database.py', '-H', 'testhost',
+                              *(CREDENTIALS + ['--all-databases', '--transpsec']))
+    assert code == 0
+    assert len(re.findall(r'\w+_transactions_per_sec=[\d.]+', output)) == 8
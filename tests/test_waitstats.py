@@ -0,0 +1,60 @@
+import check_mssql_server
+
+from conftest import server_options
+
+def wait_rows(ms_ticks, waits, start_ticks=1000):
+    #~ Rows of WAIT_QUERY from (wait_type, wait_time_ms, signal_wait_time_ms)
+    return [(ms_ticks, start_ticks, wait_type, wait, signal) for wait_type, wait, signal in waits]
+
+def waitstats(options, ms_ticks, waits, start_ticks=1000):
+    options.perfdata = None
+    query = check_mssql_server.make_query('waitstats', options, 'testhost')
+    query.query_result = wait_rows(ms_ticks, waits, start_ticks)
+    query.calculate_result()
+    return query
+
+def perfdata(query, name):
+    return [p for p in query.options.perfdata if p.startswith(name + '=')][0]
+
+def test_categories():
+    assert check_mssql_server.wait_category('LCK_M_X') == 'lock'
+    assert check_mssql_server.wait_category('PAGEIOLATCH_SH') == 'bufferio'
+    assert check_mssql_server.wait_category('WRITELOG') == 'tranlogio'
+    assert check_mssql_server.wait_category('SOMETHING_NEW') == 'other'
+
+def test_first_run_since_start():
+    query = waitstats(server_options('--waitstats'), 11000, [('LCK_M_X', 1000, 10), ('WRITELOG', 500, 50)])
+    #~ 10 seconds since SQL Server started
+    assert query.result == 150.0
+    assert perfdata(query, 'wait_lock') == 'wait_lock=100.000ms;;;0;'
+
+def test_delta_between_runs():
+    options = server_options('--waitstats')
+    waitstats(options, 11000, [('LCK_M_X', 1000, 10), ('WRITELOG', 500, 50)])
+    query = waitstats(options, 21000, [('LCK_M_X', 1000, 10), ('WRITELOG', 2500, 250), ('CXPACKET', 100, 0)])
+    #~ The lock waits did not grow; a wait type new since the last run counts in full
+    assert query.result == 210.0
+    assert perfdata(query, 'wait_lock') == 'wait_lock=0.000ms;;;0;'
+    assert perfdata(query, 'wait_tranlogio') == 'wait_tranlogio=200.000ms;;;0;'
+    assert perfdata(query, 'wait_parallelism') == 'wait_parallelism=10.000ms;;;0;'
+    assert 'top: WRITELOG 200.0 ms/sec (10%% signal)' in query.stdout
+
+def test_benign_waits_left_out():
+    query = waitstats(server_options('--waitstats'), 11000, [('SLEEP_TASK', 100000, 0), ('LCK_M_S', 100, 0)])
+    assert query.result == 10.0
+    assert 'SLEEP_TASK' not in query.stdout
+
+def test_statistics_cleared():
+    options = server_options('--waitstats')
+    waitstats(options, 11000, [('LCK_M_X', 1000, 10)])
+    #~ DBCC SQLPERF cleared them: the averages since start-up instead of a negative rate
+    query = waitstats(options, 21000, [('LCK_M_X', 400, 0)])
+    assert query.result == 20.0
+
+def test_category_thresholds():
+    options = server_options('--waitstats', '--category-warning', 'lock=50', '--category-critical', 'tranlogio=40')
+    query = waitstats(options, 11000, [('LCK_M_X', 1000, 10), ('WRITELOG', 500, 50)])
+    assert query.category_code == 2
+    assert 'lock waits 100.0 ms/sec (WARNING)' in query.stdout
+    assert 'tranlogio waits 50.0 ms/sec (CRITICAL)' in query.stdout
+    assert perfdata(query, 'wait_lock') == 'wait_lock=100.000ms;50;;0;'